@@ -0,0 +1,492 @@
+"""Load-generation benchmark for the user service
+
+Starts the service, drives its routes at a fixed concurrency and saves the
+latency percentiles, throughput and memory use as JSON so results from two
+commits can be compared.
+
+    # run app.py as a subprocess in threaded mode
+    python bench/user_service_bench.py run --server-mode threaded --output before.json
+
+    # run app.py in-process against a MockSSM parameter store
+    python bench/user_service_bench.py run --in-process --server-mode asyncio --output after.json
+
+    # exit non-zero if after.json regressed more than 10% against before.json
+    python bench/user_service_bench.py compare before.json after.json --threshold 0.1
+
+The load generator is a pool of client threads in this process, so for
+in-process runs the clients and the server share one interpreter. Use the
+subprocess mode for numbers that reflect a deployed task.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.client import HTTPConnection, HTTPException
+
+# Paths the benchmark needs to import app.py and the test stand-ins
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(REPO_DIR, "src")
+
+# The routes which can be benchmarked
+SCENARIOS = ("hit", "miss", "batch")
+# Connection handling of the clients
+CONNECTION_MODES = ("keep-alive", "close")
+# Ids requested in every batch request
+BATCH_SIZE = 20
+# Settings used unless overridden with --setting, per-request logging is
+# sampled out so the benchmark doesn't measure the terminal
+DEFAULT_SETTINGS = {
+    "log/sample-rate": "0.0"
+}
+
+
+def write_users_file(path:str, count:int) -> None:
+    """Writes count generated users as newline delimited JSON"""
+    with open(path, "w", encoding="utf-8") as users_file:
+        for i in range(count):
+            users_file.write(json.dumps({
+                "id": str(i),
+                "first_name": "First{}".format(i % 1000),
+                "last_name": "Last{}".format(i % 5000),
+                "username": "user{}".format(i),
+                "icon": "default.png"
+            }) + "\n")
+
+
+def setting_to_env(name:str) -> str:
+    """Converts a setting name to its environment variable, like AppConfig._get_setting"""
+    return name.upper().replace("-", "_").replace(".", "_").replace("/", "_")
+
+
+def free_port() -> int:
+    """Returns a TCP port which is free on localhost"""
+    with socket.socket() as _sock:
+        _sock.bind(("127.0.0.1", 0))
+        return _sock.getsockname()[1]
+
+
+def wait_for_port(port:int, timeout:float=30) -> None:
+    """Waits until something accepts connections on port
+
+    Raises:
+        RuntimeError: if nothing is listening before timeout
+    """
+    _deadline = time.time() + timeout
+    while time.time() < _deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("The user service didn't listen on port {}".format(port))
+
+
+def _read_proc_kib(pid:int, field:str) -> int:
+    """Returns a kB field of /proc/<pid>/status in bytes, or 0"""
+    try:
+        with open("/proc/{}/status".format(pid)) as status_file:
+            for line in status_file:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _child_pids(pid:int) -> list:
+    try:
+        with open("/proc/{}/task/{}/children".format(pid, pid)) as children_file:
+            return [int(child) for child in children_file.read().split()]
+    except OSError:
+        return []
+
+
+class SubprocessServer:
+    """SubprocessServer runs app.py in local mode as a child process"""
+    def __init__(self, port:int, app_args:list, settings:dict) -> None:
+        self.port = port
+        _env = dict(os.environ)
+        for name, value in settings.items():
+            _env[setting_to_env(name)] = value
+
+        self._log = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            [sys.executable, "app.py", "-l", "127.0.0.1", "-p", str(port)] + app_args,
+            cwd=SRC_DIR, env=_env, stdout=self._log, stderr=subprocess.STDOUT
+        )
+        try:
+            wait_for_port(port)
+        except RuntimeError:
+            self.stop()
+            raise
+
+    def memory(self) -> dict:
+        """Returns the resident memory of the server and its workers"""
+        _pids = [self._process.pid] + _child_pids(self._process.pid)
+        return {
+            "rss_bytes": sum(_read_proc_kib(pid, "VmRSS") for pid in _pids),
+            "peak_rss_bytes": sum(_read_proc_kib(pid, "VmHWM") for pid in _pids)
+        }
+
+    def stop(self) -> None:
+        self._process.terminate()
+        try:
+            self._process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._log.close()
+
+
+class InProcessServer:
+    """InProcessServer runs app.Application on a thread, reading its settings
+    from a MockSSM parameter store"""
+    def __init__(self, port:int, app_args:list, settings:dict) -> None:
+        for path in (REPO_DIR, SRC_DIR):
+            if path not in sys.path:
+                sys.path.insert(0, path)
+
+        import app
+        from libs.parameters import AWSParameter
+        from test.mock_boto import MockSSM
+
+        if "prefork" in app_args:
+            raise ValueError("The prefork server mode can't run in-process, use a subprocess")
+
+        _values = {"/user-service/{}".format(name): value for name, value in settings.items()}
+        # the benchmark doesn't need the configuration to change under it
+        _values.setdefault("/user-service/config/refresh-interval", "0")
+
+        self.port = port
+        _args = app.get_arguments(["-l", "127.0.0.1", "-p", str(port)] + app_args)
+        self._application = app.Application(_args, parameter_client=AWSParameter(MockSSM(_values)))
+        self._application.start()
+        self._thread = threading.Thread(target=self._application.serve_forever, daemon=True)
+        self._thread.start()
+        wait_for_port(port)
+
+    def memory(self) -> dict:
+        """Returns the memory of this process, which includes the clients"""
+        _peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return {
+            "rss_bytes": _read_proc_kib(os.getpid(), "VmRSS") or _peak,
+            "peak_rss_bytes": _peak
+        }
+
+    def stop(self) -> None:
+        self._application.webserver.shutdown()
+        self._thread.join()
+        self._application.close()
+
+
+def _path_generator(scenario:str, users:int, seed:int):
+    """Returns a callable producing request paths for a scenario"""
+    _random = random.Random(seed)
+
+    if scenario == "hit":
+        return lambda: "/user/{}".format(_random.randrange(users))
+    if scenario == "miss":
+        return lambda: "/user/{}".format(users + _random.randrange(users))
+    if scenario == "batch":
+        return lambda: "/users?ids={}".format(
+            ",".join(str(_random.randrange(users)) for _ in range(BATCH_SIZE)))
+    raise ValueError("Unknown scenario: {}".format(scenario))
+
+
+# The response code each scenario expects
+EXPECTED_STATUS = {"hit": 200, "miss": 404, "batch": 200}
+
+
+def _client(port:int, next_path, expected_status:int, keep_alive:bool,
+            deadline:float, latencies:list, errors:list) -> None:
+    """Sends requests until deadline, recording latencies and errors"""
+    _conn = None
+    _headers = {} if keep_alive else {"Connection": "close"}
+    _errors = 0
+
+    while time.perf_counter() < deadline:
+        if _conn is None:
+            _conn = HTTPConnection("127.0.0.1", port, timeout=10)
+
+        _start = time.perf_counter()
+        try:
+            _conn.request("GET", next_path(), headers=_headers)
+            _response = _conn.getresponse()
+            _response.read()
+        except (OSError, HTTPException):
+            _errors += 1
+            _conn.close()
+            _conn = None
+            continue
+
+        latencies.append(time.perf_counter() - _start)
+        if _response.status != expected_status:
+            _errors += 1
+        if not keep_alive or _response.will_close:
+            _conn.close()
+            _conn = None
+
+    if _conn is not None:
+        _conn.close()
+    errors.append(_errors)
+
+
+def percentile(sorted_values:list, fraction:float) -> float:
+    """Returns the nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    _index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[_index]
+
+
+def run_scenario(port:int, scenario:str, users:int, concurrency:int,
+                 duration:float, keep_alive:bool) -> dict:
+    """Drives one scenario and summarizes the latencies
+
+    Returns:
+        dict: requests, errors, requests per second and latency percentiles in ms
+    """
+    _latencies = [[] for _ in range(concurrency)]
+    _errors = []
+    _start = time.perf_counter()
+    _deadline = _start + duration
+
+    _threads = [
+        threading.Thread(target=_client, args=(port, _path_generator(scenario, users, seed),
+                                               EXPECTED_STATUS[scenario], keep_alive,
+                                               _deadline, _latencies[seed], _errors))
+        for seed in range(concurrency)
+    ]
+    for _thread in _threads:
+        _thread.start()
+    for _thread in _threads:
+        _thread.join()
+    _elapsed = time.perf_counter() - _start
+
+    _all = sorted(latency for thread_latencies in _latencies for latency in thread_latencies)
+    return {
+        "requests": len(_all),
+        "errors": sum(_errors),
+        "requests_per_second": round(len(_all) / _elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(_all, 0.50) * 1000, 3),
+            "p95": round(percentile(_all, 0.95) * 1000, 3),
+            "p99": round(percentile(_all, 0.99) * 1000, 3),
+            "max": round((_all[-1] if _all else 0.0) * 1000, 3),
+            "mean": round((sum(_all) / len(_all) if _all else 0.0) * 1000, 3)
+        }
+    }
+
+
+def git_commit() -> str:
+    """Returns the commit being benchmarked, or None outside a git checkout"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args:argparse.Namespace) -> dict:
+    """Starts the service, runs every scenario and returns the results"""
+    _settings = dict(DEFAULT_SETTINGS)
+    for _setting in args.setting:
+        _name, _, _value = _setting.partition("=")
+        _settings[_name] = _value
+
+    _app_args = []
+    if args.server_mode:
+        _app_args += ["--server-mode", args.server_mode]
+    if args.threads is not None:
+        _app_args += ["--threads", str(args.threads)]
+    if args.processes is not None:
+        _app_args += ["--processes", str(args.processes)]
+
+    _connection_modes = CONNECTION_MODES if args.connection == "both" else (args.connection,)
+    _results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "in_process": args.in_process,
+            "app_args": _app_args,
+            "settings": _settings,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup
+        },
+        "scenarios": {}
+    }
+
+    with tempfile.TemporaryDirectory() as _dir:
+        _users_file = os.path.join(_dir, "users.ndjson")
+        write_users_file(_users_file, args.users)
+        _app_args += ["--users-backend", "memory", "--users-source", _users_file]
+
+        _server_class = InProcessServer if args.in_process else SubprocessServer
+        _server = _server_class(free_port(), _app_args, _settings)
+        try:
+            _results["server"] = {"after_start": _server.memory()}
+            for _scenario in args.scenario or SCENARIOS:
+                for _connection in _connection_modes:
+                    _keep_alive = _connection == "keep-alive"
+                    if args.warmup > 0:
+                        run_scenario(_server.port, _scenario, args.users, args.concurrency,
+                                     args.warmup, _keep_alive)
+
+                    _name = "{}-{}".format(_scenario, _connection)
+                    _result = run_scenario(_server.port, _scenario, args.users,
+                                           args.concurrency, args.duration, _keep_alive)
+                    _results["scenarios"][_name] = _result
+                    print("{:<20} {:>10.1f} req/s  p50 {:>8.3f}ms  p95 {:>8.3f}ms  p99 {:>8.3f}ms  errors {}".format(
+                        _name, _result["requests_per_second"], _result["latency_ms"]["p50"],
+                        _result["latency_ms"]["p95"], _result["latency_ms"]["p99"], _result["errors"]))
+            _results["server"]["after_load"] = _server.memory()
+        finally:
+            _server.stop()
+
+    return _results
+
+
+def compare_results(baseline:dict, current:dict, threshold:float) -> list:
+    """Compares two result files
+
+    Args:
+        baseline (dict): results of the reference commit
+        current (dict): results of the commit under test
+        threshold (float): allowed relative regression, 0.1 is 10%
+
+    Returns:
+        list: a description of each regression
+    """
+    _regressions = []
+
+    for _name, _current in sorted(current.get("scenarios", {}).items()):
+        _baseline = baseline.get("scenarios", {}).get(_name)
+        if _baseline is None:
+            continue
+
+        _old_rps = _baseline["requests_per_second"]
+        _new_rps = _current["requests_per_second"]
+        if _old_rps > 0 and _new_rps < _old_rps * (1 - threshold):
+            _regressions.append("{}: requests/sec fell from {} to {}".format(_name, _old_rps, _new_rps))
+
+        for _percentile in ("p50", "p99"):
+            _old = _baseline["latency_ms"][_percentile]
+            _new = _current["latency_ms"][_percentile]
+            if _old > 0 and _new > _old * (1 + threshold):
+                _regressions.append("{}: {} rose from {}ms to {}ms".format(_name, _percentile, _old, _new))
+
+        if _current["errors"] > _baseline["errors"]:
+            _regressions.append("{}: errors rose from {} to {}".format(
+                _name, _baseline["errors"], _current["errors"]))
+
+    return _regressions
+
+
+def get_arguments(argv:list=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the user service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmark")
+    run_parser.add_argument('--in-process',
+                            action='store_true',
+                            help="Run app.py in this process against a MockSSM parameter store")
+    run_parser.add_argument('--server-mode',
+                            action="store",
+                            default=None,
+                            help="Server mode passed to app.py")
+    run_parser.add_argument('--threads',
+                            action="store",
+                            type=int,
+                            default=None,
+                            help="Worker threads passed to app.py")
+    run_parser.add_argument('--processes',
+                            action="store",
+                            type=int,
+                            default=None,
+                            help="Worker processes passed to app.py")
+    run_parser.add_argument('--setting',
+                            action="append",
+                            default=[],
+                            help="A name=value setting for the service, may be repeated")
+    run_parser.add_argument('--scenario',
+                            action="append",
+                            choices=SCENARIOS,
+                            help="Scenario to run, may be repeated. Defaults to all")
+    run_parser.add_argument('--connection',
+                            action="store",
+                            choices=CONNECTION_MODES + ("both",),
+                            default="both",
+                            help="Reuse connections (keep-alive), open one per request (close) or both")
+    run_parser.add_argument('--users',
+                            action="store",
+                            type=int,
+                            default=100000,
+                            help="Number of generated users to load")
+    run_parser.add_argument('-c', '--concurrency',
+                            action="store",
+                            type=int,
+                            default=16,
+                            help="Concurrent clients")
+    run_parser.add_argument('--duration',
+                            action="store",
+                            type=float,
+                            default=10,
+                            help="Seconds each scenario runs")
+    run_parser.add_argument('--warmup',
+                            action="store",
+                            type=float,
+                            default=1,
+                            help="Seconds of unrecorded load before each scenario")
+    run_parser.add_argument('-o', '--output',
+                            action="store",
+                            default=None,
+                            help="File to save the JSON results to")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files")
+    compare_parser.add_argument('baseline', help="Results of the reference commit")
+    compare_parser.add_argument('current', help="Results of the commit under test")
+    compare_parser.add_argument('--threshold',
+                                action="store",
+                                type=float,
+                                default=0.1,
+                                help="Allowed relative regression, 0.1 is 10%%")
+
+    return parser.parse_args(argv)
+
+
+def main(argv:list=None) -> int:
+    args = get_arguments(argv)
+
+    if args.command == "compare":
+        with open(args.baseline) as baseline_file, open(args.current) as current_file:
+            _regressions = compare_results(json.load(baseline_file), json.load(current_file), args.threshold)
+        for _regression in _regressions:
+            print(_regression)
+        if not _regressions:
+            print("No regressions")
+        return 1 if _regressions else 0
+
+    _results = run_benchmark(args)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(_results, output_file, indent=2)
+        print("Saved results to {}".format(args.output))
+    else:
+        print(json.dumps(_results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,94 @@
+# imported first, so the time taken by the other imports is reported
+from libs.startup import StartupTimer
+
 import logging
 import argparse
+import signal
+import sys
+import threading
+import time
 
 from app_config import AppConfig
 import user_service
-from libs.parameters import AWSParameter
-from http.server import HTTPServer
+from libs.admission import AdmissionController
+from libs.parameters import AWSParameter, Parameter
+from libs.servers import SERVER_MODE_PREFORK, SERVER_MODES, PreForkServer, create_server
+from libs.user_store import USER_STORE_BACKENDS, create_user_store
+from libs.response_cache import ResponseCache
+from libs.config_refresher import ConfigRefresher
+from libs.user_log import LoggedUserStore, UserWriteLog, persist_users
+from libs.user_reloader import UserStoreReloader, readers
+from libs.user_search import SearchIndexer
+from libs.log_handlers import LOG_MODES, access_log, configure_logging
+from libs.profiling import profiler, tracer
+
+def apply_config(config:AppConfig) -> None:
+    """Swaps a refreshed configuration into the user service
+
+    Args:
+        config (AppConfig): the new configuration
+    """
+    # a single assignment, so requests see the old or the new snapshot
+    user_service.config = config
+
+    # log levels are applied by the root logger, see libs.log_handlers
+    logging.getLogger().setLevel(config.log_level)
+    access_log.sample_rate = config.log_sample_rate
+    apply_profiling(config)
+
+    if user_service.response_cache is not None:
+        user_service.response_cache.max_entries = config.cache_max_entries
+        user_service.response_cache.max_bytes = config.cache_max_bytes
+
+    # the server holds the same controller, so new limits apply to the next request
+    if user_service.admission is not None:
+        user_service.admission.configure(**admission_settings(config))
+
+
+def admission_settings(config:AppConfig) -> dict:
+    """Returns the AdmissionController settings of a configuration
+
+    Args:
+        config (AppConfig): the configuration
+
+    Returns:
+        dict: keyword arguments for AdmissionController and its configure()
+    """
+    return {
+        "mode": config.admission_mode,
+        "limit": config.admission_limit,
+        "min_limit": config.admission_min_limit,
+        "latency_target": config.admission_latency_target,
+        "retry_after": config.admission_retry_after,
+        "priority_paths": config.admission_priority_paths
+    }
+
+
+def apply_profiling(config:AppConfig) -> None:
+    """Applies the profiler and tracing settings of a configuration, a
+    profile already running keeps its interval
+
+    Args:
+        config (AppConfig): the configuration
+    """
+    profiler.interval = config.profiling_interval
+    # tracing is only switched on with profiling, so it costs nothing by default
+    tracer.sample_rate = config.profiling_trace_sample_rate if config.profiling_enabled else 0.0
+
 
-def get_arguments():
+def apply_user_store(store) -> None:
+    """Swaps a reloaded user store into the user service
+
+    Args:
+        store (UserStore): the new user store
+    """
+    # a single assignment, responses cached from the old store are dropped
+    # because the store is part of the response cache's generation. Searches
+    # use the old index until one of the new store is built in the background
+    user_service.user_store = store
+
+
+def get_arguments(argv:list=None):
     parser = argparse.ArgumentParser(description="A test application for cloudbee's demo")
     parser.add_argument('-d', '--debug',
                         action='store_true',
@@ -22,11 +104,273 @@ def get_arguments():
                         action="store",
                         default="0.0.0.0",
                         help="Listening Address")
+    parser.add_argument('--server-mode',
+                        action="store",
+                        choices=SERVER_MODES,
+                        default=None,
+                        help="How requests are served, overrides the server/mode setting")
+    parser.add_argument('--threads',
+                        action="store",
+                        type=int,
+                        default=None,
+                        help="Worker threads per process, overrides the server/threads setting")
+    parser.add_argument('--processes',
+                        action="store",
+                        type=int,
+                        default=None,
+                        help="Worker processes in prefork mode (0 is one per CPU), "
+                             "overrides the server/processes setting")
+    parser.add_argument('--backlog',
+                        action="store",
+                        type=int,
+                        default=None,
+                        help="Accept backlog of the listening socket, overrides the server/backlog setting")
+    parser.add_argument('--log-mode',
+                        action="store",
+                        choices=LOG_MODES,
+                        default=None,
+                        help="Write logs on the request thread (stream) or a background thread (queue), "
+                             "overrides the log/mode setting")
+    parser.add_argument('--users-backend',
+                        action="store",
+                        choices=USER_STORE_BACKENDS,
+                        default=None,
+                        help="User store backend, overrides the users/backend setting")
+    parser.add_argument('--users-source',
+                        action="store",
+                        default=None,
+                        help="NDJSON or CSV users file (memory), database (sqlite) or snapshot file (snapshot), "
+                             "overrides the users/source setting")
+    parser.add_argument('--startup-report',
+                        action='store_true',
+                        help="Log how long each phase of startup took")
+    parser.add_argument('--check',
+                        action='store_true',
+                        help="Start up and exit without serving, to check the configuration and startup time")
+
+    return parser.parse_args(argv)
+
 
-    return parser.parse_args()
+class Application:
+    """Application wires the configuration, logging, user data and web server
+    of the user service together
+
+    Methods
+    -------
+    start() - reads the configuration, loads users and binds the web server
+    serve_forever() - serves requests until the web server is shut down
+    shutdown() - fails readiness and stops the web server, which drains
+    close() - stops background work and releases resources
+    """
+    def __init__(self, args:argparse.Namespace, parameter_client:Parameter=None,
+                 startup:StartupTimer=None) -> None:
+        """
+        Args:
+            args (argparse.Namespace): arguments from get_arguments()
+            parameter_client (Parameter, optional): A Parameter Client. Defaults to None.
+            startup (StartupTimer, optional): times the phases of start(). Defaults to a new timer.
+        """
+        self.args = args
+        self.parameter_client = parameter_client
+        self.startup = startup if startup is not None else StartupTimer()
+        self.config = None
+        self.webserver = None
+        self._user_store = None
+        self._users_reloader = None
+        self._write_log = None
+        self._config_refresher = None
+        self._log_listener = None
+        self._shutting_down = False
+
+    def start(self) -> None:
+        """Reads the configuration, loads users and binds the web server"""
+        args = self.args
+
+        # get application configuration
+        logging.debug("Generating Application configuration")
+        _config = AppConfig(parameter_client=self.parameter_client,
+                            debug=args.debug)
+        self.config = _config
+        self.startup.lap("config")
+
+        logging.info("Setting log level to %s", _config.log_level)
+        _log_mode = args.log_mode or _config.log_mode
+        self._log_listener = configure_logging(handlers=_config.log_handlers,
+                                               log_level=_config.log_level,
+                                               mode=_log_mode,
+                                               queue_size=_config.log_queue_size)
+        access_log.sample_rate = _config.log_sample_rate
+        apply_profiling(_config)
+        self.startup.lap("logging")
+
+        # command line arguments take priority over configured server settings
+        _server_mode = args.server_mode or _config.server_mode
+        _threads = args.threads if args.threads is not None else _config.server_threads
+        _processes = args.processes if args.processes is not None else _config.server_processes
+        _backlog = args.backlog if args.backlog is not None else _config.server_backlog
+
+        # replay the writes which haven't been compacted into the users source
+        if _config.user_write_log is not None:
+            if _server_mode == SERVER_MODE_PREFORK:
+                raise ValueError("The user write log can't be shared by prefork workers, "
+                                 "use another server mode to accept writes")
+            self._write_log = UserWriteLog(_config.user_write_log)
+
+        # load the user data
+        _users_backend = args.users_backend or _config.user_store_backend
+        _users_source = args.users_source or _config.user_store_source
+        logging.debug("Loading users with the %s backend", _users_backend)
+
+        def _load_users():
+            _store = create_user_store(backend=_users_backend,
+                                       source=_users_source,
+                                       default_users=user_service.UserService._user_map,
+                                       max_bytes=_config.user_max_bytes)
+            if self._write_log is None:
+                return _store
+            return LoggedUserStore(_store, self._write_log)
+
+        self._user_store = _load_users()
+        self.startup.lap("users")
+
+        # set config, user store and response cache in user_service library
+        user_service.config = _config
+        apply_user_store(self._user_store)
+        user_service.search_indexer = SearchIndexer() if _config.search_enabled else None
+        user_service.response_cache = None
+        if _config.cache_max_entries > 0:
+            user_service.response_cache = ResponseCache(max_entries=_config.cache_max_entries,
+                                                        max_bytes=_config.cache_max_bytes)
+
+        # reload the users when asked to, or when the source file changes
+        self._users_reloader = UserStoreReloader(load=_load_users,
+                                                 apply=apply_user_store,
+                                                 store=self._user_store,
+                                                 source=_users_source,
+                                                 poll_interval=_config.user_reload_interval,
+                                                 requests=readers)
+        user_service.users_reloader = self._users_reloader
+        self._users_reloader.start()
+        # signal handlers can only be installed by the main thread
+        if threading.current_thread() is threading.main_thread():
+            self._users_reloader.install_signal_handler(signal.SIGHUP)
+
+        # accept writes, compacting them into the users source in the background
+        if self._write_log is not None:
+            user_service.write_log = self._write_log
+            self._write_log.start(
+                compact_interval=_config.user_compact_interval,
+                persist=lambda users: self._persist_users(_users_backend, _users_source, users)
+            )
+
+        # poll the parameter store for configuration changes
+        if self.parameter_client is not None and _config.refresh_interval > 0:
+            logging.debug("Refreshing configuration every %s seconds", _config.refresh_interval)
+            self._config_refresher = ConfigRefresher(load=lambda: user_service.config.reload(),
+                                                     apply=apply_config,
+                                                     interval=_config.refresh_interval,
+                                                     version=_config.version)
+            user_service.config_refresher = self._config_refresher
+            self._config_refresher.start()
+
+        self.startup.lap("background")
+
+        # shed requests once the server holds too many
+        _admission = AdmissionController(**admission_settings(_config))
+        user_service.admission = _admission
+
+        logging.info("Starting HTTP Server on %s in %s mode", args.port, _server_mode)
+        # create webserver object
+        self.webserver = create_server(mode=_server_mode,
+                                       server_address=(args.listen_addr, int(args.port)),
+                                       handler_class=user_service.UserService,
+                                       threads=_threads,
+                                       processes=_processes,
+                                       backlog=_backlog,
+                                       app=user_service.UserService.handle_request,
+                                       probe_paths=user_service.PROBE_PATHS,
+                                       blocking_paths=user_service.BLOCKING_PATHS,
+                                       forward_signals=(signal.SIGHUP,),
+                                       admission=_admission,
+                                       drain_timeout=_config.server_drain_timeout,
+                                       on_child_exit=self._flush_logs,
+                                       on_drain=self._fail_readiness,
+                                       deregistration_delay=_config.server_deregistration_delay)
+        # ECS sends SIGTERM before stopping a task, signal handlers can
+        # only be installed by the main thread
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, self._handle_sigterm)
+        self.startup.lap("bind")
+
+        if args.startup_report:
+            self.startup.log()
+
+    def _persist_users(self, backend:str, source:str, users:list) -> bool:
+        """Writes logged users into the users source and reloads it, for UserWriteLog.compact
+
+        Returns:
+            bool: True if the users source now holds the users
+        """
+        # otherwise the users stay in the write log, which searches still index
+        return persist_users(backend, source, users) and self._users_reloader.reload()
+
+    def serve_forever(self) -> None:
+        """Serves requests until the web server is shut down"""
+        self.webserver.serve_forever()
+
+    def shutdown(self) -> None:
+        """Fails readiness, so the load balancer stops sending requests, and
+        stops the web server accepting them deregistration_delay seconds
+        later. serve_forever() returns once the server has stopped, and
+        close() waits for any requests left to finish"""
+        if self._shutting_down:
+            return
+        self._shutting_down = True
+
+        logging.info("Shutting down in %s seconds, requests in progress then have %s seconds to finish",
+                     self.config.server_deregistration_delay, self.config.server_drain_timeout)
+        # prefork workers serve the readiness probes, and fail them and wait themselves
+        if not isinstance(self.webserver, PreForkServer):
+            self._fail_readiness()
+            time.sleep(self.config.server_deregistration_delay)
+        self.webserver.shutdown()
+
+    def _fail_readiness(self) -> None:
+        """Answers readiness probes with 503 from now on"""
+        user_service.draining = True
+
+    def _handle_sigterm(self, signum:int, frame) -> None:
+        """Shuts down gracefully on SIGTERM"""
+        # shutdown() waits for serve_forever(), which this signal interrupted
+        threading.Thread(target=self.shutdown, name="shutdown", daemon=True).start()
+
+    def _flush_logs(self) -> None:
+        """Writes the queued log records, for prefork workers which exit without close()"""
+        if self._log_listener is not None:
+            self._log_listener.stop()
+
+    def close(self) -> None:
+        """Stops background work and releases resources"""
+        if self._config_refresher is not None:
+            self._config_refresher.stop()
+        # drains the requests still in progress
+        if self.webserver is not None:
+            self.webserver.server_close()
+        if self._write_log is not None:
+            self._write_log.close()
+        if self._users_reloader is not None:
+            self._users_reloader.stop()
+            # the reloader holds the store in use, which may have replaced the first one
+            self._user_store = self._users_reloader.store
+        if self._user_store is not None:
+            self._user_store.close()
+        logging.info("Exiting")
+        self._flush_logs()
 
 
 if __name__ == "__main__":
+    startup = StartupTimer()
+    startup.lap("import")
     args = get_arguments()
 
     # set log level before reading configs
@@ -48,25 +392,18 @@ if __name__ == "__main__":
         logging.info("Application is running in AWS")
         logging.debug("Generating AWS Parameter Client")
         parameter_client = AWSParameter()
+        startup.lap("parameter_client")
 
-    # get application configuration
-    logging.debug("Generating Application configuration")
-    _config = AppConfig(parameter_client=parameter_client,
-                        debug=args.debug)
-
-    logging.info("Setting log level to %s", _config.log_level)
-    logging.basicConfig(level=_config.log_level, handlers=_config.log_handlers)
-    logging.info("Starting HTTP Server on %s", args.port)
+    application = Application(args, parameter_client=parameter_client, startup=startup)
+    application.start()
 
-    # set config in user_service library
-    user_service.config = _config
-    # create webserver object
-    webserver = HTTPServer((args.listen_addr, int(args.port)), user_service.UserService)
+    if args.check:
+        application.close()
+        sys.exit(0)
 
     try:
-        webserver.serve_forever()
+        application.serve_forever()
     except KeyboardInterrupt:
         pass
-    
-    webserver.server_close()
-    logging.info("Exiting")
\ No newline at end of file
+
+    application.close()
@@ -1,30 +1,134 @@
+import hashlib
+import json
 import logging
 import os
-from libs.parameters import Parameter, ParameterNotFoundException
+import time
+from libs.parameters import CachedParameter, Parameter, ParameterNotFoundException
+from libs.parameters import ParameterUnavailableException
+from libs.admission import ADMISSION_MODES
+from libs.servers import SERVER_MODES
+from libs.user_store import USER_STORE_BACKENDS
+from libs.log_handlers import LOG_MODES
 
 APPLICATION_NAME = "user-service"
 
 class AppConfig:
-    """AppConfig is a class which stores the configurtion of the application
+    """AppConfig is a class which stores the configurtion of the application,
+    an instance is a snapshot which isn't changed once built
     Abstract Methods
     ----------------
     get_log_handlers(log_level) - gets log handlers
+    Methods
+    -------
+    reload() - builds a new snapshot from the same sources
     """
     # The default log level
     DEFAULT_LOG_LEVEL = "info"
+    # The default logging mode, see libs.log_handlers
+    DEFAULT_LOG_MODE = "queue"
+    # The default number of log records queued before records are dropped
+    DEFAULT_LOG_QUEUE_SIZE = "10000"
+    # The default fraction of per-request log lines written
+    DEFAULT_LOG_SAMPLE_RATE = "1.0"
+    # The default serving mode, see libs.servers
+    DEFAULT_SERVER_MODE = "threaded"
+    # The default number of worker threads per process
+    DEFAULT_SERVER_THREADS = "16"
+    # The default number of worker processes, 0 uses one per CPU
+    DEFAULT_SERVER_PROCESSES = "0"
+    # The default size of the listen socket's accept backlog
+    DEFAULT_SERVER_BACKLOG = "128"
+    # The default seconds a connection may wait for the client to send, 0 waits forever
+    DEFAULT_SERVER_REQUEST_TIMEOUT = "10"
+    # The default seconds requests in progress have to finish on shutdown
+    DEFAULT_SERVER_DRAIN_TIMEOUT = "20"
+    # The default seconds the service keeps accepting requests after failing readiness on shutdown
+    DEFAULT_SERVER_DEREGISTRATION_DELAY = "0"
+    # The default admission mode, see libs.admission
+    DEFAULT_ADMISSION_MODE = "fixed"
+    # The default number of requests a process holds at once, queued ones included
+    DEFAULT_ADMISSION_LIMIT = "256"
+    # The default floor of the adaptive admission limit
+    DEFAULT_ADMISSION_MIN_LIMIT = "16"
+    # The default seconds a request may take before the adaptive admission limit is cut
+    DEFAULT_ADMISSION_LATENCY_TARGET = "1.0"
+    # The default seconds refused clients are asked to wait before retrying
+    DEFAULT_ADMISSION_RETRY_AFTER = "1"
+    # The default comma separated path prefixes which are never refused
+    DEFAULT_ADMISSION_PRIORITY_PATHS = "/metrics"
+    # The default user store backend, see libs.user_store
+    DEFAULT_USER_STORE_BACKEND = "memory"
+    # The user source which selects the built-in users
+    BUILTIN_USER_SOURCE = "builtin"
+    # The default seconds between checks of the users source for changes, 0 disables polling
+    DEFAULT_USER_RELOAD_INTERVAL = "30"
+    # The default most bytes the memory user store may use, 0 doesn't bound it
+    DEFAULT_USER_MAX_BYTES = "0"
+    # The write log setting which disables user writes
+    DISABLED_USER_WRITE_LOG = "none"
+    # The default seconds between compactions of the user write log, 0 disables compaction
+    DEFAULT_USER_COMPACT_INTERVAL = "300"
+    # The default user search switch, searching needs an index of every user
+    DEFAULT_SEARCH_ENABLED = "on"
+    # The default number of cached responses, 0 disables the cache
+    DEFAULT_CACHE_MAX_ENTRIES = "100000"
+    # The default number of bytes held by the response cache
+    DEFAULT_CACHE_MAX_BYTES = "67108864"
+    # The default seconds clients and proxies may reuse a user response
+    DEFAULT_CACHE_MAX_AGE = "60"
+    # The default smallest response body compressed, in bytes, 0 disables compression
+    DEFAULT_COMPRESSION_MIN_SIZE = "1024"
+    # The default compression level, from 1 (fastest) to 9 (smallest)
+    DEFAULT_COMPRESSION_LEVEL = "6"
+    # The default profiling switch, the admin profiling routes answer 503 while it is off
+    DEFAULT_PROFILING_ENABLED = "off"
+    # The default seconds between profiler samples
+    DEFAULT_PROFILING_INTERVAL = "0.01"
+    # The default longest profile, in seconds
+    DEFAULT_PROFILING_MAX_SECONDS = "60"
+    # The default fraction of requests whose phases are timed, 0 disables tracing
+    DEFAULT_PROFILING_TRACE_SAMPLE_RATE = "0.0"
+    # The admin token setting which disables the admin routes
+    DISABLED_ADMIN_TOKEN = "none"
+    # The shortest admin token accepted
+    MIN_ADMIN_TOKEN_LENGTH = 16
+    # The default seconds between configuration refreshes, 0 disables refreshing
+    DEFAULT_REFRESH_INTERVAL = "60"
     # An empty variable to store features
-    features = []
+    features = ()
 
-    def __init__(self, parameter_client:Parameter=None, env_prefix:str=None, debug:bool=False):
+    def __init__(self, parameter_client:Parameter=None, env_prefix:str=None, debug:bool=False,
+                 strict:bool=False):
         """_summary_
 
         Args:
             parameter_client (Parameter, optional): A Parameter Client. Defaults to None.
             env_prefix (str, optional): name of a sub-environment. Defaults to None.
             debug (bool, optional): overide log level as debug. Defaults to False.
+            strict (bool, optional): fail when the parameter store can't be read,
+                rather than using defaults. Defaults to False.
+
+        Raises:
+            ParameterUnavailableException: if strict and the parameter store can't be read
         """
+        self._source_parameter_client = parameter_client
         self._parameter_client = parameter_client
         self._env_prefix = env_prefix
+        self._debug = debug
+        self._strict = strict
+        # the resolved value of every setting, used to version the snapshot
+        self._settings = {}
+
+        # read every parameter for the application in one call
+        if parameter_client is not None:
+            self._parameter_client = CachedParameter(parameter_client)
+            try:
+                self._parameter_client.load(self._get_parameter_path())
+            except ParameterUnavailableException as e:
+                if strict:
+                    raise
+                logging.warning("%s, using the defaults", e)
+
         # Get the log level
         _log_level = self._get_log_level()
 
@@ -34,7 +138,63 @@ class AppConfig:
         
         self.log_level = _log_level
         self.log_handlers = AppConfig.get_log_handlers(_log_level)
-        self.features = self._get_features()
+        self._get_log_settings()
+        self.features = tuple(self._get_features())
+        self._get_server_settings()
+        self._get_admission_settings()
+        self._get_user_store_settings()
+        self.search_enabled = self._get_setting(
+            param_name="search/enabled",
+            default_value=self.DEFAULT_SEARCH_ENABLED,
+            description="Allows searching the users of {}, which indexes them (on, off)".format(
+                APPLICATION_NAME)
+        ).lower() == "on"
+        self._get_cache_settings()
+        self._get_compression_settings()
+        self._get_profiling_settings()
+        self._get_admin_settings()
+        self.refresh_interval = self._get_int_setting(
+            param_name="config/refresh-interval",
+            default_value=self.DEFAULT_REFRESH_INTERVAL,
+            description="Seconds between configuration refreshes for {}, 0 disables refreshing".format(
+                APPLICATION_NAME)
+        )
+
+        # write any missing defaults once every setting has been read
+        if self._parameter_client is not None:
+            self._parameter_client.flush()
+
+        # identify the snapshot by its settings so versions match across tasks
+        _settings = json.dumps(self._settings, sort_keys=True)
+        self.version = hashlib.blake2b(bytes(_settings, "utf-8"), digest_size=6).hexdigest()
+        self.loaded_at = time.time()
+
+    def reload(self):
+        """Builds a new configuration snapshot from the same sources
+
+        Raises:
+            ParameterUnavailableException: if the parameter store can't be read,
+                so the snapshot in use is kept rather than replaced by defaults
+
+        Returns:
+            AppConfig: the new configuration
+        """
+        return AppConfig(parameter_client=self._source_parameter_client,
+                         env_prefix=self._env_prefix,
+                         debug=self._debug,
+                         strict=True)
+
+    def _get_parameter_path(self) -> str:
+        """Returns the parameter path holding the application's settings
+
+        Returns:
+            str: /<application>[/<env_prefix>]
+        """
+        _param_path = "/{}".format(APPLICATION_NAME)
+        if self._env_prefix is not None:
+            _param_path = "{}/{}".format(_param_path, self._env_prefix)
+
+        return _param_path
 
     def _get_setting(self, param_name:str, default_value:str, description:str) -> str:
         """Gets a setting based on a priority
@@ -57,17 +217,11 @@ class AppConfig:
         logging.debug("Checking for environment variable %s", _env_var)
         _setting_value = os.environ.get(_env_var)
 
-        # Set the base of the parameter name
-        _param_name = "/{}".format(APPLICATION_NAME)
-
         if _setting_value is None:
             logging.debug("Environment variable %s not found", _env_var)
             if self._parameter_client is not None:
-                # add prefix to param_name
-                if self._env_prefix is not None:
-                    _param_name = "{}/{}".format(_param_name, self._env_prefix)
                 # generate resulting parameter name
-                _param_name = "{}/{}".format(_param_name, param_name)
+                _param_name = "{}/{}".format(self._get_parameter_path(), param_name)
 
                 try:
                     # Get the setting from the parameter store
@@ -81,14 +235,362 @@ class AppConfig:
                         value=default_value,
                         description=description
                     )
+                except ParameterUnavailableException as e:
+                    if self._strict:
+                        raise
+                    # the parameter store is throttling or down, don't wait on it
+                    logging.warning("%s, using the default for %s: %s", e, param_name, default_value)
         
         if _setting_value is None:
             # if setting is still none, set the value to default
             logging.debug("Setting value for %s not found, using default: %s", param_name, default_value)
             _setting_value = default_value
 
+        self._settings[param_name] = _setting_value
         return _setting_value
 
+    def _get_int_setting(self, param_name:str, default_value:str, description:str,
+                         minimum:int=0, maximum:int=None) -> int:
+        """Gets a setting and converts it to an integer
+
+        Args:
+            param_name (str): Name of the parameter or setting
+            default_value (str): The default value of the setting
+            description (str): A description of the setting
+            minimum (int, optional): smallest allowed value. Defaults to 0.
+            maximum (int, optional): largest allowed value. Defaults to None.
+
+        Raises:
+            ValueError: if the value isn't an integer or is out of range
+
+        Returns:
+            int: the value of the setting
+        """
+        _setting_value = self._get_setting(
+            param_name=param_name,
+            default_value=default_value,
+            description=description
+        )
+
+        try:
+            _int_value = int(_setting_value)
+        except ValueError:
+            raise ValueError("Setting {} must be an integer: {}".format(param_name, _setting_value))
+
+        if _int_value < minimum:
+            raise ValueError("Setting {} must be at least {}: {}".format(param_name, minimum, _int_value))
+
+        if maximum is not None and _int_value > maximum:
+            raise ValueError("Setting {} must be at most {}: {}".format(param_name, maximum, _int_value))
+
+        return _int_value
+
+    def _get_float_setting(self, param_name:str, default_value:str, description:str,
+                           minimum:float=0.0, maximum:float=None) -> float:
+        """Gets a setting and converts it to a float
+
+        Args:
+            param_name (str): Name of the parameter or setting
+            default_value (str): The default value of the setting
+            description (str): A description of the setting
+            minimum (float, optional): smallest allowed value. Defaults to 0.0.
+            maximum (float, optional): largest allowed value. Defaults to None.
+
+        Raises:
+            ValueError: if the value isn't a number or is out of range
+
+        Returns:
+            float: the value of the setting
+        """
+        _setting_value = self._get_setting(
+            param_name=param_name,
+            default_value=default_value,
+            description=description
+        )
+
+        try:
+            _float_value = float(_setting_value)
+        except ValueError:
+            raise ValueError("Setting {} must be a number: {}".format(param_name, _setting_value))
+
+        if _float_value < minimum or (maximum is not None and _float_value > maximum):
+            raise ValueError("Setting {} is out of range: {}".format(param_name, _float_value))
+
+        return _float_value
+
+    def _get_log_settings(self) -> None:
+        """Reads the settings which control how logs are written
+
+        Raises:
+            ValueError: if the log mode isn't stream or queue
+        """
+        _log_mode = self._get_setting(
+            param_name="log/mode",
+            default_value=self.DEFAULT_LOG_MODE,
+            description="Logging mode for {} ({})".format(APPLICATION_NAME, ", ".join(LOG_MODES))
+        ).lower()
+
+        if _log_mode not in LOG_MODES:
+            raise ValueError("Unknown log mode: {}".format(_log_mode))
+
+        self.log_mode = _log_mode
+        self.log_queue_size = self._get_int_setting(
+            param_name="log/queue-size",
+            default_value=self.DEFAULT_LOG_QUEUE_SIZE,
+            description="Log records queued before dropping for {}".format(APPLICATION_NAME),
+            minimum=1
+        )
+        self.log_sample_rate = self._get_float_setting(
+            param_name="log/sample-rate",
+            default_value=self.DEFAULT_LOG_SAMPLE_RATE,
+            description="Fraction of per-request log lines written for {}".format(APPLICATION_NAME),
+            maximum=1.0
+        )
+
+    def _get_server_settings(self) -> None:
+        """Reads the settings which control how requests are served
+
+        Raises:
+            ValueError: if the server mode isn't single, threaded or prefork
+        """
+        _server_mode = self._get_setting(
+            param_name="server/mode",
+            default_value=self.DEFAULT_SERVER_MODE,
+            description="Serving mode for {} ({})".format(APPLICATION_NAME, ", ".join(SERVER_MODES))
+        ).lower()
+
+        if _server_mode not in SERVER_MODES:
+            raise ValueError("Unknown server mode: {}".format(_server_mode))
+
+        self.server_mode = _server_mode
+        self.server_threads = self._get_int_setting(
+            param_name="server/threads",
+            default_value=self.DEFAULT_SERVER_THREADS,
+            description="Worker threads per process for {}".format(APPLICATION_NAME),
+            minimum=1
+        )
+        self.server_processes = self._get_int_setting(
+            param_name="server/processes",
+            default_value=self.DEFAULT_SERVER_PROCESSES,
+            description="Worker processes for {}, 0 is one per CPU".format(APPLICATION_NAME)
+        )
+        self.server_backlog = self._get_int_setting(
+            param_name="server/backlog",
+            default_value=self.DEFAULT_SERVER_BACKLOG,
+            description="Accept backlog for {}".format(APPLICATION_NAME),
+            minimum=1
+        )
+        self.server_request_timeout = self._get_int_setting(
+            param_name="server/request-timeout",
+            default_value=self.DEFAULT_SERVER_REQUEST_TIMEOUT,
+            description="Seconds {} waits for a client to send, 0 waits forever".format(APPLICATION_NAME)
+        )
+        self.server_drain_timeout = self._get_int_setting(
+            param_name="server/drain-timeout",
+            default_value=self.DEFAULT_SERVER_DRAIN_TIMEOUT,
+            description="Seconds requests in progress have to finish when {} shuts down".format(APPLICATION_NAME)
+        )
+        self.server_deregistration_delay = self._get_int_setting(
+            param_name="server/deregistration-delay",
+            default_value=self.DEFAULT_SERVER_DEREGISTRATION_DELAY,
+            description="Seconds {} keeps accepting requests after failing readiness on shutdown, "
+                        "so the load balancer stops sending them first".format(APPLICATION_NAME)
+        )
+
+    def _get_admission_settings(self) -> None:
+        """Reads the settings which control when requests are shed
+
+        Raises:
+            ValueError: if the admission mode isn't one of ADMISSION_MODES
+        """
+        _admission_mode = self._get_setting(
+            param_name="admission/mode",
+            default_value=self.DEFAULT_ADMISSION_MODE,
+            description="Admission control for {} ({})".format(APPLICATION_NAME, ", ".join(ADMISSION_MODES))
+        ).lower()
+
+        if _admission_mode not in ADMISSION_MODES:
+            raise ValueError("Unknown admission mode: {}".format(_admission_mode))
+
+        self.admission_mode = _admission_mode
+        self.admission_limit = self._get_int_setting(
+            param_name="admission/limit",
+            default_value=self.DEFAULT_ADMISSION_LIMIT,
+            description="Requests held at once per process by {}, queued ones included".format(APPLICATION_NAME),
+            minimum=1
+        )
+        self.admission_min_limit = self._get_int_setting(
+            param_name="admission/min-limit",
+            default_value=self.DEFAULT_ADMISSION_MIN_LIMIT,
+            description="Lowest adaptive admission limit for {}".format(APPLICATION_NAME),
+            minimum=1
+        )
+        self.admission_latency_target = self._get_float_setting(
+            param_name="admission/latency-target",
+            default_value=self.DEFAULT_ADMISSION_LATENCY_TARGET,
+            description="Seconds a request to {} may take before the adaptive admission limit is cut".format(
+                APPLICATION_NAME)
+        )
+        self.admission_retry_after = self._get_int_setting(
+            param_name="admission/retry-after",
+            default_value=self.DEFAULT_ADMISSION_RETRY_AFTER,
+            description="Seconds clients refused by {} are asked to wait".format(APPLICATION_NAME)
+        )
+        _priority_paths = self._get_setting(
+            param_name="admission/priority-paths",
+            default_value=self.DEFAULT_ADMISSION_PRIORITY_PATHS,
+            description="Comma separated path prefixes {} never refuses".format(APPLICATION_NAME)
+        )
+        self.admission_priority_paths = tuple(
+            _path.strip() for _path in _priority_paths.split(",") if _path.strip()
+        )
+
+    def _get_user_store_settings(self) -> None:
+        """Reads the settings which control where user data is loaded from
+
+        Raises:
+            ValueError: if the backend isn't one of USER_STORE_BACKENDS
+        """
+        _backend = self._get_setting(
+            param_name="users/backend",
+            default_value=self.DEFAULT_USER_STORE_BACKEND,
+            description="User store backend for {} ({})".format(APPLICATION_NAME, ", ".join(USER_STORE_BACKENDS))
+        ).lower()
+
+        if _backend not in USER_STORE_BACKENDS:
+            raise ValueError("Unknown user store backend: {}".format(_backend))
+
+        _source = self._get_setting(
+            param_name="users/source",
+            default_value=self.BUILTIN_USER_SOURCE,
+            description="NDJSON or CSV users file, database or snapshot for {}, {} uses the built-in users".format(
+                APPLICATION_NAME, self.BUILTIN_USER_SOURCE)
+        )
+
+        # the built-in users are represented by no source
+        if _source == self.BUILTIN_USER_SOURCE:
+            _source = None
+
+        self.user_store_backend = _backend
+        self.user_store_source = _source
+        self.user_reload_interval = self._get_int_setting(
+            param_name="users/reload-interval",
+            default_value=self.DEFAULT_USER_RELOAD_INTERVAL,
+            description="Seconds between checks of the users source of {} for changes, 0 disables polling".format(
+                APPLICATION_NAME)
+        )
+
+        self.user_max_bytes = self._get_int_setting(
+            param_name="users/max-bytes",
+            default_value=self.DEFAULT_USER_MAX_BYTES,
+            description="Most bytes the memory user store of {} may use, loads needing more fail, "
+                        "0 doesn't bound it".format(APPLICATION_NAME)
+        )
+
+        _write_log = self._get_setting(
+            param_name="users/write-log",
+            default_value=self.DISABLED_USER_WRITE_LOG,
+            description="Append-only log of user writes for {}, {} disables writes".format(
+                APPLICATION_NAME, self.DISABLED_USER_WRITE_LOG)
+        )
+        self.user_write_log = None if _write_log == self.DISABLED_USER_WRITE_LOG else _write_log
+        self.user_compact_interval = self._get_int_setting(
+            param_name="users/compact-interval",
+            default_value=self.DEFAULT_USER_COMPACT_INTERVAL,
+            description="Seconds between compactions of the user write log of {}, 0 disables compaction".format(
+                APPLICATION_NAME)
+        )
+
+    def _get_cache_settings(self) -> None:
+        """Reads the settings which size the response cache"""
+        self.cache_max_entries = self._get_int_setting(
+            param_name="cache/max-entries",
+            default_value=self.DEFAULT_CACHE_MAX_ENTRIES,
+            description="Most cached responses for {}, 0 disables the cache".format(APPLICATION_NAME)
+        )
+        self.cache_max_bytes = self._get_int_setting(
+            param_name="cache/max-bytes",
+            default_value=self.DEFAULT_CACHE_MAX_BYTES,
+            description="Most bytes of cached responses for {}".format(APPLICATION_NAME)
+        )
+        self.cache_max_age = self._get_int_setting(
+            param_name="cache/max-age",
+            default_value=self.DEFAULT_CACHE_MAX_AGE,
+            description="Seconds clients may reuse a user response from {}, 0 revalidates every time".format(APPLICATION_NAME)
+        )
+
+        # the Cache-Control header of user responses
+        self.cache_control = "max-age={}".format(self.cache_max_age)
+        if self.cache_max_age == 0:
+            self.cache_control = "no-cache"
+
+    def _get_compression_settings(self) -> None:
+        """Reads the settings which control response compression"""
+        self.compression_min_size = self._get_int_setting(
+            param_name="compression/min-size",
+            default_value=self.DEFAULT_COMPRESSION_MIN_SIZE,
+            description="Smallest response body compressed by {}, in bytes, 0 disables compression".format(
+                APPLICATION_NAME)
+        )
+        self.compression_level = self._get_int_setting(
+            param_name="compression/level",
+            default_value=self.DEFAULT_COMPRESSION_LEVEL,
+            description="Compression level from 1 (fastest) to 9 (smallest) for {}".format(APPLICATION_NAME),
+            minimum=1,
+            maximum=9
+        )
+
+    def _get_admin_settings(self) -> None:
+        """Reads the token which the admin routes require, store it in the
+        parameter store as a SecureString
+
+        Raises:
+            ValueError: if the token is shorter than MIN_ADMIN_TOKEN_LENGTH
+        """
+        _admin_token = self._get_setting(
+            param_name="admin/token",
+            default_value=self.DISABLED_ADMIN_TOKEN,
+            description="Bearer token required by the admin routes of {}, {} disables them".format(
+                APPLICATION_NAME, self.DISABLED_ADMIN_TOKEN)
+        )
+
+        if _admin_token == self.DISABLED_ADMIN_TOKEN:
+            self.admin_token = None
+            return
+
+        if len(_admin_token) < self.MIN_ADMIN_TOKEN_LENGTH:
+            raise ValueError("Setting admin/token must be at least {} characters".format(
+                self.MIN_ADMIN_TOKEN_LENGTH))
+        self.admin_token = _admin_token
+
+    def _get_profiling_settings(self) -> None:
+        """Reads the settings which control the profiler and request tracing"""
+        self.profiling_enabled = self._get_setting(
+            param_name="profiling/enabled",
+            default_value=self.DEFAULT_PROFILING_ENABLED,
+            description="Allows profiling and tracing {} from the admin routes (on, off)".format(
+                APPLICATION_NAME)
+        ).lower() == "on"
+        self.profiling_interval = self._get_float_setting(
+            param_name="profiling/interval",
+            default_value=self.DEFAULT_PROFILING_INTERVAL,
+            description="Seconds between profiler samples of {}".format(APPLICATION_NAME),
+            minimum=0.001
+        )
+        self.profiling_max_seconds = self._get_int_setting(
+            param_name="profiling/max-seconds",
+            default_value=self.DEFAULT_PROFILING_MAX_SECONDS,
+            description="Longest profile of {}, in seconds".format(APPLICATION_NAME),
+            minimum=1
+        )
+        self.profiling_trace_sample_rate = self._get_float_setting(
+            param_name="profiling/trace-sample-rate",
+            default_value=self.DEFAULT_PROFILING_TRACE_SAMPLE_RATE,
+            description="Fraction of requests to {} whose phases are timed, 0 disables tracing".format(
+                APPLICATION_NAME),
+            maximum=1.0
+        )
+
     def _get_log_level(self, param_prefix:str = None) -> int:
         """Gets the log_level based on the setting
 
@@ -0,0 +1,82 @@
+import argparse
+import json
+import logging
+import resource
+import sys
+
+from libs.user_import import IMPORT_FORMATS, import_users
+from libs.user_snapshot import SnapshotUserStore, SnapshotWriter
+from libs.user_store import MemoryUserStore, SQLiteUserStore
+
+
+def get_arguments(argv:list=None):
+    parser = argparse.ArgumentParser(description="Import users from a NDJSON or CSV export")
+    parser.add_argument('source',
+                        help="The NDJSON or CSV file to import")
+    parser.add_argument('--format',
+                        action="store",
+                        choices=IMPORT_FORMATS,
+                        default=None,
+                        help="Format of the source, defaults to its file extension")
+    parser.add_argument('--sqlite',
+                        action="store",
+                        default=None,
+                        help="Write the users to this SQLite database for the sqlite backend")
+    parser.add_argument('--snapshot',
+                        action="store",
+                        default=None,
+                        help="Write the users to this snapshot file for the snapshot backend")
+    parser.add_argument('--skip-invalid',
+                        action='store_true',
+                        help="Skip invalid records instead of stopping at the first one")
+    parser.add_argument('--progress-interval',
+                        action="store",
+                        type=float,
+                        default=5.0,
+                        help="Seconds between progress messages")
+    parser.add_argument('-d', '--debug',
+                        action='store_true',
+                        help='Display debug messages')
+
+    return parser.parse_args(argv)
+
+
+def main(argv:list=None) -> int:
+    args = get_arguments(argv)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    # without a destination the users are only validated in memory
+    if args.sqlite is not None:
+        _store = SQLiteUserStore(args.sqlite)
+    elif args.snapshot is not None:
+        _store = SnapshotWriter(args.snapshot)
+    else:
+        _store = MemoryUserStore()
+
+    try:
+        _stats = import_users(_store, args.source,
+                              file_format=args.format,
+                              skip_invalid=args.skip_invalid,
+                              progress_interval=args.progress_interval)
+    except ValueError as e:
+        logging.error(e)
+        if args.snapshot is not None:
+            _store.abort()
+        return 1
+    finally:
+        _store.close()
+
+    _report = _stats.to_dict()
+    if args.snapshot is not None:
+        # check what was written can be read back
+        _snapshot = SnapshotUserStore(args.snapshot, verify=True)
+        _report["snapshot_users"] = _snapshot.count()
+        _snapshot.close()
+    # ru_maxrss is in kilobytes on Linux
+    _report["peak_rss_bytes"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps(_report))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
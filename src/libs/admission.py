@@ -0,0 +1,149 @@
+import threading
+import time
+
+# Admission modes, see AdmissionController
+ADMISSION_MODE_OFF = "off"
+ADMISSION_MODE_FIXED = "fixed"
+ADMISSION_MODE_ADAPTIVE = "adaptive"
+ADMISSION_MODES = (ADMISSION_MODE_OFF, ADMISSION_MODE_FIXED, ADMISSION_MODE_ADAPTIVE)
+
+# The body of the response to a request which wasn't admitted
+SHED_MESSAGE = b"service overloaded, retry later"
+
+
+class AdmissionController:
+    """AdmissionController limits how many requests a server holds at once,
+    counting requests waiting for a worker as well as running ones, so
+    requests over the limit can be answered with a fast 503 instead of
+    queueing until the load balancer gives up on them
+
+    In fixed mode the limit doesn't change. In adaptive mode it starts at
+    the limit and follows the latency of finished requests: a request
+    slower than latency_target cuts it by backoff (at most once per
+    latency_target, so one burst of slow requests is one cut), and faster
+    requests raise it by 1/limit each while at least half of it is in use,
+    never going below min_limit or above the configured limit. In off mode
+    every request is admitted.
+
+    Priority requests, such as admin and metrics requests, are admitted
+    whatever the limit, but are counted like any other.
+
+    Attributes:
+        in_flight -- requests admitted and not yet released
+        admitted -- requests admitted
+        shed -- requests refused
+
+    Methods
+    -------
+    configure(mode, limit, min_limit, latency_target, retry_after, priority_paths) - changes the settings
+    try_acquire(priority) - returns True if a request is admitted
+    release(latency) - records that an admitted request has finished
+    is_priority(path) - returns True if a path is exempt from the limit
+    """
+    # the fraction the adaptive limit is cut to when requests are slow
+    backoff = 0.9
+
+    def __init__(self, mode:str=ADMISSION_MODE_FIXED, limit:int=256, min_limit:int=16,
+                 latency_target:float=1.0, retry_after:int=1, priority_paths:tuple=(),
+                 clock=time.monotonic) -> None:
+        """
+        Args:
+            mode (str, optional): off, fixed or adaptive. Defaults to fixed.
+            limit (int, optional): requests admitted at once, the ceiling of the adaptive limit.
+                Defaults to 256.
+            min_limit (int, optional): the floor of the adaptive limit. Defaults to 16.
+            latency_target (float, optional): seconds a request may take before the adaptive
+                limit is cut. Defaults to 1.0.
+            retry_after (int, optional): seconds refused clients are asked to wait. Defaults to 1.
+            priority_paths (tuple, optional): path prefixes exempt from the limit. Defaults to ().
+            clock (callable, optional): returns the current time in seconds. Defaults to time.monotonic.
+        """
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._last_decrease = None
+        self.mode = None
+        self._limit = float(limit)
+        self.configure(mode, limit, min_limit, latency_target, retry_after, priority_paths)
+
+    def configure(self, mode:str, limit:int, min_limit:int, latency_target:float,
+                  retry_after:int, priority_paths:tuple=()) -> None:
+        """Changes the settings, requests already admitted are unaffected
+
+        Raises:
+            ValueError: if mode isn't known or the limits are out of range
+        """
+        if mode not in ADMISSION_MODES:
+            raise ValueError("Unknown admission mode: {}".format(mode))
+        if limit < 1 or min_limit < 1:
+            raise ValueError("Admission limits must be at least 1: {}, {}".format(limit, min_limit))
+
+        with self._lock:
+            # the adaptive limit keeps what it has learnt, within the new bounds
+            if mode == ADMISSION_MODE_ADAPTIVE and self.mode == ADMISSION_MODE_ADAPTIVE:
+                self._limit = min(max(self._limit, min_limit), limit)
+            else:
+                self._limit = float(limit)
+
+            self.mode = mode
+            self.max_limit = limit
+            self.min_limit = min(min_limit, limit)
+            self.latency_target = latency_target
+            self.retry_after = retry_after
+            self.priority_paths = tuple(priority_paths)
+
+    @property
+    def enabled(self) -> bool:
+        """True unless every request is admitted"""
+        return self.mode != ADMISSION_MODE_OFF
+
+    @property
+    def limit(self) -> int:
+        """The number of requests admitted at once"""
+        return int(self._limit)
+
+    def is_priority(self, path:str) -> bool:
+        """Returns True if a request for path is exempt from the limit"""
+        return path.startswith(self.priority_paths) if self.priority_paths else False
+
+    def try_acquire(self, priority:bool=False) -> bool:
+        """Admits a request if it is under the limit, every call which
+        returns True must be followed by a call to release()
+
+        Args:
+            priority (bool, optional): admit the request whatever the limit. Defaults to False.
+
+        Returns:
+            bool: True if the request is admitted
+        """
+        with self._lock:
+            if not priority and self.enabled and self.in_flight >= self._limit:
+                self.shed += 1
+                return False
+
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self, latency:float) -> None:
+        """Records that an admitted request has finished
+
+        Args:
+            latency (float): seconds from admitting the request to finishing it
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if self.mode != ADMISSION_MODE_ADAPTIVE:
+                return
+
+            if latency > self.latency_target:
+                _now = self._clock()
+                if self._last_decrease is None or _now - self._last_decrease >= self.latency_target:
+                    self._limit = max(self._limit * self.backoff, self.min_limit)
+                    self._last_decrease = _now
+            elif self.in_flight + 1 >= self._limit / 2:
+                # only grow while the limit is being used, so an idle server
+                # doesn't drift to the ceiling and admit a whole spike
+                self._limit = min(self._limit + 1 / self._limit, self.max_limit)
@@ -0,0 +1,394 @@
+import asyncio
+import email.parser
+import logging
+import socket
+import threading
+import time
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import HTTPMessage
+from .admission import SHED_MESSAGE, AdmissionController
+from .log_handlers import access_log
+
+# The largest request line and header block accepted, in bytes
+MAX_HEADER_SIZE = 65536
+# The largest request body accepted, in bytes
+MAX_BODY_SIZE = 1048576
+# Seconds an idle keep-alive connection is held open. This is longer than
+# the default ALB idle timeout so the load balancer closes connections first
+DEFAULT_KEEP_ALIVE_TIMEOUT = 65
+
+
+class BadRequest(Exception):
+    """Exception raised when a request can't be parsed
+    Attributes:
+        status -- the HTTP status to answer with
+        message -- explination of the error
+    """
+    def __init__(self, status:int, message:str) -> None:
+        self.status = status
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class AsyncHTTPServer:
+    """AsyncHTTPServer is a HTTP/1.1 server built on asyncio streams
+
+    Connections are persistent unless the client asks otherwise, so a load
+    balancer can reuse them, and pipelined requests are answered in order.
+    Idle connections cost a coroutine rather than a thread.
+
+    Requests are passed to an app callable
+        app(method:str, path:str, headers:HTTPMessage, body:bytes) -> (status:int, headers:dict, body:bytes)
+    which is run on the event loop, so it must not block. Requests with
+    a method in blocking_methods, which may wait on a disk sync, or for one
+    of blocking_paths, are run on the loop's default thread pool instead. The body can also
+    be an iterable of bytes, which is sent as it is produced with chunked
+    transfer encoding, or until the connection closes for HTTP/1.0 clients.
+    The loop waits for each chunk to drain before asking for the next, so
+    only one chunk is buffered per connection.
+
+    With an AdmissionController, requests beyond its limit are answered
+    with a 503 and Retry-After, and their connection closed, without
+    calling the app. GET and HEAD requests for probe_paths, and requests
+    for the admission priority paths, are always answered.
+
+    On shutdown() the server stops accepting connections and closes
+    keep-alive connections which are waiting for a request. Requests in
+    progress have drain_timeout seconds to finish, and their connections
+    are closed once answered.
+
+    Methods
+    -------
+    serve_forever() - runs the event loop until shutdown() is called
+    shutdown() - drains and stops serve_forever(), may be called from another thread
+    server_close() - closes the listening socket
+    """
+    server_version = "UserService-asyncio"
+
+    def __init__(self, server_address:tuple, app, backlog:int=128,
+                 keep_alive_timeout:float=DEFAULT_KEEP_ALIVE_TIMEOUT,
+                 blocking_methods:tuple=("POST", "PUT"), blocking_paths:tuple=(), probe_paths:tuple=(),
+                 admission:AdmissionController=None, drain_timeout:float=None) -> None:
+        """
+        Args:
+            server_address (tuple): (address, port) to listen on
+            app (callable): called once per request
+            backlog (int, optional): size of the accept backlog. Defaults to 128.
+            keep_alive_timeout (float, optional): idle seconds before a connection is closed.
+                Defaults to DEFAULT_KEEP_ALIVE_TIMEOUT.
+            blocking_methods (tuple, optional): methods run off the event loop.
+                Defaults to ("POST", "PUT").
+            blocking_paths (tuple, optional): paths run off the event loop whatever
+                the method. Defaults to ().
+            probe_paths (tuple, optional): paths never refused by admission. Defaults to ().
+            admission (AdmissionController, optional): limits the requests in progress.
+                Defaults to None.
+            drain_timeout (float, optional): seconds requests in progress have to finish
+                on shutdown, None waits for as long as they take. Defaults to None.
+        """
+        self.app = app
+        self.blocking_methods = blocking_methods
+        self.blocking_paths = tuple(blocking_paths)
+        self.probe_paths = tuple(probe_paths)
+        self.admission = admission
+        self.drain_timeout = drain_timeout
+        self.keep_alive_timeout = keep_alive_timeout
+        # bind now so errors surface at startup, like HTTPServer
+        self.socket = socket.create_server(server_address, backlog=backlog)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()[:2]
+        self._loop = None
+        self._stop = None
+        self._started = threading.Event()
+        self._stopped = threading.Event()
+        self._connections = set()
+        # the tasks of connections waiting for their next request, by stream reader
+        self._idle = {}
+        self._draining = False
+
+    def serve_forever(self) -> None:
+        """Serves requests until shutdown() is called"""
+        self._stopped.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    def shutdown(self) -> None:
+        """Stops serve_forever() and waits for it to return"""
+        self._started.wait()
+        try:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        except RuntimeError:
+            # serve_forever() has already returned and closed its loop
+            pass
+        self._stopped.wait()
+
+    def server_close(self) -> None:
+        """Closes the listening socket"""
+        self.socket.close()
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        _server = await asyncio.start_server(self._handle_connection,
+                                             sock=self.socket,
+                                             limit=MAX_HEADER_SIZE)
+        self._started.set()
+        try:
+            await self._stop.wait()
+        finally:
+            # stop accepting, then let the requests in progress finish
+            _server.close()
+            self._draining = True
+            for _task in list(self._idle.values()):
+                _task.cancel()
+
+            if self._connections:
+                _done, _pending = await asyncio.wait(set(self._connections), timeout=self.drain_timeout)
+                if _pending:
+                    logging.warning("Closing %s connections still open after %s seconds",
+                                    len(_pending), self.drain_timeout)
+                for _task in _pending:
+                    _task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _handle_connection(self, reader:asyncio.StreamReader,
+                                 writer:asyncio.StreamWriter) -> None:
+        """Answers requests on one connection until it closes"""
+        _task = asyncio.current_task()
+        self._connections.add(_task)
+        _peer = writer.get_extra_info("peername")
+        _client = _peer[0] if _peer else "-"
+
+        try:
+            _keep_alive = True
+            while _keep_alive and not self._draining:
+                self._idle[reader] = _task
+                try:
+                    _request = await asyncio.wait_for(self._read_request(reader),
+                                                      self.keep_alive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except BadRequest as e:
+                    self._write_response(writer, "HTTP/1.1", e.status, {},
+                                         bytes(e.message, "utf-8"), False, True)
+                    await writer.drain()
+                    break
+
+                if _request is None:
+                    # client closed the connection
+                    break
+
+                _start = time.perf_counter()
+                _method, _path, _version, _headers, _body = _request
+                # the connection is closed once answered while draining
+                _keep_alive = self._should_keep_alive(_version, _headers) and not self._draining
+
+                if not self._admit(_method, _path):
+                    # closing the connection sheds the client's next requests too
+                    self._write_response(writer, _version, 503,
+                                         {"Retry-After": str(self.admission.retry_after),
+                                          "Content-type": "text/plain"},
+                                         SHED_MESSAGE, _method == "HEAD", True)
+                    await writer.drain()
+                    break
+
+                try:
+                    _status, _sent, _keep_alive = await self._answer(writer, _method, _path, _version,
+                                                                     _headers, _body, _keep_alive)
+                finally:
+                    if self.admission is not None:
+                        self.admission.release(time.perf_counter() - _start)
+                access_log.log(_client, _method, _path, _status, _sent,
+                               time.perf_counter() - _start)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(_task)
+            self._idle.pop(reader, None)
+            writer.close()
+
+    def _admit(self, method:str, path:str) -> bool:
+        """Returns True if a request is admitted, admitted requests must be released"""
+        if self.admission is None:
+            return True
+
+        _path = path.partition("?")[0]
+        _priority = ((method == "GET" or method == "HEAD") and _path in self.probe_paths) \
+            or self.admission.is_priority(_path)
+        return self.admission.try_acquire(priority=_priority)
+
+    async def _answer(self, writer:asyncio.StreamWriter, method:str, path:str, version:str,
+                      headers:HTTPMessage, body:bytes, keep_alive:bool) -> tuple:
+        """Calls the app and writes its response
+
+        Returns:
+            tuple: (status, body bytes sent, whether the connection is kept alive)
+        """
+        try:
+            if method in self.blocking_methods or path.partition("?")[0] in self.blocking_paths:
+                _status, _response_headers, _response_body = await self._loop.run_in_executor(
+                    None, self.app, method, path, headers, body)
+            else:
+                _status, _response_headers, _response_body = self.app(method, path, headers, body)
+        except Exception:
+            logging.exception("Error handling %s %s", method, path)
+            _status, _response_headers, _response_body = 500, {}, b"internal server error"
+
+        if isinstance(_response_body, (bytes, bytearray)):
+            self._write_response(writer, version, _status, _response_headers,
+                                 _response_body, method == "HEAD", not keep_alive)
+            _sent = len(_response_body)
+            await writer.drain()
+        else:
+            # without chunked encoding the end of the body is the end of the connection
+            keep_alive = keep_alive and version == "HTTP/1.1"
+            _sent = await self._write_stream(writer, version, _status, _response_headers,
+                                             _response_body, method == "HEAD", not keep_alive)
+        return _status, _sent, keep_alive
+
+    async def _read_request(self, reader:asyncio.StreamReader):
+        """Reads one request from the stream
+
+        Raises:
+            BadRequest: if the request is malformed or too large
+
+        Returns:
+            tuple: (method, path, version, headers, body) or None at end of stream
+        """
+        try:
+            # the connection is idle until the next request starts to arrive
+            _first = await reader.readexactly(1)
+            self._idle.pop(reader, None)
+            _head = _first + await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise BadRequest(HTTPStatus.BAD_REQUEST, "incomplete request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise BadRequest(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "request header too large")
+
+        _request_line, _, _header_block = _head.decode("iso-8859-1").partition("\r\n")
+        _parts = _request_line.split()
+        if len(_parts) != 3 or not _parts[2].startswith("HTTP/"):
+            raise BadRequest(HTTPStatus.BAD_REQUEST, "bad request line")
+
+        _method, _path, _version = _parts
+        _headers = email.parser.Parser(_class=HTTPMessage).parsestr(_header_block)
+
+        if _headers.get("Transfer-Encoding") is not None:
+            raise BadRequest(HTTPStatus.LENGTH_REQUIRED, "chunked request bodies are not supported")
+
+        _body = b""
+        _length = _headers.get("Content-Length")
+        if _length is not None:
+            try:
+                _length = int(_length)
+            except ValueError:
+                raise BadRequest(HTTPStatus.BAD_REQUEST, "bad content-length")
+            if _length < 0:
+                raise BadRequest(HTTPStatus.BAD_REQUEST, "bad content-length")
+            if _length > MAX_BODY_SIZE:
+                raise BadRequest(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "request body too large")
+            _body = await reader.readexactly(_length)
+
+        return _method, _path, _version, _headers, _body
+
+    @staticmethod
+    def _should_keep_alive(version:str, headers:HTTPMessage) -> bool:
+        """Decides whether a connection stays open after the response"""
+        _connection = (headers.get("Connection") or "").lower()
+        if version == "HTTP/1.1":
+            return "close" not in _connection
+        return "keep-alive" in _connection
+
+    def _response_head(self, version:str, status:int, headers:dict, framing:str, close:bool) -> bytes:
+        """Returns the status line and headers of a response
+
+        Args:
+            framing (str): the header describing the body, or None
+        """
+        try:
+            _reason = HTTPStatus(status).phrase
+        except ValueError:
+            _reason = ""
+
+        _version = "HTTP/1.1" if version == "HTTP/1.1" else "HTTP/1.0"
+        _lines = [
+            "{} {} {}".format(_version, int(status), _reason),
+            "Server: {}".format(self.server_version),
+            "Date: {}".format(formatdate(usegmt=True)),
+        ]
+        for key, value in headers.items():
+            # framing headers are always set by the server
+            if key.lower() in ("content-length", "connection", "transfer-encoding"):
+                continue
+            _lines.append("{}: {}".format(key, value))
+        if framing is not None:
+            _lines.append(framing)
+        _lines.append("Connection: {}".format("close" if close else "keep-alive"))
+
+        return bytes("\r\n".join(_lines) + "\r\n\r\n", "iso-8859-1")
+
+    async def _write_stream(self, writer:asyncio.StreamWriter, version:str, status:int,
+                            headers:dict, body, head_only:bool, close:bool) -> int:
+        """Writes a response with a body of byte chunks as they are produced
+
+        Returns:
+            int: the number of body bytes sent
+        """
+        _chunked = version == "HTTP/1.1"
+        _sent = 0
+        try:
+            writer.write(self._response_head(version, status, headers,
+                                             "Transfer-Encoding: chunked" if _chunked else None, close))
+            if head_only:
+                return _sent
+
+            _chunks = iter(body)
+            while True:
+                try:
+                    _chunk = next(_chunks)
+                except StopIteration:
+                    break
+                except Exception:
+                    # the status is sent, closing early is the only way left to report it
+                    logging.exception("Error streaming a %s response", status)
+                    raise ConnectionAbortedError("response body failed")
+
+                # an empty chunk would end a chunked body early
+                if not _chunk:
+                    continue
+                if _chunked:
+                    writer.write(b"%x\r\n" % len(_chunk) + _chunk + b"\r\n")
+                else:
+                    writer.write(_chunk)
+                _sent += len(_chunk)
+                await writer.drain()
+
+            if _chunked:
+                writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            # lets the app release whatever the body was reading
+            if hasattr(body, "close"):
+                body.close()
+        return _sent
+
+    def _write_response(self, writer:asyncio.StreamWriter, version:str, status:int,
+                        headers:dict, body:bytes, head_only:bool, close:bool) -> None:
+        """Writes a complete response into the transport buffer"""
+        # a 304 has no body, so it doesn't describe one
+        _framing = None if status == 304 else "Content-Length: {}".format(len(body))
+        _head = self._response_head(version, status, headers, _framing, close)
+        if head_only:
+            writer.write(_head)
+        else:
+            writer.write(_head + body)
@@ -1,24 +1,55 @@
-import boto3
 import os
+import threading
+
+# Clients shared by every AWSBase in the process, keyed by client type,
+# region, credentials and client settings
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def clear_clients() -> None:
+    """Drops the shared clients, the next AWSBase builds a new one"""
+    with _clients_lock:
+        _clients.clear()
+
 
 class AWSBase:
     """
-    AWSBase is a class intended to be be a base class to build 
+    AWSBase is a class intended to be be a base class to build
     functionality for all AWS classes
+
+    Clients are shared by every instance with the same client type, region,
+    credentials and settings, boto3 clients are thread safe and building
+    one takes tens of milliseconds. The client settings are read from
+    environment variables:
+        AWS_MAX_POOL_CONNECTIONS -- connections kept open to the service
+        AWS_CONNECT_TIMEOUT -- seconds to wait for a connection
+        AWS_READ_TIMEOUT -- seconds to wait for a response
+        AWS_MAX_ATTEMPTS -- attempts per call, including the first
+        AWS_RETRY_MODE -- legacy, standard or adaptive retries
     """
     # The default AWS Region
     _default_region = "us-east-1"
+    # The default client settings, overridden by environment variables
+    DEFAULT_MAX_POOL_CONNECTIONS = "10"
+    DEFAULT_CONNECT_TIMEOUT = "2"
+    DEFAULT_READ_TIMEOUT = "5"
+    DEFAULT_MAX_ATTEMPTS = "3"
+    # adaptive retries also rate limit the client while it is being throttled
+    DEFAULT_RETRY_MODE = "adaptive"
+    RETRY_MODES = ("legacy", "standard", "adaptive")
     _client = None
 
     def __init__(self, client_type: str, client:object=None) -> None:
         if client is None:
-            client = self._generate_client(client_type)
+            client = self._get_client(client_type)
 
-        self._client = client        
+        self._client = client
 
-    def _generate_client(self, client_type: str) -> object:
+    def _get_client(self, client_type: str) -> object:
         """
-        _generate_client creates a AWS client based on environment
+        _get_client returns the shared client for the environment, building
+        it the first time
         Args
         ----
         client_type (str) - the type of AWS client to return
@@ -26,7 +57,21 @@ class AWSBase:
         -------
         object - an AWS client
         """
+        _key = (client_type,) + self._get_credentials() + tuple(sorted(self._get_client_settings().items()))
 
+        # building clients from boto3's default session isn't thread safe
+        with _clients_lock:
+            if _key not in _clients:
+                _clients[_key] = self._generate_client(client_type)
+            return _clients[_key]
+
+    def _get_credentials(self) -> tuple:
+        """
+        _get_credentials reads the AWS credentials and region from the environment
+        Returns
+        -------
+        tuple - access key id, secret access key, session token and region
+        """
         # Attempt to get AWS Variables from the environment
         _access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
         _secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
@@ -37,24 +82,90 @@ class AWSBase:
         if _region is None:
             _region = self._default_region
 
+        return _access_key_id, _secret_access_key, _session_token, _region
+
+    def _get_client_settings(self) -> dict:
+        """
+        _get_client_settings reads the connection pool, timeout and retry
+        settings from the environment
+        Returns
+        -------
+        dict - max_pool_connections, connect_timeout, read_timeout, max_attempts and retry_mode
+        Raises
+        ------
+        ValueError - if a setting isn't valid
+        """
+        _settings = {}
+        for _name, _default, _type in (("max_pool_connections", self.DEFAULT_MAX_POOL_CONNECTIONS, int),
+                                       ("connect_timeout", self.DEFAULT_CONNECT_TIMEOUT, float),
+                                       ("read_timeout", self.DEFAULT_READ_TIMEOUT, float),
+                                       ("max_attempts", self.DEFAULT_MAX_ATTEMPTS, int)):
+            _env_var = "AWS_{}".format(_name.upper())
+            _value = os.getenv(_env_var, _default)
+            try:
+                _settings[_name] = _type(_value)
+            except ValueError:
+                raise ValueError("{} must be a number: {}".format(_env_var, _value))
+
+            if _settings[_name] <= 0:
+                raise ValueError("{} must be greater than 0: {}".format(_env_var, _value))
+
+        _settings["retry_mode"] = os.getenv('AWS_RETRY_MODE', self.DEFAULT_RETRY_MODE)
+        if _settings["retry_mode"] not in self.RETRY_MODES:
+            raise ValueError("AWS_RETRY_MODE must be one of {}: {}".format(
+                ", ".join(self.RETRY_MODES), _settings["retry_mode"]))
+
+        return _settings
+
+    def _generate_client(self, client_type: str) -> object:
+        """
+        _generate_client creates a AWS client based on environment
+        Args
+        ----
+        client_type (str) - the type of AWS client to return
+        Returns
+        -------
+        object - an AWS client
+        """
+        _access_key_id, _secret_access_key, _session_token, _region = self._get_credentials()
+        _settings = self._get_client_settings()
+
+        # boto3 takes most of the start up time, so it is only imported
+        # when a client is built
+        import boto3
+        from botocore.config import Config
+
+        # bound the connection pool and how long a slow endpoint can stall a call
+        _config = Config(
+            max_pool_connections = _settings["max_pool_connections"],
+            connect_timeout = _settings["connect_timeout"],
+            read_timeout = _settings["read_timeout"],
+            retries = {
+                "total_max_attempts": _settings["max_attempts"],
+                "mode": _settings["retry_mode"]
+            }
+        )
+
         # Create an empty variable for the client
         client = None
 
         if _access_key_id is None:
             # if auth variables are not present, attempt to get a client with out
-            client = boto3.client(client_type)
+            client = boto3.client(client_type, config = _config)
         elif _session_token is None:
             client = boto3.client(client_type,
                 aws_access_key_id = _access_key_id,
                 aws_secret_access_key = _secret_access_key,
-                region_name = _region
+                region_name = _region,
+                config = _config
             )
         else:
             client = boto3.client(client_type,
                 aws_access_key_id = _access_key_id,
                 aws_secret_access_key = _secret_access_key,
                 aws_session_token = _session_token,
-                region_name = _region
+                region_name = _region,
+                config = _config
             )
 
-        return client
\ No newline at end of file
+        return client
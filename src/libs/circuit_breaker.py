@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+
+# The circuit states, see CircuitBreaker
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+
+class CircuitOpenException(Exception):
+    """Exception raised when a call is refused because its circuit is open
+    Attributes:
+        name -- the name of the circuit
+        retry_in -- seconds until a call will be tried again
+        message -- explination of the error
+    """
+    def __init__(self, name:str, retry_in:float) -> None:
+        self.name = name
+        self.retry_in = retry_in
+        self.message = "Circuit {} is open, retrying in {:.1f} seconds".format(name, retry_in)
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class CircuitBreaker:
+    """CircuitBreaker stops calls to a dependency after it fails repeatedly,
+    so callers fail fast instead of waiting on, and adding load to, a
+    service which is throttling or down
+
+    The circuit opens after failure_threshold consecutive failures. Once
+    reset_timeout seconds have passed a single trial call is let through
+    (half-open), its success closes the circuit and its failure opens it
+    again.
+
+    Attributes:
+        state -- closed, open or half-open
+        failures -- consecutive failed calls
+        opened -- times the circuit has opened
+
+    Methods
+    -------
+    allow() - raises CircuitOpenException if a call shouldn't be made
+    record_success() - records a call which succeeded
+    record_failure() - records a call which failed
+    """
+    def __init__(self, name:str, failure_threshold:int=5, reset_timeout:float=30,
+                 clock=time.monotonic) -> None:
+        """
+        Args:
+            name (str): the name of the circuit, used in logs and exceptions
+            failure_threshold (int, optional): consecutive failures which open the circuit. Defaults to 5.
+            reset_timeout (float, optional): seconds before a trial call. Defaults to 30.
+            clock (callable, optional): returns the current time in seconds. Defaults to time.monotonic.
+        """
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1: {}".format(failure_threshold))
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened = 0
+        self._clock = clock
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> None:
+        """Checks a call may be made, while half-open only one trial call is allowed
+
+        Raises:
+            CircuitOpenException: if the circuit is open
+        """
+        with self._lock:
+            if self.state == CIRCUIT_CLOSED:
+                return
+
+            _retry_in = self._opened_at + self.reset_timeout - self._clock()
+            # the trial call is in flight, or it is too soon for one
+            if self.state == CIRCUIT_HALF_OPEN or _retry_in > 0:
+                raise CircuitOpenException(self.name, max(_retry_in, 0.0))
+
+            logging.info("Circuit %s is half-open, trying a call", self.name)
+            self.state = CIRCUIT_HALF_OPEN
+
+    def record_success(self) -> None:
+        """Records a call which succeeded, closing the circuit"""
+        with self._lock:
+            if self.state != CIRCUIT_CLOSED:
+                logging.info("Circuit %s is closed", self.name)
+            self.state = CIRCUIT_CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        """Records a call which failed, opening the circuit at the threshold
+        or when the trial call fails"""
+        with self._lock:
+            self.failures += 1
+            if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != CIRCUIT_OPEN:
+                    logging.warning("Circuit %s is open after %s failures, retrying in %s seconds",
+                                    self.name, self.failures, self.reset_timeout)
+                    self.opened += 1
+                self.state = CIRCUIT_OPEN
+                self._opened_at = self._clock()
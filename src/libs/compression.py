@@ -0,0 +1,107 @@
+import gzip
+import zlib
+from functools import lru_cache
+
+# Content codings the service can produce, in order of preference
+ENCODINGS = ("gzip", "deflate")
+
+
+@lru_cache(maxsize=256)
+def negotiate(accept_encoding:str) -> str:
+    """Picks a content coding from an Accept-Encoding header
+
+    Clients send few distinct headers, so results are cached.
+
+    Args:
+        accept_encoding (str): the Accept-Encoding header
+
+    Returns:
+        str: the preferred coding from ENCODINGS or None for the identity coding
+    """
+    if not accept_encoding:
+        return None
+
+    _qualities = {}
+    for _item in accept_encoding.split(","):
+        _coding, _, _params = _item.partition(";")
+        _coding = _coding.strip().lower()
+        _quality = 1.0
+
+        _params = _params.strip()
+        if _params.startswith("q="):
+            try:
+                _quality = float(_params[2:])
+            except ValueError:
+                _quality = 0.0
+        _qualities[_coding] = _quality
+
+    _best = None
+    _best_quality = 0.0
+    for _coding in ENCODINGS:
+        _quality = _qualities.get(_coding, _qualities.get("*", 0.0))
+        if _quality > _best_quality:
+            _best, _best_quality = _coding, _quality
+
+    return _best
+
+
+def compress(body:bytes, encoding:str, level:int=6) -> bytes:
+    """Compresses a body with a content coding
+
+    Args:
+        body (bytes): the body to compress
+        encoding (str): one of ENCODINGS
+        level (int, optional): compression level from 1 to 9. Defaults to 6.
+
+    Raises:
+        ValueError: if the encoding isn't supported
+
+    Returns:
+        bytes: the compressed body
+    """
+    if encoding == "gzip":
+        # a fixed mtime keeps the output, and so the entity tag, stable
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if encoding == "deflate":
+        return zlib.compress(body, level)
+    raise ValueError("Unsupported content encoding: {}".format(encoding))
+
+
+# zlib window bits which frame a compressed stream for each content coding
+_STREAM_WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+def compress_stream(chunks, encoding:str, level:int=6):
+    """Compresses a body of byte chunks with a content coding as they are produced
+
+    Only the compressor's window is held in memory, and the chunks are
+    closed when the stream is, so the source can release what it reads.
+
+    Args:
+        chunks (iterable): the chunks of the body
+        encoding (str): one of ENCODINGS
+        level (int, optional): compression level from 1 to 9. Defaults to 6.
+
+    Raises:
+        ValueError: if the encoding isn't supported
+
+    Yields:
+        bytes: the compressed chunks
+    """
+    if encoding not in _STREAM_WBITS:
+        raise ValueError("Unsupported content encoding: {}".format(encoding))
+    return _compress_chunks(chunks, zlib.compressobj(level, zlib.DEFLATED, _STREAM_WBITS[encoding]))
+
+
+def _compress_chunks(chunks, compressor):
+    """Yields chunks compressed with a zlib compressor, then its trailer"""
+    try:
+        for _chunk in chunks:
+            _compressed = compressor.compress(_chunk)
+            # the compressor buffers small chunks until it has a block to emit
+            if _compressed:
+                yield _compressed
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
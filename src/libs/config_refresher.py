@@ -0,0 +1,110 @@
+import logging
+import os
+import random
+import threading
+import time
+
+
+class ConfigRefresher:
+    """ConfigRefresher periodically loads a new configuration on a
+    background thread and hands it to an apply callable
+
+    The configuration is built completely before it is applied, so readers
+    only ever see the old or the new object, never a mix. Polling is
+    jittered so many tasks don't hit the parameter store together, and
+    failures (such as throttling) back off exponentially.
+
+    Attributes:
+        version -- the version of the last applied configuration
+        last_refresh -- epoch time of the last successful load
+        last_change -- epoch time the configuration last changed
+        failures -- consecutive failed loads
+
+    Methods
+    -------
+    start() - starts polling on a daemon thread
+    stop() - stops polling
+    refresh() - loads and applies the configuration once
+    """
+    def __init__(self, load, apply, interval:float, version:str=None,
+                 jitter:float=0.1, max_backoff:float=900) -> None:
+        """
+        Args:
+            load (callable): returns a new configuration with a version attribute
+            apply (callable): called with a configuration whose version changed
+            interval (float): seconds between loads
+            version (str, optional): version of the configuration in use. Defaults to None.
+            jitter (float, optional): fraction of the delay to randomize. Defaults to 0.1.
+            max_backoff (float, optional): longest delay after failures. Defaults to 900.
+        """
+        self._load = load
+        self._apply = apply
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.version = version
+        self.last_refresh = None
+        self.last_change = None
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._fork_hook_registered = False
+
+    def start(self) -> None:
+        """Starts polling on a daemon thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="config-refresher", daemon=True)
+        self._thread.start()
+
+        # threads don't survive fork, so forked workers start their own
+        if not self._fork_hook_registered and hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._fork_hook_registered = True
+
+    def _after_fork(self) -> None:
+        if self._thread is not None and not self._stop.is_set():
+            self._stop = threading.Event()
+            self.start()
+
+    def stop(self) -> None:
+        """Stops polling and waits for the thread to exit"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def next_delay(self) -> float:
+        """Returns the seconds to wait before the next load"""
+        _delay = self.interval
+        if self.failures:
+            _delay = min(self.interval * (2 ** self.failures), self.max_backoff)
+
+        return _delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def refresh(self) -> bool:
+        """Loads the configuration and applies it if its version changed
+
+        Returns:
+            bool: True if the load succeeded
+        """
+        try:
+            _config = self._load()
+        except Exception as e:
+            self.failures += 1
+            logging.warning("Unable to refresh configuration (%s consecutive failures): %s",
+                            self.failures, e)
+            return False
+
+        self.failures = 0
+        self.last_refresh = time.time()
+
+        if _config.version != self.version:
+            logging.info("Configuration changed from version %s to %s", self.version, _config.version)
+            self._apply(_config)
+            self.version = _config.version
+            self.last_change = self.last_refresh
+
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.next_delay()):
+            self.refresh()
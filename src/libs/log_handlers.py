@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# The logger structured access lines are written to
+ACCESS_LOGGER_NAME = "access"
+
+# Supported logging modes
+LOG_MODE_STREAM = "stream"
+LOG_MODE_QUEUE = "queue"
+LOG_MODES = (LOG_MODE_STREAM, LOG_MODE_QUEUE)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """DeferredQueueHandler enqueues records without formatting them, so the
+    request thread only pays for creating the record
+
+    Formatting happens on the QueueListener's thread. Records are dropped,
+    and counted, when the queue is full rather than blocking the caller.
+    """
+    def __init__(self, log_queue:queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record:logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record:logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonAccessFormatter(logging.Formatter):
+    """JsonAccessFormatter writes access records as one JSON object per line"""
+    def format(self, record:logging.LogRecord) -> str:
+        _line = {"time": self.formatTime(record)}
+        _line.update(getattr(record, "access", {}))
+        return json.dumps(_line)
+
+
+class AccessLog:
+    """AccessLog writes structured access lines, optionally sampled
+
+    Attributes:
+        sample_rate -- the fraction of requests logged, errors are always logged
+    """
+    def __init__(self, sample_rate:float=1.0) -> None:
+        self.sample_rate = sample_rate
+        self._logger = logging.getLogger(ACCESS_LOGGER_NAME)
+
+    def sampled(self) -> bool:
+        """Returns True if the current request should be logged"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def log(self, client:str, method:str, path:str, status:int, size:int, duration:float) -> None:
+        """Logs a request
+
+        Args:
+            client (str): the client address
+            method (str): the HTTP method
+            path (str): the request path
+            status (int): the response code
+            size (int): bytes in the response body
+            duration (float): seconds spent handling the request
+        """
+        if status < 500 and not self.sampled():
+            return
+
+        if not self._logger.isEnabledFor(logging.INFO):
+            return
+
+        self._logger.info("access", extra={"access": {
+            "client": client,
+            "method": method,
+            "path": path,
+            "status": int(status),
+            "bytes": size,
+            "duration_ms": round(duration * 1000, 3)
+        }})
+
+
+# The access log shared by every serving mode
+access_log = AccessLog()
+
+
+def _is_access_record(record:logging.LogRecord) -> bool:
+    return record.name == ACCESS_LOGGER_NAME
+
+
+def _is_not_access_record(record:logging.LogRecord) -> bool:
+    return record.name != ACCESS_LOGGER_NAME
+
+
+def _restart_listener(listener:QueueListener, queue_handler:QueueHandler, queue_size:int) -> None:
+    """Starts a running listener again in a forked child, whose copy has no thread"""
+    # _thread is only set while the listener is running, a stopped one stays stopped
+    if listener._thread is None:
+        return
+
+    # a new queue, so the child doesn't write the parent's records or share its locks
+    _queue = queue.Queue(maxsize=queue_size)
+    queue_handler.queue = _queue
+    listener.queue = _queue
+    listener._thread = None
+    listener.start()
+
+
+def configure_logging(handlers:list, log_level:int, mode:str=LOG_MODE_STREAM,
+                      queue_size:int=10000) -> QueueListener:
+    """Installs handlers on the root logger and a JSON handler on the access logger
+
+    Levels are applied by the loggers, not the handlers, so changing the
+    root logger's level is enough to change what is logged. In queue mode
+    every logger writes to a DeferredQueueHandler and the given handlers
+    run on a QueueListener thread, which forked children start again.
+
+    Args:
+        handlers (list): handlers for application log lines
+        log_level (int): the log level
+        mode (str, optional): stream or queue. Defaults to stream.
+        queue_size (int, optional): records held before dropping. Defaults to 10000.
+
+    Raises:
+        ValueError: if mode isn't stream or queue
+
+    Returns:
+        QueueListener: the started listener in queue mode, otherwise None
+    """
+    if mode not in LOG_MODES:
+        raise ValueError("Unknown log mode: {}".format(mode))
+
+    _access_handler = logging.StreamHandler(sys.stderr)
+    _access_handler.setFormatter(JsonAccessFormatter())
+    _access_logger = logging.getLogger(ACCESS_LOGGER_NAME)
+    _access_logger.propagate = False
+    _access_logger.setLevel(logging.INFO)
+
+    for _handler in handlers:
+        _handler.setLevel(logging.NOTSET)
+
+    _listener = None
+    if mode == LOG_MODE_QUEUE:
+        # one listener writes both kinds of record to their own handlers
+        for _handler in handlers:
+            _handler.addFilter(_is_not_access_record)
+        _access_handler.addFilter(_is_access_record)
+
+        _queue_handler = DeferredQueueHandler(queue.Queue(maxsize=queue_size))
+        _listener = QueueListener(_queue_handler.queue, *handlers, _access_handler,
+                                  respect_handler_level=True)
+        _listener.start()
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(
+                after_in_child=lambda: _restart_listener(_listener, _queue_handler, queue_size))
+
+        _root_handlers = [_queue_handler]
+        _access_logger.handlers = [_queue_handler]
+    else:
+        _root_handlers = handlers
+        _access_logger.handlers = [_access_handler]
+
+    logging.basicConfig(level=log_level, handlers=_root_handlers, force=True)
+    return _listener
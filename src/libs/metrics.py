@@ -0,0 +1,201 @@
+import threading
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the request latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The prefix of every metric name
+METRIC_PREFIX = "user_service"
+
+# The content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Shard:
+    """_Shard holds the measurements written by a single thread"""
+    __slots__ = ("started", "finished", "requests", "counters")
+
+    def __init__(self) -> None:
+        self.started = 0
+        self.finished = 0
+        # (route, status) -> [bucket counts..., +Inf count, sum of durations]
+        self.requests = {}
+        # (name, labels) -> count
+        self.counters = {}
+
+
+class Metrics:
+    """Metrics records request counts, latency histograms and counters and
+    renders them in the Prometheus text format
+
+    Every thread writes to its own shard, so recording takes no lock and
+    threads never contend. Shards are only summed when metrics are rendered.
+    Metrics are per process, so each pre-forked worker reports its own.
+
+    Methods
+    -------
+    request_started() - marks a request as in flight, returns a token
+    request_finished(token, route, status, duration) - records a finished request
+    inc(name, labels) - increments a counter
+    render(extra) - returns the metrics in the Prometheus text format
+    """
+    def __init__(self, buckets:tuple=DEFAULT_BUCKETS) -> None:
+        """
+        Args:
+            buckets (tuple, optional): latency bucket upper bounds in seconds.
+                Defaults to DEFAULT_BUCKETS.
+        """
+        self.buckets = tuple(buckets)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._help = {}
+
+    def _shard(self) -> _Shard:
+        """Returns the calling thread's shard, creating it on first use"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            _shard = _Shard()
+            self._local.shard = _shard
+            with self._shards_lock:
+                self._shards.append(_shard)
+            return _shard
+
+    def request_started(self) -> _Shard:
+        """Marks a request as in flight
+
+        Returns:
+            _Shard: a token to pass to request_finished
+        """
+        _shard = self._shard()
+        _shard.started += 1
+        return _shard
+
+    def request_finished(self, token:_Shard, route:str, status:int, duration:float) -> None:
+        """Records a finished request
+
+        Args:
+            token (_Shard): the token returned by request_started
+            route (str): name of the route which handled the request
+            status (int): the response code
+            duration (float): seconds spent handling the request
+        """
+        token.finished += 1
+
+        _key = (route, status)
+        _histogram = token.requests.get(_key)
+        if _histogram is None:
+            _histogram = [0] * (len(self.buckets) + 2)
+            token.requests[_key] = _histogram
+        _histogram[bisect_left(self.buckets, duration)] += 1
+        _histogram[-1] += duration
+
+    def describe(self, name:str, help_text:str) -> None:
+        """Sets the help text of a counter"""
+        self._help[name] = help_text
+
+    def inc(self, name:str, labels:tuple=(), amount:int=1) -> None:
+        """Increments a counter
+
+        Args:
+            name (str): counter name, without the metric prefix
+            labels (tuple, optional): (label, value) pairs. Defaults to ().
+            amount (int, optional): amount to add. Defaults to 1.
+        """
+        _counters = self._shard().counters
+        _key = (name, labels)
+        _counters[_key] = _counters.get(_key, 0) + amount
+
+    def _collect(self) -> tuple:
+        """Sums every shard
+
+        Returns:
+            tuple: (in flight, requests, latency, counters)
+        """
+        with self._shards_lock:
+            _shards = list(self._shards)
+
+        _in_flight = 0
+        _requests = {}
+        _latency = {}
+        _counters = {}
+
+        for _shard in _shards:
+            _in_flight += _shard.started - _shard.finished
+            # dict() and list() copy in one step, so a writing thread can't change them mid-copy
+            for (_route, _status), _histogram in dict(_shard.requests).items():
+                _histogram = list(_histogram)
+                _key = (_route, _status)
+                _requests[_key] = _requests.get(_key, 0) + sum(_histogram[:-1])
+                _total = _latency.setdefault(_route, [0] * len(_histogram))
+                for i, _value in enumerate(_histogram):
+                    _total[i] += _value
+            for _key, _value in dict(_shard.counters).items():
+                _counters[_key] = _counters.get(_key, 0) + _value
+
+        return max(_in_flight, 0), _requests, _latency, _counters
+
+    @staticmethod
+    def _labels(pairs) -> str:
+        if not pairs:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(key, value) for key, value in pairs) + "}"
+
+    def render(self, extra:list=None) -> str:
+        """Renders the metrics in the Prometheus text format
+
+        Args:
+            extra (list, optional): (name, type, help, value) samples computed by
+                the caller, such as cache sizes. Defaults to None.
+
+        Returns:
+            str: the metrics
+        """
+        _in_flight, _requests, _latency, _counters = self._collect()
+        _lines = []
+
+        _name = "{}_requests_total".format(METRIC_PREFIX)
+        _lines.append("# HELP {} Requests handled, by route and status".format(_name))
+        _lines.append("# TYPE {} counter".format(_name))
+        for (_route, _status), _value in sorted(_requests.items()):
+            _lines.append("{}{} {}".format(_name, self._labels((("route", _route), ("status", _status))), _value))
+
+        _name = "{}_request_duration_seconds".format(METRIC_PREFIX)
+        _lines.append("# HELP {} Time spent handling requests, by route".format(_name))
+        _lines.append("# TYPE {} histogram".format(_name))
+        for _route, _histogram in sorted(_latency.items()):
+            _cumulative = 0
+            for _bound, _value in zip(self.buckets + ("+Inf",), _histogram[:-1]):
+                _cumulative += _value
+                _lines.append("{}_bucket{} {}".format(
+                    _name, self._labels((("route", _route), ("le", _bound))), _cumulative))
+            _lines.append("{}_sum{} {}".format(_name, self._labels((("route", _route),)), _histogram[-1]))
+            _lines.append("{}_count{} {}".format(_name, self._labels((("route", _route),)), _cumulative))
+
+        _name = "{}_requests_in_flight".format(METRIC_PREFIX)
+        _lines.append("# HELP {} Requests being handled".format(_name))
+        _lines.append("# TYPE {} gauge".format(_name))
+        _lines.append("{} {}".format(_name, _in_flight))
+
+        _described = set()
+        for (_counter, _labels), _value in sorted(_counters.items()):
+            _name = "{}_{}".format(METRIC_PREFIX, _counter)
+            if _counter not in _described:
+                _described.add(_counter)
+                if _counter in self._help:
+                    _lines.append("# HELP {} {}".format(_name, self._help[_counter]))
+                _lines.append("# TYPE {} counter".format(_name))
+            _lines.append("{}{} {}".format(_name, self._labels(_labels), _value))
+
+        for _extra_name, _type, _help, _value in extra or []:
+            _name = "{}_{}".format(METRIC_PREFIX, _extra_name)
+            _lines.append("# HELP {} {}".format(_name, _help))
+            _lines.append("# TYPE {} {}".format(_name, _type))
+            _lines.append("{} {}".format(_name, _value))
+
+        return "\n".join(_lines) + "\n"
+
+
+# The metrics shared by every serving mode
+metrics = Metrics()
@@ -1,6 +1,18 @@
+import logging
 from .aws_base import AWSBase
+from .circuit_breaker import CircuitBreaker, CircuitOpenException
 from abc import ABC
 
+# Error codes AWS returns when it is throttling or can't serve a request
+UNAVAILABLE_ERROR_CODES = (
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "InternalServerError",
+    "ServiceUnavailable"
+)
+
 class ParameterNotFoundException(Exception):
     """Exception raised when a parameter can't be found
     Attributes:
@@ -16,6 +28,35 @@ class ParameterNotFoundException(Exception):
         return self.message
 
 
+class ParameterUnavailableException(Exception):
+    """Exception raised when the parameter store can't be read and there
+    is no earlier value of the parameter to use
+    Attributes:
+        parameter_name -- the name of the parameter looked for
+        message -- explination of the error
+    """
+    def __init__(self, parameter_name: str) -> None:
+        self.parameter_name = parameter_name
+        self.message = "Unable to read parameter: {}".format(parameter_name)
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+def _is_unavailable(error:Exception) -> bool:
+    """Returns True if an AWS call failed because the service is throttling,
+    failing or unreachable, rather than because of the request"""
+    # connection errors and timeouts don't carry a response
+    _response = getattr(error, "response", None)
+    if not isinstance(_response, dict):
+        return True
+
+    _code = _response.get('Error', {}).get('Code')
+    _status = _response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    return _code in UNAVAILABLE_ERROR_CODES or _status >= 500
+
+
 class Parameter(ABC):
     """Parameter is an abstract class used to which
         dictates the outline of Parameter classes
@@ -23,24 +64,64 @@ class Parameter(ABC):
     Methods
     -------
         get_value(name:str) - gets the value of a prameter
+        get_values_by_path(path:str) - gets every parameter below a path
         put_parameter(name:str, value:str, description:str) - puts a parameter
     """
     def get_value(self, name:str) -> str:
         """ The is ment to get the value of a paramter"""
 
+    def get_values_by_path(self, path:str) -> dict:
+        """ Gets a dict of every parameter name and value below a path,
+            returns None when the client can't list parameters"""
+
     def put_parameter(self, name:str, value:str, description: str) -> None:
         """ Set's or create a parameter"""
 
 
 class AWSParameter(Parameter, AWSBase):
-    """AWSParameter is a class used to interact with aws parameter stores"""
-    def __init__(self, ssm_client=None):
+    """AWSParameter is a class used to interact with aws parameter stores
+
+    Calls go through a circuit breaker, once SSM has throttled or failed
+    several calls in a row they fail fast instead of waiting on it.
+    get_value then returns the last value read of the parameter, or raises
+    ParameterUnavailableException so the caller can use its default.
+    """
+    def __init__(self, ssm_client=None, breaker:CircuitBreaker=None):
         super().__init__("ssm", ssm_client)
+        self.breaker = breaker if breaker is not None else CircuitBreaker("ssm")
+        # the last value read or written of every parameter
+        self._known_values = {}
+
+    def _call(self, method, **kwargs):
+        """Calls a client method through the circuit breaker
+
+        Raises:
+            CircuitOpenException: if the circuit is open
+        """
+        self.breaker.allow()
+        try:
+            _result = method(**kwargs)
+        except Exception as e:
+            # errors about the request show the service is answering
+            if _is_unavailable(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+
+        self.breaker.record_success()
+        return _result
 
     def get_value(self, name:str) -> str:
         try:
-            _param = self._client.get_parameter(Name=name)
+            # SecureString parameters, such as the admin token, are decrypted
+            _param = self._call(self._client.get_parameter, Name=name, WithDecryption=True)
+        except CircuitOpenException as e:
+            return self._get_known_value(name, e)
         except Exception as e:
+            if _is_unavailable(e):
+                return self._get_known_value(name, e)
+
             error_code = e.response.get('Error').get('Code')
 
             if error_code == 'ParameterNotFound':
@@ -49,13 +130,151 @@ class AWSParameter(Parameter, AWSBase):
                 raise e
         
         _value = _param.get('Parameter').get('Value')
+        self._known_values[name] = _value
         return _value
 
+    def _get_known_value(self, name:str, error:Exception) -> str:
+        """Returns the last value read of a parameter SSM can't serve
+
+        Raises:
+            ParameterUnavailableException: if the parameter hasn't been read before
+        """
+        if name not in self._known_values:
+            raise ParameterUnavailableException(name) from error
+
+        logging.debug("Using the last value read of %s: %s", name, error)
+        return self._known_values[name]
+
+    def get_values_by_path(self, path: str) -> dict:
+        _values = {}
+        _kwargs = {
+            "Path": path,
+            "Recursive": True,
+            "WithDecryption": True,
+            "MaxResults": 10
+        }
+
+        # follow NextToken until every page has been read
+        while True:
+            _page = self._call(self._client.get_parameters_by_path, **_kwargs)
+            for _param in _page.get('Parameters', []):
+                _values[_param.get('Name')] = _param.get('Value')
+
+            _next_token = _page.get('NextToken')
+            if not _next_token:
+                break
+            _kwargs['NextToken'] = _next_token
+
+        self._known_values.update(_values)
+        return _values
+
     def put_parameter(self, name: str, value: str, description: str) -> None:
-        self._client.put_parameter(
+        self._call(self._client.put_parameter,
             Name = name,
             Value = value,
             Description = description,
             Type = 'String',
             Tier = 'Standard'
-        )
\ No newline at end of file
+        )
+        self._known_values[name] = value
+
+
+class CachedParameter(Parameter):
+    """CachedParameter wraps a Parameter client, reading a whole parameter
+    tree in one call and deferring writes until flush() is called
+
+    When the parameter store is throttling, failing or behind an open
+    circuit, the tree isn't read one parameter at a time instead, which
+    would only add load. Its parameters are unavailable until it is loaded.
+
+    Methods
+    -------
+        load(path:str) - reads every parameter below path into the cache
+        flush() - writes the deferred parameters to the wrapped client
+    """
+    def __init__(self, parameter_client:Parameter) -> None:
+        self._parameter_client = parameter_client
+        self._path = None
+        self._values = {}
+        self._pending = []
+        # why the parameter store couldn't be read, None once it has been
+        self._unavailable = None
+
+    def load(self, path:str) -> bool:
+        """Reads every parameter below path into the cache
+
+        Args:
+            path (str): the parameter path to read
+
+        Raises:
+            ParameterUnavailableException: if the parameter store is throttling,
+                failing or behind an open circuit
+
+        Returns:
+            bool: True if the path was loaded, False if reads go to the client
+        """
+        try:
+            _values = self._parameter_client.get_values_by_path(path)
+        except Exception as e:
+            if isinstance(e, CircuitOpenException) or _is_unavailable(e):
+                self._path = path.rstrip("/") + "/"
+                self._values = {}
+                self._unavailable = e
+                raise ParameterUnavailableException(path) from e
+
+            logging.warning("Unable to load parameters below %s, reading them one at a time: %s", path, e)
+            return False
+
+        if _values is None:
+            return False
+
+        logging.debug("Loaded %s parameters below %s", len(_values), path)
+        self._path = path.rstrip("/") + "/"
+        self._values = _values
+        self._unavailable = None
+        return True
+
+    def _is_loaded(self, name:str) -> bool:
+        return self._path is not None and name.startswith(self._path)
+
+    def get_value(self, name:str) -> str:
+        if not self._is_loaded(name):
+            return self._parameter_client.get_value(name)
+
+        if self._unavailable is not None:
+            raise ParameterUnavailableException(name) from self._unavailable
+
+        if name not in self._values:
+            raise ParameterNotFoundException(name)
+
+        return self._values[name]
+
+    def get_values_by_path(self, path:str) -> dict:
+        return self._parameter_client.get_values_by_path(path)
+
+    def put_parameter(self, name:str, value:str, description:str) -> None:
+        if not self._is_loaded(name):
+            self._parameter_client.put_parameter(name=name, value=value, description=description)
+            return
+
+        # the cached value is used straight away, the write happens on flush
+        self._values[name] = value
+        self._pending.append((name, value, description))
+
+    def flush(self) -> int:
+        """Writes the deferred parameters, failures are logged and skipped
+
+        Returns:
+            int: the number of parameters written
+        """
+        _pending, self._pending = self._pending, []
+        _written = 0
+
+        for name, value, description in _pending:
+            try:
+                self._parameter_client.put_parameter(name=name, value=value, description=description)
+                _written += 1
+            except Exception as e:
+                logging.warning("Unable to create parameter %s: %s", name, e)
+
+        return _written
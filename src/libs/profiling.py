@@ -0,0 +1,252 @@
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+from .metrics import metrics
+
+# Trailing worker numbers dropped from thread names, so a pool's threads share a root frame
+_THREAD_NUMBER = re.compile(r"[-_\d]+$")
+
+
+class ProfilerBusyException(Exception):
+    """Exception raised when a profile is requested while one is running
+    Attributes:
+        message -- explination of the error
+    """
+    def __init__(self) -> None:
+        self.message = "A profile is already running"
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class SamplingProfiler:
+    """SamplingProfiler records where every thread of the process spends its
+    time by reading their stacks every interval seconds, instead of tracing
+    every call, so it can run against production traffic
+
+    Only the thread running the profile is slowed, the others are paused
+    for as long as it takes to copy their stacks. One profile runs at a time.
+
+    Attributes:
+        interval -- seconds between samples
+        running -- True while a profile is running
+
+    Methods
+    -------
+    profile(seconds) - samples the stacks for seconds, returns the sample counts
+    collapse(stacks) - formats sample counts as collapsed stacks
+    """
+    def __init__(self, interval:float=0.01, clock=time.monotonic, sleep=time.sleep) -> None:
+        """
+        Args:
+            interval (float, optional): seconds between samples. Defaults to 0.01.
+            clock (callable, optional): returns the current time in seconds. Defaults to time.monotonic.
+            sleep (callable, optional): waits for a number of seconds. Defaults to time.sleep.
+        """
+        self.interval = interval
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        """True while a profile is running"""
+        return self._lock.locked()
+
+    def profile(self, seconds:float) -> dict:
+        """Samples the stacks of every other thread for seconds
+
+        Args:
+            seconds (float): how long to sample for
+
+        Raises:
+            ProfilerBusyException: if a profile is already running
+
+        Returns:
+            dict: the number of samples of each stack, keyed by a tuple of
+                frames from the thread down to the running function
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyException()
+
+        try:
+            _own_id = threading.get_ident()
+            _stacks = {}
+            # frame labels, code objects are shared by every call of a function
+            _labels = {}
+            _deadline = self._clock() + seconds
+
+            while self._clock() < _deadline:
+                _names = {_thread.ident: _thread.name for _thread in threading.enumerate()}
+                for _thread_id, _frame in sys._current_frames().items():
+                    if _thread_id == _own_id:
+                        continue
+
+                    _stack = []
+                    while _frame is not None:
+                        _code = _frame.f_code
+                        _label = _labels.get(_code)
+                        if _label is None:
+                            _label = self._label(_code)
+                            _labels[_code] = _label
+                        _stack.append(_label)
+                        _frame = _frame.f_back
+
+                    _stack.append(_THREAD_NUMBER.sub("", _names.get(_thread_id, "thread")) or "thread")
+                    _stack = tuple(reversed(_stack))
+                    _stacks[_stack] = _stacks.get(_stack, 0) + 1
+
+                self._sleep(self.interval)
+
+            return _stacks
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _label(code) -> str:
+        """Returns the name of a function as module:qualified name"""
+        _module = os.path.splitext(os.path.basename(code.co_filename))[0]
+        # co_qualname, which includes the class, is new in Python 3.11
+        return "{}:{}".format(_module, getattr(code, "co_qualname", code.co_name))
+
+    @staticmethod
+    def collapse(stacks:dict) -> str:
+        """Formats sample counts as collapsed stacks, one "frame;frame;... count"
+        line per stack, the input of flamegraph.pl and speedscope
+
+        Args:
+            stacks (dict): sample counts returned by profile
+
+        Returns:
+            str: the collapsed stacks
+        """
+        return "".join("{} {}\n".format(";".join(_frame.replace(";", ":") for _frame in _stack), _count)
+                       for _stack, _count in sorted(stacks.items()))
+
+
+class _TraceState(threading.local):
+    """_TraceState holds the phases of the trace running on each thread"""
+    # a class default, so threads which aren't tracing find None without an AttributeError
+    phases = None
+
+
+class RequestTracer:
+    """RequestTracer times the phases of a sampled fraction of requests,
+    such as routing, lookups and serialization
+
+    A request is traced from start() to finish() on the thread handling it.
+    A phase is timed by taking a mark() before it and passing the mark to
+    record() after it, mark() returns None when the request isn't traced so
+    the phase is only recorded when the mark isn't None:
+
+        _mark = tracer.mark()
+        _user = user_store.get_user(user_id)
+        if _mark is not None:
+            tracer.record("lookup", _mark)
+
+    which keeps the cost of an untraced phase to one call. Phases of a
+    traced request are summed into counters and the latest traces are kept.
+
+    Attributes:
+        sample_rate -- the fraction of requests traced, 0 turns tracing off
+        traces -- the latest traces, oldest first
+
+    Methods
+    -------
+    start() - begins tracing the calling thread's request if it is sampled
+    mark() - returns the start of a phase, or None if the request isn't traced
+    record(name, mark) - adds the time since mark to a phase
+    finish(route, status, duration) - records the calling thread's trace
+    recent() - returns the latest traces
+    """
+    def __init__(self, sample_rate:float=0.0, max_traces:int=100, counters=None) -> None:
+        """
+        Args:
+            sample_rate (float, optional): the fraction of requests traced. Defaults to 0.0.
+            max_traces (int, optional): the number of traces kept. Defaults to 100.
+            counters (Metrics, optional): metrics the phase times are added to. Defaults to None.
+        """
+        self.sample_rate = sample_rate
+        self.traces = deque(maxlen=max_traces)
+        self._counters = counters
+        self._local = _TraceState()
+        # only traced requests take the lock, to add their trace
+        self._lock = threading.Lock()
+
+    def start(self) -> bool:
+        """Begins tracing the calling thread's request if it is sampled
+
+        Returns:
+            bool: True if the request is traced, finish() must then be called
+        """
+        if not self.sample_rate or (self.sample_rate < 1.0 and random.random() >= self.sample_rate):
+            return False
+
+        self._local.phases = {}
+        return True
+
+    def mark(self) -> float:
+        """Returns the start of a phase of the calling thread's request
+
+        Returns:
+            float: the time, or None if the request isn't traced
+        """
+        if self._local.phases is None:
+            return None
+        return time.perf_counter()
+
+    def record(self, name:str, mark:float) -> None:
+        """Adds the time since mark to a phase of the calling thread's
+        request, phases with the same name are added together
+
+        Args:
+            name (str): the name of the phase
+            mark (float): the time returned by mark()
+        """
+        _phases = self._local.phases
+        # the request was finished while the phase was running
+        if _phases is None:
+            return
+        _phases[name] = _phases.get(name, 0.0) + time.perf_counter() - mark
+
+    def finish(self, route:str, status:int, duration:float) -> None:
+        """Records the calling thread's trace
+
+        Args:
+            route (str): name of the route which handled the request
+            status (int): the response code
+            duration (float): seconds spent handling the request
+        """
+        _phases = self._local.phases
+        self._local.phases = None
+
+        with self._lock:
+            self.traces.append({
+                "time": time.time(),
+                "route": route,
+                "status": status,
+                "duration": duration,
+                "phases": _phases
+            })
+
+        if self._counters is not None:
+            self._counters.inc("traced_requests_total", (("route", route),))
+            for _name, _seconds in _phases.items():
+                self._counters.inc("request_phase_seconds_total", (("phase", _name),), _seconds)
+
+    def recent(self) -> list:
+        """Returns the latest traces, oldest first"""
+        with self._lock:
+            return list(self.traces)
+
+
+# The profiler and tracer shared by every serving mode, both are per process
+profiler = SamplingProfiler()
+tracer = RequestTracer(counters=metrics)
+metrics.describe("traced_requests_total", "Requests traced, by route")
+metrics.describe("request_phase_seconds_total", "Time spent in each phase of traced requests")
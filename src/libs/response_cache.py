@@ -0,0 +1,192 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Bytes counted for every entry on top of its body
+ENTRY_OVERHEAD = 200
+
+
+def variant_etag(etag:str, encoding:str) -> str:
+    """Returns the entity tag of a body in a content coding, which differs
+    from the identity tag since the bytes differ"""
+    return '{}-{}"'.format(etag[:-1], encoding)
+
+
+class CachedResponse:
+    """CachedResponse is an encoded response body ready to be written
+
+    Attributes:
+        body -- the encoded body
+        etag -- a strong entity tag for the body
+        last_modified -- a HTTP date for the Last-Modified header, or None
+        variants -- content coding -> (compressed body, entity tag)
+    """
+    __slots__ = ("body", "etag", "last_modified", "variants")
+
+    def __init__(self, body:bytes, last_modified:str=None) -> None:
+        self.body = body
+        self.etag = '"{}"'.format(hashlib.blake2b(body, digest_size=12).hexdigest())
+        self.last_modified = last_modified
+        self.variants = {}
+
+    def size(self) -> int:
+        """Returns the bytes counted against the cache size"""
+        return len(self.body) + ENTRY_OVERHEAD + sum(len(body) for body, _ in self.variants.values())
+
+
+class ResponseCache:
+    """ResponseCache is a thread safe LRU cache of encoded responses
+
+    Every lookup passes a generation describing the data the responses were
+    built from, for example the user store and the enabled features. When
+    the generation changes every cached response is dropped, so entries are
+    never served after the data behind them changed.
+
+    Methods
+    -------
+    get(key, generation) - returns a CachedResponse or None
+    put(key, generation, body) - caches and returns a CachedResponse
+    invalidate(key) - drops the entry for key
+    get_variant(key, response, encoding, encode) - returns a compressed body, encoded once
+    clear() - drops every entry
+    """
+    def __init__(self, max_entries:int=100000, max_bytes:int=67108864) -> None:
+        """
+        Args:
+            max_entries (int, optional): most entries kept. Defaults to 100000.
+            max_bytes (int, optional): most bytes kept. Defaults to 64MiB.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # incremented by every invalidate()
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def get(self, key, generation) -> CachedResponse:
+        """Returns the cached response for key or None
+
+        Args:
+            key: the cache key
+            generation: the generation of the data the caller expects
+
+        Returns:
+            CachedResponse: the cached response or None
+        """
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+
+            _entry = self._entries.get(key)
+            if _entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return _entry
+
+    def put(self, key, generation, body:bytes, last_modified:str=None,
+            invalidations:int=None) -> CachedResponse:
+        """Caches a body and returns it as a CachedResponse
+
+        Args:
+            key: the cache key
+            generation: the generation of the data body was built from
+            body (bytes): the encoded body
+            last_modified (str, optional): a HTTP date the body last changed. Defaults to None.
+            invalidations (int, optional): the value of invalidations before the data
+                was read, the body isn't cached if an entry was invalidated since,
+                as the data may have changed under it. Defaults to None.
+
+        Returns:
+            CachedResponse: the cached response
+        """
+        _entry = CachedResponse(body, last_modified)
+
+        with self._lock:
+            if generation != self._generation:
+                self._reset(generation)
+
+            if self.max_entries < 1 or _entry.size() > self.max_bytes:
+                return _entry
+            if invalidations is not None and invalidations != self.invalidations:
+                return _entry
+
+            _old = self._entries.pop(key, None)
+            if _old is not None:
+                self._bytes -= _old.size()
+
+            self._entries[key] = _entry
+            self._bytes += _entry.size()
+
+            self._evict()
+
+        return _entry
+
+    def get_variant(self, key, response:CachedResponse, encoding:str, encode) -> tuple:
+        """Returns a response body in a content coding, encoding it only
+        the first time it is asked for
+
+        Args:
+            key: the cache key of response
+            response (CachedResponse): the response to encode
+            encoding (str): the content coding, like gzip
+            encode (callable): called with the body to produce the coding
+
+        Returns:
+            tuple: (encoded body, entity tag)
+        """
+        _variant = response.variants.get(encoding)
+        if _variant is not None:
+            return _variant
+
+        _variant = (encode(response.body), variant_etag(response.etag, encoding))
+
+        with self._lock:
+            if encoding in response.variants:
+                return response.variants[encoding]
+
+            response.variants[encoding] = _variant
+            # count the variant while the response is cached
+            if self._entries.get(key) is response:
+                self._bytes += len(_variant[0])
+                self._evict()
+
+        return _variant
+
+    def invalidate(self, key) -> None:
+        """Drops the entry for key, for example after it was written"""
+        with self._lock:
+            self.invalidations += 1
+            _old = self._entries.pop(key, None)
+            if _old is not None:
+                self._bytes -= _old.size()
+
+    def clear(self) -> None:
+        """Drops every entry"""
+        with self._lock:
+            self._reset(None)
+
+    def _evict(self) -> None:
+        """Evicts the least recently used entries until the cache fits its limits"""
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, _evicted = self._entries.popitem(last=False)
+            self._bytes -= _evicted.size()
+
+    def _reset(self, generation) -> None:
+        self._entries.clear()
+        self._bytes = 0
+        self._generation = generation
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        """The bytes counted against max_bytes"""
+        return self._bytes
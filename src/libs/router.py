@@ -0,0 +1,185 @@
+class RouteNotFoundException(Exception):
+    """Exception raised when no route matches a path
+    Attributes:
+        path -- the path which was requested
+        message -- explination of the error
+    """
+    def __init__(self, path:str) -> None:
+        self.path = path
+        self.message = "No route for path: {}".format(path)
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class MethodNotAllowedException(Exception):
+    """Exception raised when a path has routes, but not for the method
+    Attributes:
+        path -- the path which was requested
+        method -- the method which was requested
+        allowed -- the methods the path accepts
+        message -- explination of the error
+    """
+    def __init__(self, path:str, method:str, allowed:tuple) -> None:
+        self.path = path
+        self.method = method
+        self.allowed = allowed
+        self.message = "Method {} not allowed for path: {}".format(method, path)
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class Route:
+    """Route is a handler registered for a method and path pattern"""
+    __slots__ = ("method", "pattern", "name", "handler")
+
+    def __init__(self, method:str, pattern:str, name:str, handler) -> None:
+        self.method = method
+        self.pattern = pattern
+        self.name = name
+        self.handler = handler
+
+
+class _Node:
+    """_Node is a path segment in the compiled routing tree"""
+    __slots__ = ("static", "param", "routes", "allowed")
+
+    def __init__(self) -> None:
+        # segment -> _Node
+        self.static = {}
+        # the _Node for a {parameter} segment
+        self.param = None
+        # method -> Route
+        self.routes = {}
+        # the methods routes accept, for 405 responses
+        self.allowed = ()
+
+
+class Router:
+    """Router matches request paths to handlers
+
+    Patterns are made of /-separated segments, where a segment written as
+    {name} matches any non-empty segment and is passed to the handler.
+    Static segments take precedence over parameters. Routes are compiled
+    into a tree once, so resolving a path is a dict lookup per segment
+    with no regular expressions. Paths without parameters are resolved
+    with a single dict lookup.
+
+    HEAD requests are answered by the GET route of a path unless a HEAD
+    route is registered.
+
+    Methods
+    -------
+    add(method, pattern, name, handler) - registers a route
+    compile() - builds the routing tree, called by resolve if needed
+    resolve(method, path) - returns the route and parameters for a request
+    """
+    def __init__(self) -> None:
+        self._routes = []
+        self._root = None
+        # path -> _Node, for patterns without parameters
+        self._exact = {}
+
+    def add(self, method:str, pattern:str, name:str, handler) -> Route:
+        """Registers a route
+
+        Args:
+            method (str): the HTTP method
+            pattern (str): the path pattern, like /user/{user_id}
+            name (str): the route name used in metrics
+            handler (callable): called with the request and the path parameters
+
+        Raises:
+            ValueError: if the pattern doesn't start with / or the route already exists
+
+        Returns:
+            Route: the registered route
+        """
+        if not pattern.startswith("/"):
+            raise ValueError("Route patterns must start with /, got {}".format(pattern))
+
+        for _route in self._routes:
+            if _route.method == method and _route.pattern == pattern:
+                raise ValueError("Route already registered: {} {}".format(method, pattern))
+
+        _route = Route(method, pattern, name, handler)
+        self._routes.append(_route)
+        # recompiled on the next resolve
+        self._root = None
+        return _route
+
+    def compile(self) -> None:
+        """Builds the routing tree from the registered routes"""
+        _root = _Node()
+        _exact = {}
+
+        for _route in self._routes:
+            _node = _root
+            _segments = _route.pattern[1:].split("/")
+            for _segment in _segments:
+                if _segment.startswith("{") and _segment.endswith("}"):
+                    if _node.param is None:
+                        _node.param = _Node()
+                    _node = _node.param
+                else:
+                    _node = _node.static.setdefault(_segment, _Node())
+
+            _node.routes[_route.method] = _route
+            if "GET" in _node.routes and "HEAD" not in _node.routes:
+                _node.routes["HEAD"] = _node.routes["GET"]
+            _node.allowed = tuple(sorted(_node.routes))
+
+            if "{" not in _route.pattern:
+                _exact[_route.pattern] = _node
+
+        self._exact = _exact
+        self._root = _root
+
+    def resolve(self, method:str, path:str) -> tuple:
+        """Finds the route for a request
+
+        Args:
+            method (str): the HTTP method
+            path (str): the request path, without the query string
+
+        Raises:
+            RouteNotFoundException: if no route matches the path
+            MethodNotAllowedException: if the path has no route for the method
+
+        Returns:
+            tuple: (Route, tuple of path parameters)
+        """
+        if self._root is None:
+            self.compile()
+
+        _params = ()
+        _node = self._exact.get(path)
+
+        if _node is None and path.startswith("/"):
+            _node = self._root
+            _start = 1
+            while _node is not None:
+                _end = path.find("/", _start)
+                _segment = path[_start:] if _end < 0 else path[_start:_end]
+
+                _next = _node.static.get(_segment)
+                if _next is None and _segment and _node.param is not None:
+                    _next = _node.param
+                    _params += (_segment,)
+                _node = _next
+
+                if _end < 0:
+                    break
+                _start = _end + 1
+
+        if _node is None or not _node.routes:
+            raise RouteNotFoundException(path)
+
+        _route = _node.routes.get(method)
+        if _route is None:
+            raise MethodNotAllowedException(path, method, _node.allowed)
+
+        return _route, _params
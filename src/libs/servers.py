@@ -0,0 +1,682 @@
+import collections
+import logging
+import os
+import selectors
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+from .admission import SHED_MESSAGE, AdmissionController
+
+# Supported serving modes
+SERVER_MODE_SINGLE = "single"
+SERVER_MODE_THREADED = "threaded"
+SERVER_MODE_PREFORK = "prefork"
+SERVER_MODE_ASYNCIO = "asyncio"
+SERVER_MODES = (SERVER_MODE_SINGLE, SERVER_MODE_THREADED, SERVER_MODE_PREFORK, SERVER_MODE_ASYNCIO)
+
+
+class _RequestTriage:
+    """_RequestTriage waits for the request lines of many connections at once
+    on a single thread, so the accept loop never waits on a client
+
+    Each connection is passed to decide(request, client_address, accepted, head)
+    as soon as it has sent something, or after wait seconds with whatever
+    it has sent. The thread, and the socket which wakes it, are created by
+    the first add(), so a server forked before serving has its own.
+
+    Methods
+    -------
+    add(request, client_address, accepted) - waits for the request line of a connection
+    close() - stops the thread and closes the connections still waiting
+    """
+    def __init__(self, wait:float, decide, close) -> None:
+        """
+        Args:
+            wait (float): seconds a connection has to send its request line
+            decide (callable): decide(request, client_address, accepted, head)
+                admits or sheds a connection, head is the start of what it sent
+            close (callable): close(request) closes a connection which was never decided
+        """
+        self.wait = wait
+        self._decide = decide
+        self._close = close
+        # guards the connections added and not yet picked up by the thread
+        self._lock = threading.Lock()
+        self._added = []
+        self._closed = False
+        self._thread = None
+        self._selector = None
+        self._wake_reader = self._wake_writer = None
+
+    def add(self, request, client_address, accepted:float) -> None:
+        """Waits on the triage thread for the request line of a connection
+
+        Args:
+            request (socket): the connection
+            client_address (tuple): the client's address
+            accepted (float): the perf_counter() time the connection was accepted
+        """
+        with self._lock:
+            if self._closed:
+                self._close(request)
+                return
+            if self._thread is None:
+                self._selector = selectors.DefaultSelector()
+                self._wake_reader, self._wake_writer = socket.socketpair()
+                self._wake_reader.setblocking(False)
+                self._wake_writer.setblocking(False)
+                self._selector.register(self._wake_reader, selectors.EVENT_READ)
+                self._thread = threading.Thread(target=self._run, name="user-service-triage", daemon=True)
+                self._thread.start()
+            self._added.append((time.monotonic() + self.wait, request, client_address, accepted))
+        self._wake()
+
+    def close(self) -> None:
+        """Stops the triage thread, closing the connections still waiting"""
+        with self._lock:
+            self._closed = True
+            _thread = self._thread
+        if _thread is None:
+            return
+
+        self._wake()
+        _thread.join()
+        self._selector.close()
+        self._wake_reader.close()
+        self._wake_writer.close()
+
+    def _wake(self) -> None:
+        """Wakes the triage thread to pick up connections"""
+        try:
+            self._wake_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            # a full buffer already holds a wake up
+            pass
+
+    def _run(self) -> None:
+        """Decides connections as their request lines arrive or their wait runs out"""
+        # connections waiting, with the times their waits run out in order
+        _waiting = {}
+        _deadlines = collections.deque()
+        while True:
+            with self._lock:
+                _added, self._added = self._added, []
+                _closed = self._closed
+            if _closed:
+                break
+
+            for _entry in _added:
+                _waiting[_entry[1]] = _entry
+                _deadlines.append((_entry[0], _entry[1]))
+                self._selector.register(_entry[1], selectors.EVENT_READ)
+
+            _timeout = None
+            if _deadlines:
+                _timeout = max(0.0, _deadlines[0][0] - time.monotonic())
+
+            for _key, _ in self._selector.select(_timeout):
+                if _key.fileobj is self._wake_reader:
+                    try:
+                        while self._wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._ready(_waiting.pop(_key.fileobj))
+
+            # connections which haven't sent anything in time are decided without a request line
+            _now = time.monotonic()
+            while _deadlines and _deadlines[0][0] <= _now:
+                _entry = _waiting.pop(_deadlines.popleft()[1], None)
+                if _entry is not None:
+                    self._ready(_entry)
+
+        for _entry in _waiting.values():
+            self._selector.unregister(_entry[1])
+            self._close(_entry[1])
+
+    def _ready(self, entry:tuple) -> None:
+        """Stops waiting on a connection and decides it with what it has sent"""
+        _, _request, _client_address, _accepted = entry
+        self._selector.unregister(_request)
+        try:
+            _head = _request.recv(64, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+        except OSError:
+            _head = b""
+
+        try:
+            self._decide(_request, _client_address, _accepted, _head)
+        except Exception:
+            logging.exception("Error admitting a request from %s", _client_address)
+            self._close(_request)
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """ThreadPoolHTTPServer is a HTTPServer which handles requests on a
+    bounded pool of worker threads
+
+    Once every worker is busy the accept loop stops pulling connections off
+    the listening socket, so extra clients wait in the kernel accept backlog
+    instead of an unbounded in-process queue. Connections whose first request
+    is a GET or HEAD for one of probe_paths skip that wait and are answered
+    by a separate probe worker, so load balancer health checks don't fail
+    while the pool is busy.
+
+    With an enabled AdmissionController connections are instead accepted
+    straight away and queue in-process for a worker, until the server holds
+    as many as the admission limit. Connections over the limit are answered
+    with a 503 and Retry-After by the accept loop, without using a worker,
+    unless they are probes or for one of the admission priority paths.
+    Those are told apart by their request line, a connection which hasn't
+    sent it yet waits for it on a triage thread rather than the accept loop.
+
+    server_close() drains the server: once the socket is closed, requests
+    already accepted have drain_timeout seconds to finish before their
+    connections are cut.
+
+    Methods
+    -------
+    process_request(request, client_address) - hands a request to the pool
+    server_close() - closes the socket and waits for the requests held to finish
+    """
+    # seconds a connection has to send its request line when it may be a probe or shed
+    probe_wait = 0.05
+
+    def __init__(self, server_address:tuple, handler_class, threads:int=16,
+                 backlog:int=128, bind_and_activate:bool=True, probe_paths:tuple=(),
+                 admission:AdmissionController=None, drain_timeout:float=None) -> None:
+        """
+        Args:
+            server_address (tuple): (address, port) to listen on
+            handler_class: A BaseHTTPRequestHandler class
+            threads (int, optional): number of worker threads. Defaults to 16.
+            backlog (int, optional): size of the accept backlog. Defaults to 128.
+            bind_and_activate (bool, optional): bind and listen immediately. Defaults to True.
+            probe_paths (tuple, optional): paths answered by the probe worker when
+                every worker is busy. Defaults to ().
+            admission (AdmissionController, optional): limits the connections held,
+                see above. Defaults to None.
+            drain_timeout (float, optional): seconds server_close() waits for requests
+                to finish, None waits for as long as they take. Defaults to None.
+        """
+        if threads < 1:
+            raise ValueError("threads must be at least 1, got {}".format(threads))
+
+        # must be set before server_activate() calls listen()
+        self.request_queue_size = backlog
+        self.threads = threads
+        self.admission = admission
+        self.drain_timeout = drain_timeout
+        # the connections accepted and not yet closed
+        self._requests = set()
+        self._requests_changed = threading.Condition()
+        self._slots = threading.BoundedSemaphore(threads)
+        self._executor = ThreadPoolExecutor(max_workers=threads,
+                                            thread_name_prefix="user-service")
+
+        # request lines which identify a probe, such as b"GET /health "
+        self._probe_requests = tuple(
+            bytes("{} {}{}".format(_method, _path, _end), "ascii")
+            for _path in probe_paths for _method in ("GET", "HEAD") for _end in (" ", "?")
+        )
+        self._probe_slots = threading.BoundedSemaphore(1)
+        # connections which may be probes or shed wait here for their request line
+        self._triage = _RequestTriage(self.probe_wait, self._decide_admission, self.shutdown_request)
+        self._probe_executor = None
+        if self._probe_requests:
+            self._probe_executor = ThreadPoolExecutor(max_workers=1,
+                                                      thread_name_prefix="user-service-probe")
+        super().__init__(server_address, handler_class, bind_and_activate)
+
+    def process_request(self, request, client_address) -> None:
+        """Waits for a free worker then hands the request to it"""
+        with self._requests_changed:
+            self._requests.add(request)
+
+        if self.admission is not None and self.admission.enabled:
+            self._admit_request(request, client_address)
+            return
+
+        _executor, _slots = self._executor, self._slots
+
+        if not _slots.acquire(blocking=False):
+            # every worker is busy, probes go to the probe worker instead of waiting
+            if self._is_probe(request) and self._probe_slots.acquire(blocking=False):
+                _executor, _slots = self._probe_executor, self._probe_slots
+            else:
+                _slots.acquire()
+
+        try:
+            _executor.submit(self._process_request_worker, request, client_address, _slots)
+        except RuntimeError:
+            # executor has been shut down
+            _slots.release()
+            self.shutdown_request(request)
+
+    def _admit_request(self, request, client_address) -> None:
+        """Queues the request for a worker, or sheds it once the admission limit is reached"""
+        _accepted = time.perf_counter()
+        _admission = self.admission
+
+        # only requests which may go to the probe worker or be refused need
+        # their request line, a connection which hasn't sent it is triaged
+        if (self._probe_requests and _admission.in_flight >= self.threads) \
+                or _admission.in_flight >= _admission.limit:
+            _head = self._peek(request, 0.0)
+            if not _head:
+                self._triage.add(request, client_address, _accepted)
+                return
+        else:
+            _head = None
+
+        self._decide_admission(request, client_address, _accepted, _head)
+
+    def _decide_admission(self, request, client_address, accepted:float, head:bytes) -> None:
+        """Hands a request to the probe worker or a worker, or sheds it
+
+        Args:
+            request (socket): the connection
+            client_address (tuple): the client's address
+            accepted (float): the perf_counter() time the connection was accepted
+            head (bytes): the start of the request, or None when it wasn't read
+        """
+        _admission = self.admission
+
+        # every worker is busy, probes go to the probe worker instead of queueing
+        if head and self._probe_requests and _admission.in_flight >= self.threads \
+                and head.startswith(self._probe_requests) and self._probe_slots.acquire(blocking=False):
+            try:
+                self._probe_executor.submit(self._process_request_worker, request,
+                                            client_address, self._probe_slots)
+            except RuntimeError:
+                self._probe_slots.release()
+                self.shutdown_request(request)
+            return
+
+        _priority = bool(head) and _admission.in_flight >= _admission.limit and self._is_priority(head)
+        if not _admission.try_acquire(priority=_priority):
+            self._shed(request)
+            return
+
+        try:
+            self._executor.submit(self._process_admitted_worker, request, client_address, accepted)
+        except RuntimeError:
+            # executor has been shut down
+            _admission.release(0.0)
+            self.shutdown_request(request)
+
+    def _is_priority(self, head:bytes) -> bool:
+        """Returns True if a request line is for a probe or an admission priority path"""
+        if self._probe_requests and head.startswith(self._probe_requests):
+            return True
+
+        _parts = head.split(b" ", 2)
+        return len(_parts) > 1 and self.admission.is_priority(_parts[1].decode("latin-1"))
+
+    def _shed(self, request) -> None:
+        """Answers a request which wasn't admitted with a 503, on the accept loop"""
+        _response = bytes("HTTP/1.0 503 Service Unavailable\r\n"
+                          "Retry-After: {}\r\n"
+                          "Content-Type: text/plain\r\n"
+                          "Content-Length: {}\r\n"
+                          "Connection: close\r\n\r\n".format(self.admission.retry_after,
+                                                                 len(SHED_MESSAGE)), "ascii") + SHED_MESSAGE
+        try:
+            # never wait on the client, the response fits in an empty send buffer
+            request.setblocking(False)
+            # read the request first, closing a socket with unread data resets
+            # the connection and the client may never see the response
+            try:
+                request.recv(65536)
+            except BlockingIOError:
+                pass
+            request.send(_response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _peek(self, request, wait:float=None) -> bytes:
+        """Peeks at the request line, without consuming it, waiting up to
+        wait seconds, or probe_wait when None, for it to arrive"""
+        try:
+            request.settimeout(self.probe_wait if wait is None else wait)
+            return request.recv(64, socket.MSG_PEEK)
+        except OSError:
+            return b""
+        finally:
+            try:
+                request.settimeout(None)
+            except OSError:
+                pass
+
+    def _is_probe(self, request) -> bool:
+        """Peeks at the request line to find probes"""
+        if not self._probe_requests:
+            return False
+
+        return self._peek(request).startswith(self._probe_requests)
+
+    def _process_request_worker(self, request, client_address, slots:threading.BoundedSemaphore) -> None:
+        """Runs a single request on a worker thread"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            slots.release()
+
+    def _process_admitted_worker(self, request, client_address, accepted:float) -> None:
+        """Runs a single admitted request on a worker thread"""
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.admission.release(time.perf_counter() - accepted)
+
+    def shutdown_request(self, request) -> None:
+        """Closes a connection and stops tracking it"""
+        with self._requests_changed:
+            self._requests.discard(request)
+            self._requests_changed.notify_all()
+        super().shutdown_request(request)
+
+    def server_close(self) -> None:
+        """Closes the socket, waits up to drain_timeout for the requests held
+        to finish, then cuts the connections left and stops the workers"""
+        super().server_close()
+        # connections still waiting for their request line are never admitted
+        self._triage.close()
+
+        with self._requests_changed:
+            if not self._requests_changed.wait_for(lambda: not self._requests, self.drain_timeout):
+                logging.warning("Closing %s connections still open after %s seconds",
+                                len(self._requests), self.drain_timeout)
+                # the workers reading or writing them fail fast and move on
+                for _request in self._requests:
+                    try:
+                        _request.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+        self._executor.shutdown(wait=True)
+        if self._probe_executor is not None:
+            self._probe_executor.shutdown(wait=True)
+
+
+class PreForkServer:
+    """PreForkServer runs a HTTPServer in several forked worker processes
+    which share the parent's listening socket
+
+    Workers drain and exit on SIGTERM, or once the parent process has gone
+    so they never outlive it. A draining worker calls on_drain, such as to
+    fail readiness, and keeps serving for deregistration_delay seconds while
+    the load balancer notices before it stops accepting. shutdown() asks
+    every worker to drain, and kills those still running kill_grace seconds
+    after they should have finished.
+
+    Methods
+    -------
+    serve_forever() - forks the workers and waits for them to exit
+    shutdown() - drains the workers, may be called from another thread
+    server_close() - stops the workers and closes the listening socket
+    """
+    # seconds workers have on top of drain_timeout before they are killed
+    kill_grace = 5
+    # seconds between a worker's checks that its parent is still running
+    parent_poll_interval = 1
+
+    def __init__(self, server:HTTPServer, processes:int=None, forward_signals:tuple=(),
+                 drain_timeout:float=None, on_child_exit=None, on_drain=None,
+                 deregistration_delay:float=0) -> None:
+        """
+        Args:
+            server (HTTPServer): a bound and activated server to share
+            processes (int, optional): number of workers. Defaults to the CPU count.
+            forward_signals (tuple, optional): signals the parent passes on to
+                every worker. Defaults to ().
+            drain_timeout (float, optional): seconds workers have to drain, None
+                waits for as long as they take. Defaults to None.
+            on_child_exit (callable, optional): called by a worker after it has
+                drained, such as to flush logs. Defaults to None.
+            on_drain (callable, optional): called by a worker when it starts to
+                drain, such as to fail readiness. Defaults to None.
+            deregistration_delay (float, optional): seconds a draining worker keeps
+                accepting requests after on_drain. Defaults to 0.
+        """
+        if not processes:
+            processes = os.cpu_count() or 1
+
+        self.server = server
+        self.processes = processes
+        self.forward_signals = tuple(forward_signals)
+        self.drain_timeout = drain_timeout
+        self.on_child_exit = on_child_exit
+        self.on_drain = on_drain
+        self.deregistration_delay = deregistration_delay
+        self._children = []
+        self._stopped = threading.Event()
+
+    def serve_forever(self) -> None:
+        """Forks the worker processes and blocks until they have all exited"""
+        self._stopped.clear()
+        _parent_pid = os.getpid()
+        for _ in range(self.processes):
+            _pid = os.fork()
+            if _pid == 0:
+                self._run_child(_parent_pid)
+            self._children.append(_pid)
+
+        logging.info("Started %s worker processes", len(self._children))
+
+        # installed after forking, so workers keep their own handlers
+        for _signum in self.forward_signals:
+            signal.signal(_signum, self._forward_signal)
+
+        try:
+            self._wait_children()
+        except KeyboardInterrupt:
+            self._stop_children()
+            raise
+        finally:
+            self._stopped.set()
+
+    def shutdown(self) -> None:
+        """Asks every worker to drain and waits for serve_forever() to return"""
+        self._signal_children(signal.SIGTERM)
+        # the socket stops listening once the workers have closed their copies too
+        self.server.socket.close()
+        if not self._stopped.wait(self._kill_timeout()):
+            logging.warning("Killing worker processes still running after %s seconds",
+                            self._kill_timeout())
+            self._signal_children(signal.SIGKILL)
+            self._stopped.wait()
+
+    def _kill_timeout(self) -> float:
+        """Returns the seconds workers have to exit before they are killed"""
+        if self.drain_timeout is None:
+            return None
+        return self.deregistration_delay + self.drain_timeout + self.kill_grace
+
+    def _run_child(self, parent_pid:int) -> None:
+        """Serves requests in a forked worker and never returns"""
+        _exit_code = 0
+        # the other workers are the parent's to manage
+        self._children = []
+        signal.signal(signal.SIGTERM, self._drain_child)
+        threading.Thread(target=self._watch_parent, args=(parent_pid,),
+                         name="parent-watcher", daemon=True).start()
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            logging.exception("Worker process %s failed", os.getpid())
+            _exit_code = 1
+        finally:
+            self.server.server_close()
+            if self.on_child_exit is not None:
+                try:
+                    self.on_child_exit()
+                except Exception:
+                    logging.exception("Worker process %s failed to exit cleanly", os.getpid())
+            os._exit(_exit_code)
+
+    def _drain_child(self, signum:int, frame) -> None:
+        """Drains a worker on SIGTERM"""
+        # shutdown() waits for serve_forever, which this signal interrupted
+        threading.Thread(target=self._drain, name="shutdown", daemon=True).start()
+
+    def _drain(self) -> None:
+        """Calls on_drain, waits deregistration_delay and stops the worker's
+        server, which drains before the worker exits"""
+        if self.on_drain is not None:
+            try:
+                self.on_drain()
+            except Exception:
+                logging.exception("Worker process %s failed to start draining", os.getpid())
+        if self.deregistration_delay:
+            time.sleep(self.deregistration_delay)
+        self.server.shutdown()
+
+    def _watch_parent(self, parent_pid:int) -> None:
+        """Drains a worker whose parent has exited without stopping it"""
+        while os.getppid() == parent_pid:
+            time.sleep(self.parent_poll_interval)
+
+        logging.warning("Parent process %s has exited, draining worker process %s",
+                        parent_pid, os.getpid())
+        self._drain()
+
+    def _signal_children(self, signum:int) -> None:
+        """Sends a signal to every worker process"""
+        for _pid in list(self._children):
+            try:
+                os.kill(_pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _forward_signal(self, signum:int, frame) -> None:
+        """Passes a signal received by the parent on to every worker"""
+        self._signal_children(signum)
+
+    def _wait_children(self, timeout:float=None) -> bool:
+        """Reaps worker processes until none are left, or timeout seconds have passed
+
+        Returns:
+            bool: True if every worker has exited
+        """
+        _deadline = None if timeout is None else time.monotonic() + timeout
+        while self._children:
+            try:
+                if _deadline is None:
+                    _pid, _status = os.wait()
+                else:
+                    _pid, _status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children = []
+                break
+
+            if _pid == 0:
+                if time.monotonic() >= _deadline:
+                    return False
+                time.sleep(0.05)
+                continue
+
+            if _pid in self._children:
+                self._children.remove(_pid)
+                logging.info("Worker process %s exited with status %s", _pid, _status)
+
+        return True
+
+    def _stop_children(self) -> None:
+        """Drains every worker process and reaps them, killing those which overrun"""
+        self._signal_children(signal.SIGTERM)
+        if not self._wait_children(self._kill_timeout()):
+            self._signal_children(signal.SIGKILL)
+            self._wait_children()
+
+    def server_close(self) -> None:
+        self._stop_children()
+        self.server.server_close()
+
+
+def create_server(mode:str, server_address:tuple, handler_class, threads:int=16,
+                  processes:int=None, backlog:int=128, app=None, probe_paths:tuple=(),
+                  blocking_paths:tuple=(), forward_signals:tuple=(), admission:AdmissionController=None,
+                  drain_timeout:float=None, on_child_exit=None, on_drain=None,
+                  deregistration_delay:float=0):
+    """Creates a server for the requested serving mode
+
+    Args:
+        mode (str): one of single, threaded, prefork or asyncio
+        server_address (tuple): (address, port) to listen on
+        handler_class: A BaseHTTPRequestHandler class
+        threads (int, optional): worker threads per process. Defaults to 16.
+        processes (int, optional): worker processes for prefork. Defaults to the CPU count.
+        backlog (int, optional): size of the accept backlog. Defaults to 128.
+        app (callable, optional): request callable for asyncio mode, see AsyncHTTPServer.
+            Defaults to None.
+        probe_paths (tuple, optional): health check paths answered even when every
+            worker thread is busy, see ThreadPoolHTTPServer. Defaults to ().
+        blocking_paths (tuple, optional): paths whose requests may block, run off
+            the event loop in asyncio mode, see AsyncHTTPServer. Defaults to ().
+        forward_signals (tuple, optional): signals passed on to the workers in
+            prefork mode. Defaults to ().
+        admission (AdmissionController, optional): sheds requests over its limit, in
+            every mode but single, which holds one request at a time. Defaults to None.
+        drain_timeout (float, optional): seconds requests in progress have to finish
+            once the server is shut down, None waits for as long as they take.
+            Defaults to None.
+        on_child_exit (callable, optional): called by prefork workers before they
+            exit. Defaults to None.
+        on_drain (callable, optional): called by prefork workers when they start
+            to drain, see PreForkServer. Defaults to None.
+        deregistration_delay (float, optional): seconds prefork workers keep accepting
+            requests after on_drain. Defaults to 0.
+
+    Raises:
+        ValueError: if mode is not a known serving mode or asyncio mode has no app
+
+    Returns:
+        object: a server with serve_forever(), shutdown() and server_close()
+    """
+    if mode == SERVER_MODE_SINGLE:
+        # requests are handled on the serving thread, so once serve_forever()
+        # returns there is nothing left to drain
+        _server = HTTPServer(server_address, handler_class, bind_and_activate=False)
+        _server.request_queue_size = backlog
+        try:
+            _server.server_bind()
+            _server.server_activate()
+        except Exception:
+            _server.server_close()
+            raise
+        return _server
+    elif mode == SERVER_MODE_THREADED:
+        return ThreadPoolHTTPServer(server_address, handler_class,
+                                    threads=threads, backlog=backlog, probe_paths=probe_paths,
+                                    admission=admission, drain_timeout=drain_timeout)
+    elif mode == SERVER_MODE_PREFORK:
+        # each worker process admits up to the limit
+        _server = ThreadPoolHTTPServer(server_address, handler_class,
+                                       threads=threads, backlog=backlog, probe_paths=probe_paths,
+                                       admission=admission, drain_timeout=drain_timeout)
+        return PreForkServer(_server, processes, forward_signals,
+                             drain_timeout=drain_timeout, on_child_exit=on_child_exit,
+                             on_drain=on_drain, deregistration_delay=deregistration_delay)
+    elif mode == SERVER_MODE_ASYNCIO:
+        if app is None:
+            raise ValueError("The asyncio server mode requires an app callable")
+        # asyncio is slow to import, so it is only imported when it serves
+        from .async_server import AsyncHTTPServer
+        return AsyncHTTPServer(server_address, app, backlog=backlog, blocking_paths=blocking_paths,
+                               probe_paths=probe_paths, admission=admission,
+                               drain_timeout=drain_timeout)
+    else:
+        raise ValueError("Unknown server mode: {}".format(mode))
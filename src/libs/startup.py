@@ -0,0 +1,54 @@
+import json
+import logging
+import time
+
+# When this module was imported, app.py imports it first so the rest of
+# its imports are timed
+IMPORTED_AT = time.perf_counter()
+
+
+class StartupTimer:
+    """StartupTimer breaks the time taken to start the service down into
+    consecutive phases, like imports, configuration, user data and binding
+
+    Methods
+    -------
+    lap(phase) - records the time since the last lap as phase
+    report() - returns the phases and total as a dict
+    log() - logs the report as JSON
+    """
+    def __init__(self, started_at:float=None) -> None:
+        """
+        Args:
+            started_at (float, optional): perf_counter() time startup began.
+                Defaults to when this module was imported.
+        """
+        self.started_at = IMPORTED_AT if started_at is None else started_at
+        self.phases = {}
+        self._last = self.started_at
+
+    def lap(self, phase:str) -> float:
+        """Records the time since the last lap as phase, repeated phases add up
+
+        Returns:
+            float: seconds taken by the lap
+        """
+        _now = time.perf_counter()
+        _seconds = _now - self._last
+        self.phases[phase] = self.phases.get(phase, 0.0) + _seconds
+        self._last = _now
+        return _seconds
+
+    @property
+    def total(self) -> float:
+        """Seconds from the start to the last lap"""
+        return self._last - self.started_at
+
+    def report(self) -> dict:
+        return {
+            "phases": {phase: round(seconds, 4) for phase, seconds in self.phases.items()},
+            "total": round(self.total, 4)
+        }
+
+    def log(self) -> None:
+        logging.info("Startup report: %s", json.dumps(self.report()))
@@ -0,0 +1,237 @@
+import csv
+import json
+import logging
+import os
+import time
+from .user_store import USER_FIELDS
+
+# Supported file formats
+FORMAT_NDJSON = "ndjson"
+FORMAT_CSV = "csv"
+IMPORT_FORMATS = (FORMAT_NDJSON, FORMAT_CSV)
+
+# File extensions of each format
+_EXTENSIONS = {
+    ".ndjson": FORMAT_NDJSON,
+    ".jsonl": FORMAT_NDJSON,
+    ".json": FORMAT_NDJSON,
+    ".csv": FORMAT_CSV
+}
+
+
+class InvalidUserRecordException(ValueError):
+    """Exception raised when a record in a users file is invalid
+    Attributes:
+        source -- the file being imported
+        line_number -- the line of the invalid record
+        message -- explination of the error
+    """
+    def __init__(self, source:str, line_number:int, reason:str) -> None:
+        self.source = source
+        self.line_number = line_number
+        self.message = "{}:{} is not a user record: {}".format(source, line_number, reason)
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class ImportStats:
+    """ImportStats describes a finished or running import
+
+    Attributes:
+        imported -- records handed to the store
+        skipped -- invalid records skipped
+        seconds -- time spent importing
+    """
+    def __init__(self) -> None:
+        self.imported = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    @property
+    def rate(self) -> float:
+        """Records imported per second"""
+        if self.seconds <= 0:
+            return 0.0
+        return self.imported / self.seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "imported": self.imported,
+            "skipped": self.skipped,
+            "seconds": round(self.seconds, 3),
+            "rate": round(self.rate, 1)
+        }
+
+
+def detect_format(path:str) -> str:
+    """Returns the format of a users file from its extension
+
+    Raises:
+        ValueError: if the extension isn't known
+    """
+    _extension = os.path.splitext(path)[1].lower()
+    if _extension not in _EXTENSIONS:
+        raise ValueError("Unable to tell the format of {}, expected one of {}".format(
+            path, ", ".join(sorted(_EXTENSIONS))))
+    return _EXTENSIONS[_extension]
+
+
+def read_records(path:str, file_format:str=None):
+    """Reads raw records from a users file
+
+    Args:
+        path (str): path of the file
+        file_format (str, optional): ndjson or csv. Defaults to the file extension.
+
+    Raises:
+        ValueError: if the format is unknown
+
+    Yields:
+        tuple: (line number, record), record is None for unparseable lines
+    """
+    if file_format is None:
+        file_format = detect_format(path)
+
+    if file_format == FORMAT_NDJSON:
+        with open(path, "r", encoding="utf-8") as users_file:
+            for _line_number, _line in enumerate(users_file, start=1):
+                if not _line.strip():
+                    continue
+                try:
+                    yield _line_number, json.loads(_line)
+                except ValueError:
+                    yield _line_number, None
+    elif file_format == FORMAT_CSV:
+        with open(path, "r", encoding="utf-8", newline="") as users_file:
+            _reader = csv.DictReader(users_file)
+            for _record in _reader:
+                yield _reader.line_num, _record
+    else:
+        raise ValueError("Unknown users file format: {}".format(file_format))
+
+
+def validate_user(record) -> tuple:
+    """Checks a record has an id and the USER_FIELDS as strings
+
+    Args:
+        record: a decoded record
+
+    Returns:
+        tuple: (user_id, the reason the record is invalid or None)
+    """
+    if not isinstance(record, dict):
+        return None, "not an object"
+
+    _user_id = record.get("id")
+    if isinstance(_user_id, int) and not isinstance(_user_id, bool):
+        _user_id = str(_user_id)
+
+    if not isinstance(_user_id, str) or not _user_id:
+        return None, "missing id"
+
+    for _field in USER_FIELDS:
+        if not isinstance(record.get(_field), str):
+            return _user_id, "{} must be a string".format(_field)
+
+    if not record["username"]:
+        return _user_id, "username is empty"
+
+    return _user_id, None
+
+
+def validate_records(records, source:str, stats:ImportStats=None, skip_invalid:bool=False):
+    """Checks every record has an id and the USER_FIELDS as strings
+
+    Other fields are dropped, so records match the built-in users.
+
+    Args:
+        records (iterable): (line number, record) pairs from read_records
+        source (str): the file name used in errors
+        stats (ImportStats, optional): counts skipped records. Defaults to None.
+        skip_invalid (bool, optional): skip invalid records instead of raising. Defaults to False.
+
+    Raises:
+        InvalidUserRecordException: if a record is invalid and skip_invalid is False
+
+    Yields:
+        tuple: (user_id, dict)
+    """
+    for _line_number, _record in records:
+        _user_id, _reason = validate_user(_record)
+        if _reason is not None:
+            if not skip_invalid:
+                raise InvalidUserRecordException(source, _line_number, _reason)
+            logging.warning("Skipping %s:%s, %s", source, _line_number, _reason)
+            if stats is not None:
+                stats.skipped += 1
+            continue
+
+        yield _user_id, {_field: _record[_field] for _field in USER_FIELDS}
+
+
+def read_users(path:str, file_format:str=None, stats:ImportStats=None, skip_invalid:bool=False):
+    """Reads and validates the users in a file
+
+    Args:
+        path (str): path of the file
+        file_format (str, optional): ndjson or csv. Defaults to the file extension.
+        stats (ImportStats, optional): counts skipped records. Defaults to None.
+        skip_invalid (bool, optional): skip invalid records instead of raising. Defaults to False.
+
+    Yields:
+        tuple: (user_id, dict)
+    """
+    return validate_records(read_records(path, file_format), path, stats, skip_invalid)
+
+
+def _report_progress(users, stats:ImportStats, start:float, interval:float):
+    """Counts users as they pass and logs progress every interval seconds"""
+    _next_report = start + interval
+    for _user in users:
+        stats.imported += 1
+        yield _user
+
+        # checking the clock every record would slow large imports
+        if stats.imported % 1000 == 0:
+            _now = time.perf_counter()
+            if _now >= _next_report:
+                stats.seconds = _now - start
+                logging.info("Imported %s users, %.0f users per second", stats.imported, stats.rate)
+                _next_report = _now + interval
+
+
+def import_users(store, path:str, file_format:str=None, skip_invalid:bool=False,
+                 progress_interval:float=5.0) -> ImportStats:
+    """Streams the users in a file into a store
+
+    The file is read a line at a time and each record is validated and
+    handed straight to store.add_users, which indexes it as it arrives.
+    Apart from the store itself, peak memory is one record plus the store's
+    insert batch (SQLiteUserStore.BATCH_SIZE rows), so it doesn't grow with
+    the size of the file.
+
+    Args:
+        store (UserStore): the store to add users to
+        path (str): path of the file
+        file_format (str, optional): ndjson or csv. Defaults to the file extension.
+        skip_invalid (bool, optional): skip invalid records instead of raising. Defaults to False.
+        progress_interval (float, optional): seconds between progress logs. Defaults to 5.0.
+
+    Raises:
+        InvalidUserRecordException: if a record is invalid and skip_invalid is False
+
+    Returns:
+        ImportStats: the number of users imported and how long it took
+    """
+    _stats = ImportStats()
+    _start = time.perf_counter()
+
+    _users = read_users(path, file_format, _stats, skip_invalid)
+    store.add_users(_report_progress(_users, _stats, _start, progress_interval))
+
+    _stats.seconds = time.perf_counter() - _start
+    logging.info("Imported %s users from %s in %.1f seconds, %.0f users per second, %s skipped",
+                 _stats.imported, path, _stats.seconds, _stats.rate, _stats.skipped)
+    return _stats
@@ -0,0 +1,469 @@
+import itertools
+import json
+import logging
+import os
+import threading
+from .user_import import validate_user
+from .user_snapshot import SnapshotUserStore, write_snapshot
+from .user_store import USER_FIELDS, USER_STORE_SNAPSHOT, USER_STORE_SQLITE
+from .user_store import MemoryUserStore, SQLiteUserStore, UserRecord, UserStore
+
+
+class UserLogCorruptException(ValueError):
+    """Exception raised when a write log holds a record which can't be replayed
+    Attributes:
+        path -- the write log
+        line_number -- the line of the bad record
+        message -- explination of the error
+    """
+    def __init__(self, path:str, line_number:int, reason:str) -> None:
+        self.path = path
+        self.line_number = line_number
+        self.message = "{}:{} can't be replayed: {}".format(path, line_number, reason)
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class UserExistsException(ValueError):
+    """Exception raised when an exclusive write is for a user which exists
+    Attributes:
+        user_id -- the id of the user
+        message -- explination of the error
+    """
+    def __init__(self, user_id:str) -> None:
+        self.user_id = user_id
+        self.message = "user {} already exists".format(user_id)
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+class _PendingWrite:
+    """A write waiting for the log to be flushed"""
+    __slots__ = ("record", "line", "done", "error")
+
+    def __init__(self, record:UserRecord, line:bytes) -> None:
+        self.record = record
+        self.line = line
+        self.done = False
+        self.error = None
+
+
+class UserWriteLog:
+    """UserWriteLog makes user writes durable in an append-only log
+
+    Every write is a line of NDJSON, in the format libs.user_import reads.
+    Writers queue their line and wait while a single log thread appends
+    every queued line and syncs the file once for the whole group, so many
+    concurrent writes cost one disk flush. Once synced, writes are applied
+    to users, an in-memory overlay read without locks.
+
+    When the log is opened it is replayed into users, a record cut short by
+    a crash is truncated. Compaction hands the overlay to a persist callable,
+    which writes it into the read-optimized store, and rewrites the log
+    with only the writes it still needs.
+
+    Attributes:
+        path -- the log file
+        users -- a MemoryUserStore of the writes which are only in the log
+        version -- incremented whenever writes are applied
+        writes -- number of writes applied
+        syncs -- number of times the log was synced
+        compactions -- number of compactions
+
+    Methods
+    -------
+    start(compact_interval, persist) - starts the log thread and periodic compaction
+    write(user_id, user, exists) - durably writes a user and returns its UserRecord
+    compact(persist) - moves the writes into the store and shrinks the log
+    close() - waits for queued writes and closes the log
+    """
+    def __init__(self, path:str, sync:bool=True) -> None:
+        """
+        Args:
+            path (str): the log file, created if missing
+            sync (bool, optional): sync the log before acknowledging writes. Defaults to True.
+
+        Raises:
+            UserLogCorruptException: if a complete record in the log can't be replayed
+        """
+        self.path = path
+        self.sync = sync
+        self.version = 0
+        self.writes = 0
+        self.syncs = 0
+        self.compactions = 0
+        self.users = MemoryUserStore(self._replay())
+        self._file = open(path, "ab")
+        # guards the queue of pending writes
+        self._lock = threading.Lock()
+        self._queued = threading.Condition(self._lock)
+        self._flushed = threading.Condition(self._lock)
+        self._pending = []
+        # the number of writes of each user id queued or being synced, which
+        # aren't in the overlay yet
+        self._unapplied = {}
+        # guards the log file and the overlay
+        self._file_lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._closing = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._compactor = None
+
+    def _replay(self) -> list:
+        """Reads the users in the log, truncating a final record cut short by a crash
+
+        Raises:
+            UserLogCorruptException: if a complete record can't be replayed
+
+        Returns:
+            list: (user_id, dict) pairs in the order they were written
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        _users = []
+        _good = 0
+        with open(self.path, "rb") as log_file:
+            for _line_number, _line in enumerate(log_file, start=1):
+                # only the last line can be missing its newline
+                if not _line.endswith(b"\n"):
+                    logging.warning("Truncating a partial record at %s:%s", self.path, _line_number)
+                    break
+
+                try:
+                    _record = json.loads(_line)
+                except ValueError:
+                    raise UserLogCorruptException(self.path, _line_number, "not JSON")
+                _user_id, _reason = validate_user(_record)
+                if _reason is not None:
+                    raise UserLogCorruptException(self.path, _line_number, _reason)
+
+                _users.append((_user_id, _record))
+                _good += len(_line)
+
+        if _good != os.path.getsize(self.path):
+            with open(self.path, "r+b") as log_file:
+                log_file.truncate(_good)
+
+        logging.info("Replayed %s user writes from %s", len(_users), self.path)
+        return _users
+
+    def start(self, compact_interval:float=0, persist=None) -> None:
+        """Starts the log thread, and compaction every compact_interval seconds
+
+        Args:
+            compact_interval (float, optional): seconds between compactions, 0 disables them. Defaults to 0.
+            persist (callable, optional): passed to compact(). Defaults to None.
+        """
+        self._thread = threading.Thread(target=self._run, name="user-log", daemon=True)
+        self._thread.start()
+
+        if compact_interval > 0:
+            self._compactor = threading.Thread(target=self._run_compactions, args=(compact_interval, persist),
+                                               name="user-log-compactor", daemon=True)
+            self._compactor.start()
+
+    def write(self, user_id:str, user:dict, exists=None) -> UserRecord:
+        """Writes a user and waits until the write is durable and applied
+
+        Args:
+            user_id (str): the id of the user
+            user (dict): the USER_FIELDS of the user
+            exists (callable, optional): exists(user_id) returns True if the user is
+                stored, which makes the write exclusive. It is checked with writes
+                queued, so of concurrent exclusive writes of a user only one succeeds.
+                Defaults to None.
+
+        Raises:
+            UserExistsException: if the write is exclusive and the user exists
+            OSError: if the log couldn't be written
+
+        Returns:
+            UserRecord: the user as it will be read
+        """
+        _fields = tuple(str(user.get(field, "")) for field in USER_FIELDS)
+        _record = UserRecord(user_id, *_fields)
+        _line = dict(zip(USER_FIELDS, _fields))
+        _line["id"] = user_id
+        _pending = _PendingWrite(_record, bytes(json.dumps(_line) + "\n", "utf-8"))
+
+        with self._lock:
+            if self._closing or self._thread is None:
+                raise OSError("The user write log {} isn't open for writes".format(self.path))
+            if exists is not None and (user_id in self._unapplied or exists(user_id)):
+                raise UserExistsException(user_id)
+            self._unapplied[user_id] = self._unapplied.get(user_id, 0) + 1
+            self._pending.append(_pending)
+            self._queued.notify()
+            while not _pending.done:
+                self._flushed.wait()
+
+        if _pending.error is not None:
+            raise _pending.error
+        return _record
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._pending and not self._closing:
+                    self._queued.wait()
+                if not self._pending:
+                    return
+                # every write queued while the last group was syncing joins this one
+                _group = self._pending
+                self._pending = []
+
+            _error = None
+            try:
+                self._append(_group)
+            except OSError as e:
+                logging.error("Unable to write %s users to %s: %s", len(_group), self.path, e)
+                _error = e
+
+            with self._lock:
+                for _pending in _group:
+                    _pending.error = _error
+                    _pending.done = True
+                    # applied to the overlay, or failed
+                    _user_id = _pending.record.user_id
+                    self._unapplied[_user_id] -= 1
+                    if not self._unapplied[_user_id]:
+                        del self._unapplied[_user_id]
+                self._flushed.notify_all()
+
+    def _append(self, group:list) -> None:
+        """Appends and syncs a group of writes, then applies them"""
+        with self._file_lock:
+            _size = self._file.tell()
+            try:
+                self._file.write(b"".join(_pending.line for _pending in group))
+                self._file.flush()
+                if self.sync:
+                    os.fsync(self._file.fileno())
+                    self.syncs += 1
+            except OSError:
+                # a partial group would leave a broken record in the middle of the log
+                self._file.truncate(_size)
+                raise
+
+            self.users.add_users((_pending.record.user_id, _pending.record.to_dict()) for _pending in group)
+            self.writes += len(group)
+            self.version += 1
+
+    def compact(self, persist=None) -> int:
+        """Moves the logged writes into the store and rewrites the log with
+        only the writes it still has to hold
+
+        Writes continue while the users are persisted, the log is only locked
+        while it is rewritten.
+
+        Args:
+            persist (callable, optional): called with a list of the logged UserRecords,
+                returns True once they are durable in the store. Without it, or when
+                it returns False, the log is rewritten with one record per user.
+                Defaults to None.
+
+        Returns:
+            int: the number of users left in the log
+        """
+        with self._compact_lock:
+            with self._file_lock:
+                _written = {_user.user_id: _user for _user in self.users.iter_users()}
+
+            _persisted = False
+            if persist is not None and _written:
+                try:
+                    _persisted = persist(list(_written.values()))
+                except Exception:
+                    logging.exception("Unable to compact the user write log %s", self.path)
+
+            with self._file_lock:
+                # users written again while persisting stay in the log
+                _remaining = [_user for _user in self.users.iter_users()
+                              if not _persisted or _written.get(_user.user_id) is not _user]
+                self._rewrite(_remaining)
+                if _persisted:
+                    self.users = MemoryUserStore((_user.user_id, _user.to_dict()) for _user in _remaining)
+                    self.version += 1
+
+            self.compactions += 1
+            logging.info("Compacted the user write log %s, %s users persisted, %s left in the log",
+                         self.path, len(_written) if _persisted else 0, len(_remaining))
+            return len(_remaining)
+
+    def _rewrite(self, users:list) -> None:
+        """Replaces the log with one record per user"""
+        _temp_path = "{}.tmp".format(self.path)
+        with open(_temp_path, "wb") as log_file:
+            for _user in users:
+                _line = _user.to_dict()
+                _line["id"] = _user.user_id
+                log_file.write(bytes(json.dumps(_line) + "\n", "utf-8"))
+            log_file.flush()
+            os.fsync(log_file.fileno())
+        os.replace(_temp_path, self.path)
+
+        self._file.close()
+        self._file = open(self.path, "ab")
+
+    def _run_compactions(self, interval:float, persist) -> None:
+        _compacted_version = self.version
+        while not self._stop.wait(interval):
+            # nothing to do until users are written
+            if self.version != _compacted_version:
+                self.compact(persist)
+                _compacted_version = self.version
+
+    def close(self) -> None:
+        """Waits for queued writes to be synced and closes the log"""
+        self._stop.set()
+        with self._lock:
+            self._closing = True
+            self._queued.notify()
+        if self._thread is not None:
+            self._thread.join()
+        if self._compactor is not None and self._compactor is not threading.current_thread():
+            self._compactor.join()
+        with self._file_lock:
+            self._file.close()
+
+
+class LoggedUserStore(UserStore):
+    """LoggedUserStore reads users from a store with the writes of a
+    UserWriteLog laid over it
+
+    Lookups check the log's in-memory overlay and then the store, neither
+    takes a lock. Writes replace single users, they don't change the
+    version, so responses cached for other users stay valid.
+    """
+    def __init__(self, base:UserStore, log:UserWriteLog) -> None:
+        """
+        Args:
+            base (UserStore): the read-optimized store
+            log (UserWriteLog): the writes made since the last compaction
+        """
+        self.base = base
+        self.log = log
+        # count() is cached until the store or the log changes
+        self._count = None
+
+    @property
+    def version(self) -> int:
+        return self.base.version
+
+    @property
+    def modified_at(self) -> float:
+        return max(self.base.modified_at, self.log.users.modified_at)
+
+    def get_user(self, user_id:str) -> UserRecord:
+        _user = self.log.users.get_user(user_id)
+        if _user is not None:
+            return _user
+        return self.base.get_user(user_id)
+
+    def get_user_by_username(self, username:str) -> UserRecord:
+        _user = self.log.users.get_user_by_username(username)
+        if _user is not None:
+            return _user
+
+        _user = self.base.get_user_by_username(username)
+        # the user may have been renamed since
+        if _user is not None and self.log.users.get_user(_user.user_id) is not None:
+            return None
+        return _user
+
+    def add_users(self, users) -> int:
+        _added = 0
+        for user_id, user in users:
+            self.log.write(str(user_id), user)
+            _added += 1
+        return _added
+
+    def iter_users(self, after:str=None, limit:int=None):
+        # neither walk needs more users than the merged walk returns
+        _users = self._merge_users(self.log.users.iter_users(after, limit), self.base.iter_users(after, limit))
+        if limit is not None:
+            _users = itertools.islice(_users, limit)
+        yield from _users
+
+    @staticmethod
+    def _merge_users(written, base):
+        """Yields the users of two walks in order of id, written users replace base users"""
+        _user = next(written, None)
+        for _base_user in base:
+            # the walks are in the same order, written users are merged in
+            # str order is code point order, which matches UTF-8 byte order
+            while _user is not None and _user.user_id < _base_user.user_id:
+                yield _user
+                _user = next(written, None)
+
+            if _user is not None and _user.user_id == _base_user.user_id:
+                yield _user
+                _user = next(written, None)
+            else:
+                yield _base_user
+
+        while _user is not None:
+            yield _user
+            _user = next(written, None)
+
+    def count(self) -> int:
+        _key = (self.base.version, self.log.version)
+        if self._count is None or self._count[0] != _key:
+            _users = self.log.users
+            _new = sum(1 for _user in _users.iter_users() if self.base.get_user(_user.user_id) is None)
+            self._count = (_key, self.base.count() + _new)
+        return self._count[1]
+
+    def close(self) -> None:
+        # the log outlives the stores it is laid over
+        self.base.close()
+
+
+def _merge_users(store:UserStore, users:list):
+    """Yields (user_id, dict) pairs of every user in store, replaced by users with the same id"""
+    _written = {_user.user_id: _user for _user in users}
+    for _user in store.iter_users():
+        yield _user.user_id, _written.pop(_user.user_id, _user).to_dict()
+    for _user in _written.values():
+        yield _user.user_id, _user.to_dict()
+
+
+def persist_users(backend:str, source:str, users:list) -> bool:
+    """Writes users into the source of a user store backend, for
+    UserWriteLog.compact
+
+    Args:
+        backend (str): memory, sqlite or snapshot
+        source (str): the source of the backend
+        users (list): the UserRecords to write
+
+    Returns:
+        bool: True if the users were written, the memory backend and the
+            built-in users have no source to write to
+    """
+    if source is None:
+        return False
+
+    if backend == USER_STORE_SQLITE:
+        _database = SQLiteUserStore(source)
+        try:
+            _database.add_users((_user.user_id, _user.to_dict()) for _user in users)
+        finally:
+            _database.close()
+        return True
+
+    if backend == USER_STORE_SNAPSHOT:
+        _snapshot = SnapshotUserStore(source)
+        try:
+            write_snapshot(source, _merge_users(_snapshot, users))
+        finally:
+            _snapshot.close()
+        return True
+
+    return False
@@ -0,0 +1,269 @@
+import logging
+import os
+import signal
+import threading
+import time
+
+
+class ReaderEpochs:
+    """ReaderEpochs tracks the requests which may be reading a user store,
+    so a replaced store is only closed once none can be
+
+    Requests enter the current epoch when they start and exit it when they
+    finish. They may finish on another thread, and a thread may interleave
+    many requests, as the asyncio server's event loop does with streamed
+    bodies. Once a store is replaced, advance() starts a new epoch, the
+    requests which start after it can only read the new store.
+
+    Methods
+    -------
+    enter() - marks a request as started and returns its epoch
+    exit(epoch) - marks a request of epoch as finished
+    advance() - starts a new epoch and returns the one which ended
+    finished(epoch) - returns True once every request of epoch, or before, has finished
+    """
+    def __init__(self) -> None:
+        self._epoch = 0
+        # the number of requests in flight, by epoch
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+        # requests in flight when a worker is forked don't run in it
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def enter(self) -> int:
+        """Marks a request as started
+
+        Returns:
+            int: the epoch to pass to exit
+        """
+        with self._lock:
+            _epoch = self._epoch
+            self._in_flight[_epoch] = self._in_flight.get(_epoch, 0) + 1
+            return _epoch
+
+    def exit(self, epoch:int) -> None:
+        """Marks a request as finished"""
+        with self._lock:
+            _count = self._in_flight[epoch] - 1
+            if _count:
+                self._in_flight[epoch] = _count
+            else:
+                del self._in_flight[epoch]
+
+    def advance(self) -> int:
+        """Starts a new epoch, call it once a store has been replaced
+
+        Returns:
+            int: the epoch which ended, to pass to finished
+        """
+        with self._lock:
+            self._epoch += 1
+            return self._epoch - 1
+
+    def finished(self, epoch:int) -> bool:
+        """Returns True once every request of epoch, or an earlier one, has finished"""
+        with self._lock:
+            return not any(_epoch <= epoch for _epoch in self._in_flight)
+
+
+# The requests reading user stores, shared by every serving mode, per process
+readers = ReaderEpochs()
+
+
+class UserStoreReloader:
+    """UserStoreReloader loads a new user store on a background thread and
+    swaps it in while requests are being served
+
+    The new store is loaded and validated completely before it is applied,
+    so requests see the old or the new store, never a partly loaded one.
+    The old store is closed once the requests which were in flight when it
+    was replaced have finished. A reload runs when it is requested, for
+    example by a signal or an admin route, or when polling finds the source
+    file changed. Routes check reloading and retry_after() first, so clients
+    can't keep the process loading users.
+
+    Attributes:
+        store -- the store in use
+        last_reload -- epoch time of the last successful reload
+        last_error -- why the last reload failed, or None
+        reloads -- number of successful reloads
+
+    Methods
+    -------
+    start() - starts the reload thread
+    stop() - stops the reload thread
+    request_reload() - asks the reload thread to reload
+    retry_after() - seconds until a requested reload should be accepted
+    reload() - loads, validates and applies a new store
+    install_signal_handler(signum) - reloads when the process receives signum
+    """
+    def __init__(self, load, apply, store, source:str=None, poll_interval:float=0,
+                 requests=None, drain_timeout:float=30, min_request_interval:float=10) -> None:
+        """
+        Args:
+            load (callable): returns a new, loaded UserStore
+            apply (callable): called with the new store to swap it in
+            store (UserStore): the store in use
+            source (str, optional): a file polled for changes. Defaults to None.
+            poll_interval (float, optional): seconds between polls, 0 disables polling. Defaults to 0.
+            requests (ReaderEpochs, optional): tracks the requests reading stores,
+                without it old stores are closed straight away. Defaults to None.
+            drain_timeout (float, optional): longest wait for requests to finish before
+                an old store is left open for garbage collection. Defaults to 30.
+            min_request_interval (float, optional): seconds after a reload starts before
+                retry_after() lets another be requested. Defaults to 10.
+        """
+        self._load = load
+        self._apply = apply
+        self.store = store
+        self.source = source
+        self.poll_interval = poll_interval
+        self.drain_timeout = drain_timeout
+        self.min_request_interval = min_request_interval
+        self._requests = requests
+        self.last_reload = None
+        self.last_error = None
+        self.reloads = 0
+        # the monotonic time the last reload started, failed ones included
+        self._last_started = None
+        self._signature = self._source_signature()
+        self._reload_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._fork_hook_registered = False
+
+    def start(self) -> None:
+        """Starts the reload thread"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="user-reloader", daemon=True)
+        self._thread.start()
+
+        # threads don't survive fork, so forked workers start their own
+        if not self._fork_hook_registered and hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+            self._fork_hook_registered = True
+
+    def _after_fork(self) -> None:
+        if self._thread is not None and not self._stop.is_set():
+            self._stop = threading.Event()
+            self._wake = threading.Event()
+            self._reload_lock = threading.Lock()
+            self.start()
+
+    def stop(self) -> None:
+        """Stops the reload thread and waits for it to exit"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def request_reload(self) -> None:
+        """Asks the reload thread to reload, safe to call from signal handlers"""
+        self._wake.set()
+
+    @property
+    def reloading(self) -> bool:
+        """True while a reload is requested or running"""
+        return self._wake.is_set() or self._reload_lock.locked()
+
+    def retry_after(self) -> float:
+        """Returns the seconds until min_request_interval has passed since
+        the last reload started, 0 when another may be requested"""
+        if self._last_started is None:
+            return 0.0
+        return max(0.0, self._last_started + self.min_request_interval - time.monotonic())
+
+    def install_signal_handler(self, signum:int=signal.SIGHUP) -> None:
+        """Reloads when the process receives signum, must be called from the main thread"""
+        signal.signal(signum, lambda received, frame: self.request_reload())
+
+    def _source_signature(self) -> tuple:
+        """Returns the modification time and size of the source, or None"""
+        if self.source is None:
+            return None
+        try:
+            _stat = os.stat(self.source)
+        except OSError:
+            return None
+        return (_stat.st_mtime_ns, _stat.st_size)
+
+    def changed(self) -> bool:
+        """Returns True if the source file changed since the last reload"""
+        _signature = self._source_signature()
+        return _signature is not None and _signature != self._signature
+
+    def reload(self) -> bool:
+        """Loads, validates and applies a new store, then closes the old one
+
+        Returns:
+            bool: True if the new store was applied
+        """
+        with self._reload_lock:
+            self._last_started = time.monotonic()
+            _signature = self._source_signature()
+            _start = time.perf_counter()
+            try:
+                _store = self._load()
+                if _store.count() == 0 and self.store is not None and self.store.count() > 0:
+                    _store.close()
+                    raise ValueError("the new user store is empty")
+            except Exception as e:
+                self.last_error = str(e)
+                # don't retry the same file until it changes again
+                self._signature = _signature
+                logging.warning("Unable to reload users, keeping %s users: %s",
+                                self.store.count() if self.store is not None else 0, e)
+                return False
+
+            _old = self.store
+            self._apply(_store)
+            self.store = _store
+            self._signature = _signature
+            self.last_reload = time.time()
+            self.last_error = None
+            self.reloads += 1
+            logging.info("Reloaded %s users in %.1f seconds", _store.count(), time.perf_counter() - _start)
+
+            if _old is not None and _old is not _store:
+                self._release(_old)
+
+            return True
+
+    def _release(self, store) -> None:
+        """Closes a replaced store once the requests which may be reading it have finished"""
+        if self._requests is not None:
+            _epoch = self._requests.advance()
+            _deadline = time.monotonic() + self.drain_timeout
+            while not self._requests.finished(_epoch):
+                if time.monotonic() >= _deadline:
+                    logging.warning("Requests still running %s seconds after a reload, "
+                                    "leaving the old user store open", self.drain_timeout)
+                    return
+                time.sleep(0.01)
+
+        store.close()
+
+    def _run(self) -> None:
+        _timeout = self.poll_interval if self.poll_interval > 0 and self.source is not None else None
+        while not self._stop.is_set():
+            _requested = self._wake.wait(_timeout)
+            if self._stop.is_set():
+                break
+
+            # a failure, such as closing the old store, mustn't stop reloads for good
+            try:
+                if _requested:
+                    self._wake.clear()
+                    self.reload()
+                elif self.changed():
+                    logging.info("User source %s changed", self.source)
+                    self.reload()
+            except Exception:
+                logging.exception("Unable to reload users")
@@ -0,0 +1,275 @@
+import base64
+import binascii
+import logging
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left, bisect_right
+
+# The user fields searched by prefix
+SEARCH_FIELDS = ("username", "first_name", "last_name")
+
+# Separates the name and the user id in a cursor, names never contain it
+_SEPARATOR = "\x00"
+
+
+class InvalidCursorException(ValueError):
+    """Exception raised when a search cursor can't be decoded
+    Attributes:
+        cursor -- the cursor received
+        message -- explination of the error
+    """
+    def __init__(self, cursor:str) -> None:
+        self.cursor = cursor
+        self.message = "invalid cursor: {}".format(cursor)
+        super().__init__(self.message)
+
+    def __str__(self):
+        return self.message
+
+
+def normalize(value:str) -> str:
+    """Returns the form names and prefixes are compared in"""
+    return value.casefold().replace(_SEPARATOR, "")
+
+
+def encode_cursor(name:str, user_id:str) -> str:
+    """Returns an opaque cursor for the search entry (name, user_id)"""
+    _raw = "{}{}{}".format(name, _SEPARATOR, user_id).encode("utf-8")
+    return base64.urlsafe_b64encode(_raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor:str) -> tuple:
+    """Returns the (name, user_id) search entry of a cursor
+
+    Raises:
+        InvalidCursorException: if the cursor wasn't made by encode_cursor
+    """
+    try:
+        _raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+    except (ValueError, binascii.Error):
+        raise InvalidCursorException(cursor)
+
+    _name, _separator, _user_id = _raw.partition(_SEPARATOR)
+    if not _separator or not _user_id:
+        raise InvalidCursorException(cursor)
+    return _name, _user_id
+
+
+class UserSearchIndex:
+    """UserSearchIndex finds users whose username, first name or last name
+    starts with a prefix
+
+    Every non-empty name of every user is an entry, sorted by the name
+    compared without case and then by user id. A search bisects to the
+    first entry with the prefix and walks forward, so its cost depends on
+    the size of the page and not on the number of users. The names and ids
+    are held in two parallel lists, and repeated names are stored once.
+
+    The index is built once from a store and never changes, a reloaded
+    store gets a new index. It doesn't hold on to the store, so a store
+    which has been replaced can be freed while its index is still searched.
+
+    Attributes:
+        version -- the version of the store when the index was built
+        build_seconds -- time spent building the index
+
+    Methods
+    -------
+    search(prefix, limit, cursor) - returns a page of users whose names start with prefix
+    """
+    def __init__(self, store) -> None:
+        """
+        Args:
+            store (UserStore): the users to index
+        """
+        self.version = store.version
+        _start = time.perf_counter()
+
+        # repeated names such as first names share one string
+        _names = {}
+        _entries = []
+        for _user in store.iter_users():
+            for _field in SEARCH_FIELDS:
+                _name = normalize(getattr(_user, _field))
+                if not _name:
+                    continue
+                _name = _names.setdefault(_name, _name)
+                _entries.append((_name, _user.user_id))
+        _entries.sort()
+
+        self._names = [_entry[0] for _entry in _entries]
+        self._ids = [_entry[1] for _entry in _entries]
+        self.build_seconds = time.perf_counter() - _start
+        logging.info("Indexed %s names of %s users for search in %.1f seconds",
+                     len(self._names), store.count(), self.build_seconds)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _start(self, prefix:str, cursor:str) -> int:
+        """Returns the position of the first entry of a page"""
+        if cursor is None:
+            return bisect_left(self._names, prefix)
+
+        _name, _user_id = decode_cursor(cursor)
+        # a cursor from another search would skip or repeat results
+        if not _name.startswith(prefix):
+            raise InvalidCursorException(cursor)
+
+        # entries with the same name are in order of id
+        _low = bisect_left(self._names, _name)
+        _high = bisect_right(self._names, _name, _low)
+        return bisect_right(self._ids, _user_id, _low, _high)
+
+    def search(self, prefix:str, limit:int, cursor:str=None) -> tuple:
+        """Returns a page of the users with a name starting with prefix
+
+        A user whose names match more than once is only returned once in a
+        page, it can be returned again on a later page.
+
+        Args:
+            prefix (str): the start of a username, first name or last name, case is ignored
+            limit (int): the most users to return
+            cursor (str, optional): next_cursor of the previous page. Defaults to None.
+
+        Raises:
+            InvalidCursorException: if the cursor is invalid
+
+        Returns:
+            tuple: (list of user ids, the cursor of the next page or None)
+        """
+        _prefix = normalize(prefix)
+        _names = self._names
+        _ids = self._ids
+        _position = self._start(_prefix, cursor)
+        _end = len(_names)
+
+        _user_ids = []
+        _seen = set()
+        while _position < _end and len(_user_ids) < limit:
+            if not _names[_position].startswith(_prefix):
+                return _user_ids, None
+
+            _user_id = _ids[_position]
+            if _user_id not in _seen:
+                _seen.add(_user_id)
+                _user_ids.append(_user_id)
+            _position += 1
+
+        # only hand out a cursor when another match follows
+        if _position < _end and _names[_position].startswith(_prefix):
+            return _user_ids, encode_cursor(_names[_position - 1], _ids[_position - 1])
+        return _user_ids, None
+
+
+class SearchIndexer:
+    """SearchIndexer builds the UserSearchIndex of the store being served on
+    a background thread, the first time a search needs it
+
+    Building an index reads every user, so it isn't done while starting or
+    reloading, which would make them take time in proportion to the users
+    again. Searches can't be answered until the first index is ready, after
+    a reload or a write the old index is searched until the new one is
+    ready. An index is of a store at a version, which callers pass when the
+    store's own version doesn't change on writes. One index is built at a
+    time, so a burst of writes is indexed by one build. Every process builds its own index, so each prefork
+    worker which is searched holds a copy.
+
+    Attributes:
+        index -- the latest index built, or None
+        builds -- number of indexes built
+        last_error -- why the last build failed, or None
+
+    Methods
+    -------
+    get(store, version) - returns the latest index, building one of store in the background when it is out of date
+    """
+    def __init__(self, build=UserSearchIndex) -> None:
+        """
+        Args:
+            build (callable, optional): builds an index of a store. Defaults to UserSearchIndex.
+        """
+        self.index = None
+        self.builds = 0
+        self.last_error = None
+        self._build = build
+        # the store indexed, and the store the running build should index,
+        # with the versions they were at
+        self._indexed = None
+        self._indexed_version = None
+        self._wanted = None
+        self._wanted_version = None
+        self._running = False
+        self._lock = threading.Lock()
+
+        # threads don't survive fork, so a forked worker starts its own build
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        self._wanted = None
+        self._running = False
+
+    def get(self, store, version=None) -> UserSearchIndex:
+        """Returns the latest index, starting a build of store in the
+        background if the index isn't of store at version
+
+        Args:
+            store (UserStore): the store being served
+            version (optional): the version of the users in store. Defaults to None,
+                which uses store.version.
+
+        Returns:
+            UserSearchIndex: the latest index, or None until the first is built
+        """
+        if version is None:
+            version = store.version
+        if self._indexed is not None and self._indexed() is store and self._indexed_version == version:
+            return self.index
+
+        with self._lock:
+            if self._wanted is None or self._wanted() is not store or self._wanted_version != version:
+                self._wanted = weakref.ref(store)
+                self._wanted_version = version
+                if not self._running:
+                    self._running = True
+                    threading.Thread(target=self._run, name="search-indexer", daemon=True).start()
+
+        return self.index
+
+    def _run(self) -> None:
+        """Builds indexes until the latest store wanted is indexed"""
+        while True:
+            with self._lock:
+                _store = self._wanted()
+                _version = self._wanted_version
+                # the store was replaced and freed before it was indexed
+                if _store is None:
+                    self._wanted = None
+                    self._running = False
+                    return
+
+            try:
+                _index = self._build(_store)
+                self.last_error = None
+            except Exception as e:
+                # the next search tries again
+                logging.exception("Unable to build the user search index")
+                self.last_error = str(e)
+                _index = None
+
+            with self._lock:
+                if _index is not None:
+                    self.index = _index
+                    self._indexed = weakref.ref(_store)
+                    self._indexed_version = _version
+                    self.builds += 1
+
+                if self._wanted() is _store and self._wanted_version == _version:
+                    if _index is None:
+                        self._wanted = None
+                    self._running = False
+                    return
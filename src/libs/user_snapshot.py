@@ -0,0 +1,352 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from .user_store import USER_FIELDS, UserRecord, UserStore
+
+# Identifies a user snapshot file
+SNAPSHOT_MAGIC = b"USERSNAP"
+# The snapshot format version, incremented whenever the layout changes
+SNAPSHOT_VERSION = 1
+
+# magic, version, flags, count, username index offset, heap offset, heap size, checksum
+_HEADER = struct.Struct("<8sIIQQQQ16s")
+# heap offsets of a record's id and USER_FIELDS
+_RECORD = struct.Struct("<{}I".format(1 + len(USER_FIELDS)))
+# record number in the username index
+_POSITION = struct.Struct("<I")
+# length prefix of a heap string
+_LENGTH = struct.Struct("<H")
+
+# offsets in a record
+_FIELDS = 1 + len(USER_FIELDS)
+# positions of the id and username in a record
+_ID = 0
+_USERNAME = 1 + USER_FIELDS.index("username")
+
+# bytes read at a time when checksumming
+_CHUNK_SIZE = 1048576
+# seconds between attempts to close a mapping readers still hold slices of
+CLOSE_RETRY_INTERVAL = 1.0
+
+
+class SnapshotWriter:
+    """SnapshotWriter builds a user snapshot file
+
+    A snapshot is a header, a fixed-width index of records sorted by user
+    id, a fixed-width index of record numbers sorted by username and a heap
+    of length-prefixed UTF-8 strings. Records hold the heap offsets of their
+    fields, and repeated values such as icons are stored once. Every integer
+    is little endian. The checksum is a blake2b digest of everything after
+    the header.
+
+    Strings are written to a temporary heap file as users are added, only
+    the ids, usernames and offsets are kept in memory until close() sorts
+    them and writes the file. It has the add_users() and close() methods of
+    a UserStore, so libs.user_import can stream users into it.
+
+    Methods
+    -------
+    add_users(users) - adds (user_id, dict) pairs to the snapshot
+    close() - writes the snapshot file
+    abort() - discards the snapshot without writing it
+    """
+    def __init__(self, path:str) -> None:
+        """
+        Args:
+            path (str): the snapshot file to write, replaced atomically on close
+        """
+        self.path = path
+        self._heap = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        self._heap_size = 0
+        # repeated values -> heap offset
+        self._shared = {}
+        # user id -> (username, record offsets)
+        self._records = {}
+
+    def _add_string(self, value:str, shared:bool) -> int:
+        """Writes a string to the heap and returns its offset"""
+        if shared:
+            _offset = self._shared.get(value)
+            if _offset is not None:
+                return _offset
+
+        _encoded = value.encode("utf-8")
+        if len(_encoded) > 65535:
+            raise ValueError("Snapshot strings are limited to 65535 bytes: {}...".format(value[:20]))
+
+        _offset = self._heap_size
+        if _offset + 2 + len(_encoded) > 0xFFFFFFFF:
+            raise ValueError("Snapshot heaps are limited to 4GiB")
+
+        self._heap.write(_LENGTH.pack(len(_encoded)))
+        self._heap.write(_encoded)
+        self._heap_size += 2 + len(_encoded)
+
+        if shared:
+            self._shared[value] = _offset
+        return _offset
+
+    def add_users(self, users) -> int:
+        """Adds (user_id, dict) pairs, later users replace earlier ones with the same id"""
+        _added = 0
+        for user_id, user in users:
+            _user_id = str(user_id)
+            _fields = [str(user.get(field, "")) for field in USER_FIELDS]
+            _offsets = (self._add_string(_user_id, False),) + tuple(
+                self._add_string(_value, field != "username") for field, _value in zip(USER_FIELDS, _fields)
+            )
+            self._records[_user_id] = (_fields[_USERNAME - 1], _offsets)
+            _added += 1
+        return _added
+
+    def count(self) -> int:
+        return len(self._records)
+
+    def abort(self) -> None:
+        """Discards the snapshot without writing it"""
+        if self._heap is not None:
+            self._heap.close()
+            self._heap = None
+        self._records = {}
+        self._shared = {}
+
+    def close(self) -> None:
+        """Sorts the indexes and writes the snapshot file"""
+        if self._heap is None:
+            return
+
+        # ids are compared as UTF-8 bytes, like the reader does
+        _ids = sorted(self._records, key=lambda user_id: user_id.encode("utf-8"))
+        _index = array("I")
+        for _user_id in _ids:
+            _index.extend(self._records[_user_id][1])
+
+        _by_username = sorted(range(len(_ids)),
+                              key=lambda position: self._records[_ids[position]][0].encode("utf-8"))
+        _usernames = array("I", _by_username)
+
+        if struct.pack("=I", 1) != struct.pack("<I", 1):
+            _index.byteswap()
+            _usernames.byteswap()
+
+        _index_bytes = _index.tobytes()
+        _username_bytes = _usernames.tobytes()
+        _username_offset = _HEADER.size + len(_index_bytes)
+        _heap_offset = _username_offset + len(_username_bytes)
+
+        _checksum = hashlib.blake2b(digest_size=16)
+        _checksum.update(_index_bytes)
+        _checksum.update(_username_bytes)
+        self._heap.seek(0)
+        for _chunk in iter(lambda: self._heap.read(_CHUNK_SIZE), b""):
+            _checksum.update(_chunk)
+
+        _header = _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, len(_ids),
+                               _username_offset, _heap_offset, self._heap_size, _checksum.digest())
+
+        # write beside the destination and rename, so readers never see a partial file
+        _temp_path = "{}.tmp".format(self.path)
+        with open(_temp_path, "wb") as snapshot_file:
+            snapshot_file.write(_header)
+            snapshot_file.write(_index_bytes)
+            snapshot_file.write(_username_bytes)
+            self._heap.seek(0)
+            for _chunk in iter(lambda: self._heap.read(_CHUNK_SIZE), b""):
+                snapshot_file.write(_chunk)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(_temp_path, self.path)
+        self.abort()
+
+
+class SnapshotUserStore(UserStore):
+    """SnapshotUserStore serves users from a memory-mapped snapshot written
+    by SnapshotWriter
+
+    Opening a snapshot only reads its header, so startup takes the same
+    time for any number of users. Lookups binary search the mapped indexes
+    and decode just the fields of the user found, straight from the page
+    cache. Forked workers, and other processes opening the same file, share
+    one copy of it in memory.
+    """
+    def __init__(self, path:str, verify:bool=False) -> None:
+        """
+        Args:
+            path (str): the snapshot file
+            verify (bool, optional): check the checksum, which reads the whole file.
+                Defaults to False.
+
+        Raises:
+            ValueError: if the file isn't a valid snapshot
+        """
+        self._path = path
+        with open(path, "rb") as snapshot_file:
+            _size = os.fstat(snapshot_file.fileno()).st_size
+            if _size < _HEADER.size:
+                raise ValueError("{} is not a user snapshot".format(path))
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            (_magic, _version, _, self._count, self._username_offset,
+             self._heap_offset, _heap_size, self.checksum) = _HEADER.unpack_from(self._mmap, 0)
+
+            if _magic != SNAPSHOT_MAGIC:
+                raise ValueError("{} is not a user snapshot".format(path))
+            if _version != SNAPSHOT_VERSION:
+                raise ValueError("{} is snapshot version {}, expected {}".format(path, _version, SNAPSHOT_VERSION))
+            if (self._username_offset != _HEADER.size + self._count * _RECORD.size
+                    or self._heap_offset != self._username_offset + self._count * _POSITION.size
+                    or _size != self._heap_offset + _heap_size):
+                raise ValueError("{} is truncated or corrupt".format(path))
+            if verify and not self.verify():
+                raise ValueError("{} failed its checksum".format(path))
+        except Exception:
+            self._mmap.close()
+            raise
+
+        # the indexes are read as native unsigned ints, which match the
+        # little endian file on every host the service runs on
+        if sys.byteorder != "little":
+            self._mmap.close()
+            raise ValueError("User snapshots can only be mapped on little endian hosts")
+        self._map_indexes()
+        self._close_lock = threading.Lock()
+
+        self.modified_at = os.path.getmtime(path)
+        # the snapshot never changes, so it is always the first version
+        self.version = 1
+
+    def _map_indexes(self) -> None:
+        """Views the id and username indexes in the mapping"""
+        _view = memoryview(self._mmap)
+        self._records = _view[_HEADER.size:self._username_offset].cast("I")
+        self._usernames = _view[self._username_offset:self._heap_offset].cast("I")
+        _view.release()
+
+    def verify(self) -> bool:
+        """Returns True if the snapshot matches its checksum"""
+        _checksum = hashlib.blake2b(digest_size=16)
+        for _offset in range(_HEADER.size, len(self._mmap), _CHUNK_SIZE):
+            _checksum.update(self._mmap[_offset:_offset + _CHUNK_SIZE])
+        return _checksum.digest() == self.checksum
+
+    def _string(self, offset:int) -> bytes:
+        """Returns the encoded heap string at offset"""
+        _mmap = self._mmap
+        _start = self._heap_offset + offset
+        return _mmap[_start + 2:_start + 2 + (_mmap[_start] | _mmap[_start + 1] << 8)]
+
+    def _record(self, position:int) -> UserRecord:
+        """Decodes the record at a position in the id index"""
+        _first = position * _FIELDS
+        return UserRecord(*(self._string(_offset).decode("utf-8")
+                            for _offset in self._records[_first:_first + _FIELDS]))
+
+    def _lower_bound(self, user_id:bytes) -> int:
+        """Returns the position of the first id after user_id"""
+        _records = self._records
+        _string = self._string
+        _low, _high = 0, self._count
+        while _low < _high:
+            _middle = (_low + _high) // 2
+            if _string(_records[_middle * _FIELDS + _ID]) <= user_id:
+                _low = _middle + 1
+            else:
+                _high = _middle
+        return _low
+
+    def _search(self, value:bytes, field:int, positions) -> int:
+        """Binary searches the records for a field value
+
+        Args:
+            value (bytes): the encoded value
+            field (int): the position of the field in a record
+            positions: the record numbers in order of the field, or None
+                when the records themselves are in that order
+
+        Returns:
+            int: the record number or -1
+        """
+        _records = self._records
+        _string = self._string
+        _low, _high = 0, self._count
+        while _low < _high:
+            _middle = (_low + _high) // 2
+            _position = _middle if positions is None else positions[_middle]
+            _found = _string(_records[_position * _FIELDS + field])
+            if _found < value:
+                _low = _middle + 1
+            elif _found > value:
+                _high = _middle
+            else:
+                return _position
+        return -1
+
+    def get_user(self, user_id:str) -> UserRecord:
+        _position = self._search(user_id.encode("utf-8"), _ID, None)
+        if _position < 0:
+            return None
+        return self._record(_position)
+
+    def get_user_by_username(self, username:str) -> UserRecord:
+        _position = self._search(username.encode("utf-8"), _USERNAME, self._usernames)
+        if _position < 0:
+            return None
+        return self._record(_position)
+
+    def iter_users(self, after:str=None, limit:int=None):
+        _start = 0 if after is None else self._lower_bound(after.encode("utf-8"))
+        _end = self._count if limit is None else min(self._count, _start + limit)
+        for _position in range(_start, _end):
+            yield self._record(_position)
+
+    def add_users(self, users) -> int:
+        raise NotImplementedError("User snapshots are read only, write a new one with SnapshotWriter")
+
+    def count(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        """Closes the mapping, once no reader holds a slice of it
+
+        A reader still decoding a record when the store is closed, such as
+        one which outlasted a reload's drain timeout, keeps the mapping
+        exported. Then the indexes are mapped again for it and the close is
+        retried every CLOSE_RETRY_INTERVAL seconds.
+        """
+        with self._close_lock:
+            if self._mmap.closed:
+                return
+
+            # the indexes must be released before the mapping can close
+            self._records.release()
+            self._usernames.release()
+            try:
+                self._mmap.close()
+            except BufferError:
+                self._map_indexes()
+                _retry = threading.Timer(CLOSE_RETRY_INTERVAL, self.close)
+                _retry.daemon = True
+                _retry.start()
+
+
+def write_snapshot(path:str, users) -> int:
+    """Writes (user_id, dict) pairs to a snapshot file
+
+    Returns:
+        int: the number of users in the snapshot
+    """
+    _writer = SnapshotWriter(path)
+    try:
+        _writer.add_users(users)
+        _count = _writer.count()
+        _writer.close()
+    except Exception:
+        _writer.abort()
+        raise
+    return _count
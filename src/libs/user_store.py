@@ -0,0 +1,412 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from abc import ABC
+from bisect import bisect_right
+
+# The fields stored for every user
+USER_FIELDS = ("first_name", "last_name", "username", "icon")
+
+# Supported user store backends
+USER_STORE_MEMORY = "memory"
+USER_STORE_SQLITE = "sqlite"
+USER_STORE_SNAPSHOT = "snapshot"
+USER_STORE_BACKENDS = (USER_STORE_MEMORY, USER_STORE_SQLITE, USER_STORE_SNAPSHOT)
+
+
+class UserRecord:
+    """UserRecord is a compact, read-only view of a single user
+
+    Attributes:
+        user_id -- the id of the user
+        first_name -- the user's first name
+        last_name -- the user's last name
+        username -- the user's username
+        icon -- the location of the user's icon
+    """
+    __slots__ = ("user_id",) + USER_FIELDS
+
+    def __init__(self, user_id:str, first_name:str, last_name:str, username:str, icon:str) -> None:
+        self.user_id = user_id
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+        self.icon = icon
+
+    def to_dict(self) -> dict:
+        """Returns the user's fields as a dict"""
+        return {field: getattr(self, field) for field in USER_FIELDS}
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, UserRecord):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self) -> str:
+        return "UserRecord({!r}, {!r})".format(self.user_id, self.username)
+
+
+class UserStore(ABC):
+    """UserStore is an abstract class which dictates the outline
+        of classes which store user data
+
+    Attributes
+    ----------
+        version - incremented whenever users are added or replaced
+        modified_at - the time users were last added or replaced
+
+    Methods
+    -------
+        get_user(user_id:str) - gets a user by id
+        get_user_by_username(username:str) - gets a user by username
+        add_users(users:iterable) - adds (user_id, dict) pairs to the store
+        iter_users(after:str, limit:int) - walks the users in order of id
+        count() - the number of users in the store
+        close() - releases any resources held by the store
+    """
+    version = 0
+    modified_at = 0.0
+
+    def get_user(self, user_id:str) -> UserRecord:
+        """Returns the user with user_id or None"""
+
+    def get_user_by_username(self, username:str) -> UserRecord:
+        """Returns the user with username or None"""
+
+    def add_users(self, users) -> int:
+        """Adds (user_id, dict) pairs to the store, returns the number added"""
+
+    def iter_users(self, after:str=None, limit:int=None):
+        """Yields every UserRecord in order of user id, compared as UTF-8
+        bytes, starting after the id after and stopping after limit users"""
+
+    def count(self) -> int:
+        """Returns the number of users in the store"""
+
+    def close(self) -> None:
+        """Releases any resources held by the store"""
+
+
+class MemoryUserStore(UserStore):
+    """MemoryUserStore keeps every user in memory as a __slots__ record with
+    interned strings, indexed by id and by username
+
+    Repeated values such as icon names and common first names are stored
+    once, so memory use grows with the number of users rather than with the
+    size of the source file.
+    """
+    def __init__(self, users=None) -> None:
+        """
+        Args:
+            users (iterable, optional): (user_id, dict) pairs to load. Defaults to None.
+        """
+        self._users = {}
+        self._usernames = {}
+        # ids in order, rebuilt on the first walk after users change
+        self._sorted_ids = []
+        self._sorted_version = 0
+        self._sort_lock = threading.Lock()
+        if users is not None:
+            self.add_users(users)
+
+    def get_user(self, user_id:str) -> UserRecord:
+        return self._users.get(user_id)
+
+    def get_user_by_username(self, username:str) -> UserRecord:
+        return self._usernames.get(username)
+
+    def add_users(self, users) -> int:
+        _intern = sys.intern
+        _added = 0
+        for user_id, user in users:
+            _user_id = _intern(str(user_id))
+            _record = UserRecord(_user_id, *(_intern(str(user.get(field, ""))) for field in USER_FIELDS))
+
+            # drop the old username index entry when a user is replaced
+            _old = self._users.get(_user_id)
+            if _old is not None and self._usernames.get(_old.username) is _old:
+                del self._usernames[_old.username]
+
+            self._users[_user_id] = _record
+            self._usernames[_record.username] = _record
+            _added += 1
+
+        if _added:
+            self.version += 1
+            self.modified_at = time.time()
+
+        return _added
+
+    def _ids_in_order(self) -> list:
+        """Returns the user ids in order, sorting them when users changed"""
+        if self._sorted_version != self.version:
+            with self._sort_lock:
+                if self._sorted_version != self.version:
+                    _version = self.version
+                    # str order is code point order, which matches UTF-8 byte order
+                    self._sorted_ids = sorted(self._users)
+                    self._sorted_version = _version
+        return self._sorted_ids
+
+    def iter_users(self, after:str=None, limit:int=None):
+        _ids = self._ids_in_order()
+        _start = 0 if after is None else bisect_right(_ids, after)
+        _yielded = 0
+        for i in range(_start, len(_ids)):
+            if limit is not None and _yielded >= limit:
+                return
+            _user = self._users.get(_ids[i])
+            if _user is not None:
+                yield _user
+                _yielded += 1
+
+    def count(self) -> int:
+        return len(self._users)
+
+    def close(self) -> None:
+        pass
+
+    def memory_usage(self) -> int:
+        """Measures the bytes used by the store, counting shared strings once
+
+        Returns:
+            int: bytes used by the indexes, records and strings
+        """
+        _seen = set()
+        _total = sys.getsizeof(self._users) + sys.getsizeof(self._usernames)
+
+        for _record in self._users.values():
+            _total += sys.getsizeof(_record)
+            for slot in UserRecord.__slots__:
+                _value = getattr(_record, slot)
+                if id(_value) not in _seen:
+                    _seen.add(id(_value))
+                    _total += sys.getsizeof(_value)
+
+        return _total
+
+    def bytes_per_user(self) -> float:
+        """Returns the average memory used per user"""
+        if not self._users:
+            return 0.0
+        return self.memory_usage() / len(self._users)
+
+
+class SQLiteUserStore(UserStore):
+    """SQLiteUserStore keeps users in an SQLite database so datasets larger
+    than memory can be served from the page cache
+
+    Each thread (and each forked process) gets its own connection, and
+    close() closes all of the process's connections.
+    """
+    # pages of the database file mapped into memory
+    MMAP_SIZE = 268435456
+    # rows inserted per transaction when loading
+    BATCH_SIZE = 10000
+
+    def __init__(self, path:str, read_only:bool=False) -> None:
+        """
+        Args:
+            path (str): path of the database file, created if missing
+            read_only (bool, optional): open the database read only. Defaults to False.
+        """
+        self._path = path
+        self._read_only = read_only
+        self._local = threading.local()
+        # every connection opened, with the process it was opened in
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        # an existing database was last changed when its file was written
+        if os.path.exists(path):
+            self.modified_at = os.path.getmtime(path)
+
+        if not read_only:
+            _conn = self._connection()
+            _conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "user_id TEXT PRIMARY KEY, first_name TEXT, last_name TEXT, "
+                "username TEXT, icon TEXT) WITHOUT ROWID"
+            )
+            _conn.execute("CREATE INDEX IF NOT EXISTS users_username ON users (username)")
+            _conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Returns the connection for the current thread and process"""
+        _conn = getattr(self._local, "conn", None)
+        if _conn is None or self._local.pid != os.getpid():
+            if self._read_only:
+                _conn = sqlite3.connect("file:{}?mode=ro".format(self._path), uri=True,
+                                        check_same_thread=False)
+            else:
+                _conn = sqlite3.connect(self._path, check_same_thread=False)
+            _conn.execute("PRAGMA mmap_size = {}".format(self.MMAP_SIZE))
+            self._local.conn = _conn
+            self._local.pid = os.getpid()
+            with self._connections_lock:
+                self._connections.append((_conn, self._local.pid))
+        return _conn
+
+    @staticmethod
+    def _to_record(row:tuple) -> UserRecord:
+        if row is None:
+            return None
+        return UserRecord(*row)
+
+    def get_user(self, user_id:str) -> UserRecord:
+        _row = self._connection().execute(
+            "SELECT user_id, first_name, last_name, username, icon FROM users WHERE user_id = ?",
+            (user_id,)
+        ).fetchone()
+        return self._to_record(_row)
+
+    def get_user_by_username(self, username:str) -> UserRecord:
+        _row = self._connection().execute(
+            "SELECT user_id, first_name, last_name, username, icon FROM users WHERE username = ?",
+            (username,)
+        ).fetchone()
+        return self._to_record(_row)
+
+    def add_users(self, users) -> int:
+        _conn = self._connection()
+        _added = 0
+        _batch = []
+
+        for user_id, user in users:
+            _batch.append((str(user_id),) + tuple(str(user.get(field, "")) for field in USER_FIELDS))
+            if len(_batch) >= self.BATCH_SIZE:
+                _added += self._insert(_conn, _batch)
+                _batch = []
+
+        if _batch:
+            _added += self._insert(_conn, _batch)
+
+        if _added:
+            self.version += 1
+            self.modified_at = time.time()
+
+        return _added
+
+    @staticmethod
+    def _insert(conn:sqlite3.Connection, rows:list) -> int:
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def iter_users(self, after:str=None, limit:int=None):
+        # read in pages so a long walk doesn't hold a cursor open between requests
+        _conn = self._connection()
+        _after = after
+        _remaining = limit
+        while _remaining is None or _remaining > 0:
+            # a short walk only reads the rows it returns
+            _batch = self.BATCH_SIZE if _remaining is None else min(self.BATCH_SIZE, _remaining)
+            if _after is None:
+                _rows = _conn.execute(
+                    "SELECT user_id, first_name, last_name, username, icon FROM users "
+                    "ORDER BY user_id LIMIT ?", (_batch,)
+                ).fetchall()
+            else:
+                _rows = _conn.execute(
+                    "SELECT user_id, first_name, last_name, username, icon FROM users "
+                    "WHERE user_id > ? ORDER BY user_id LIMIT ?", (_after, _batch)
+                ).fetchall()
+
+            for _row in _rows:
+                yield self._to_record(_row)
+
+            if len(_rows) < _batch:
+                return
+            _after = _rows[-1][0]
+            if _remaining is not None:
+                _remaining -= len(_rows)
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self) -> None:
+        # a forked process leaves the connections it inherited to its parent
+        _pid = os.getpid()
+        with self._connections_lock:
+            _connections = self._connections
+            self._connections = [(_conn, _owner) for _conn, _owner in _connections if _owner != _pid]
+        for _conn, _owner in _connections:
+            if _owner == _pid:
+                _conn.close()
+        self._local.conn = None
+
+
+def read_users_file(path:str):
+    """Reads users from a newline delimited JSON file, one object per line
+    with an "id" and the USER_FIELDS
+
+    Args:
+        path (str): path of the file
+
+    Raises:
+        ValueError: if a line isn't a JSON object with an id and the USER_FIELDS
+
+    Yields:
+        tuple: (user_id, dict)
+    """
+    # user_import builds on this module, so it is imported when used
+    from .user_import import FORMAT_NDJSON, read_users
+    return read_users(path, FORMAT_NDJSON)
+
+
+def create_user_store(backend:str, source:str=None, default_users:dict=None, max_bytes:int=0) -> UserStore:
+    """Creates a user store
+
+    Args:
+        backend (str): memory, sqlite or snapshot
+        source (str, optional): a NDJSON or CSV users file for memory, a database
+            for sqlite or a snapshot file for snapshot. Defaults to None, which
+            loads default_users into memory.
+        default_users (dict, optional): users keyed by id to use without a source. Defaults to None.
+        max_bytes (int, optional): most memory the memory backend may use, 0 doesn't
+            bound it. Defaults to 0.
+
+    Raises:
+        ValueError: if backend is unknown, sqlite or snapshot has no source or
+            the users need more than max_bytes
+
+    Returns:
+        UserStore: the loaded store
+    """
+    if backend == USER_STORE_MEMORY:
+        if source is None:
+            _store = MemoryUserStore((default_users or {}).items())
+        else:
+            # user_import builds on this module, so it is imported when used
+            from .user_import import import_users
+            _store = MemoryUserStore()
+            import_users(_store, source)
+        logging.info("Loaded %s users into memory", _store.count())
+        # measuring walks every user, which takes as long as a large load,
+        # so it is only done to enforce a bound or when debugging
+        if max_bytes > 0 or logging.getLogger().isEnabledFor(logging.DEBUG):
+            _used = _store.memory_usage()
+            logging.debug("The user store uses %.0f bytes per user", _used / max(_store.count(), 1))
+            if max_bytes > 0 and _used > max_bytes:
+                _store.close()
+                raise ValueError("The user store needs {} bytes, more than the {} allowed".format(
+                    _used, max_bytes))
+    elif backend == USER_STORE_SQLITE:
+        if source is None:
+            raise ValueError("The sqlite user store requires a database path")
+        _store = SQLiteUserStore(source, read_only=True)
+        logging.info("Opened user database %s with %s users", source, _store.count())
+    elif backend == USER_STORE_SNAPSHOT:
+        if source is None:
+            raise ValueError("The snapshot user store requires a snapshot path")
+        # user_snapshot builds on this module, so it is imported when used
+        from .user_snapshot import SnapshotUserStore
+        _store = SnapshotUserStore(source)
+        logging.info("Mapped user snapshot %s with %s users", source, _store.count())
+    else:
+        raise ValueError("Unknown user store backend: {}".format(backend))
+
+    return _store
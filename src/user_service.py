@@ -1,9 +1,58 @@
+import base64
+import binascii
+import hmac
+import itertools
 import json
 import logging
+import math
+import time
+import uuid
+from email.utils import formatdate, mktime_tz, parsedate_tz
 from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+from libs.compression import compress, compress_stream, negotiate
+from libs.response_cache import CachedResponse, variant_etag
+from libs.log_handlers import access_log
+from libs.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
+from libs.profiling import ProfilerBusyException, profiler, tracer
+from libs.router import MethodNotAllowedException, RouteNotFoundException, Router
+from libs.user_import import validate_user
+from libs.user_log import UserExistsException
+from libs.user_reloader import readers
+from libs.user_search import InvalidCursorException
+from libs.user_store import UserRecord
 from app_config import AppConfig
 
 config = None
+# The UserStore users are read from, set by app.py
+user_store = None
+# Builds the UserSearchIndex of user_store, set by app.py when search is enabled
+search_indexer = None
+# The ResponseCache of encoded user responses, set by app.py
+response_cache = None
+# The ConfigRefresher which replaces config, set by app.py when refreshing
+config_refresher = None
+# The UserStoreReloader which replaces user_store, set by app.py
+users_reloader = None
+# The UserWriteLog users are written to, set by app.py when writes are enabled
+write_log = None
+# The AdmissionController shedding requests in front of the service, set by app.py
+admission = None
+# Set by app.py when shutting down, so readiness fails while requests drain
+draining = False
+
+metrics.describe("user_lookups_total", "User store lookups, by result")
+
+# Liveness and readiness probe paths, the load balancer health check uses /ready
+HEALTH_PATH = "/health"
+READY_PATH = "/ready"
+PROBE_PATHS = (HEALTH_PATH, READY_PATH)
+# Admin routes answer only requests with the admin token, see _refuse_admin
+ADMIN_PATH_PREFIX = "/admin/"
+# Paths whose requests wait, a profile for as long as it runs, so the
+# asyncio server answers them off its event loop
+PROFILE_PATH = "/admin/profile"
+BLOCKING_PATHS = (PROFILE_PATH,)
 
 class UserService(BaseHTTPRequestHandler):
     """The UserService Class provides a HTTP Handler for the User Service
@@ -11,9 +60,35 @@ class UserService(BaseHTTPRequestHandler):
     Methods
     -------
     do_Get() - Handles GET requests
+    do_HEAD() - Handles HEAD requests
+    do_POST() - Handles POST requests
+    do_PUT() - Handles PUT requests
+    handle_request(method, path, headers, body) - Answers a request for any transport
 
     """
-    # _user_map handles user data until replaced with future functionality
+    # the liveness response never changes, so it is built once and shared.
+    # Transports only read response headers, they don't modify them
+    _health_response = (200,
+                        {"Content-type": "application/json", "Cache-Control": "no-store"},
+                        b'{"status": "ok"}')
+
+    # the most users which can be requested in one batch
+    _max_batch_size = 100
+    # the default and largest number of users in a page of search results
+    _default_search_limit = 20
+    _max_search_limit = 100
+    # the default and largest number of users in a page of GET /users
+    _default_list_limit = 1000
+    _max_list_limit = 100000
+    # users read from the store and sent at a time when listing
+    _list_chunk_size = 500
+    # the largest request body accepted, in bytes
+    _max_body_size = 65536
+    # the default length of a profile, in seconds
+    _default_profile_seconds = 10
+
+    # _user_map holds the built-in users, loaded into user_store when no
+    # users source is configured
     _user_map = {
         "1": {
             "first_name": "Dude",
@@ -35,7 +110,8 @@ class UserService(BaseHTTPRequestHandler):
         }
     }
 
-    def _get_user(self, user_id: str) -> dict:
+    @classmethod
+    def _get_user(cls, user_id: str) -> dict:
         """_get_user returns user info based on the user_id
 
         Args
@@ -51,58 +127,1004 @@ class UserService(BaseHTTPRequestHandler):
 
         logging.debug('Searching for User ID %s', user_id)
 
-        # get user if user id is in map
-        if user_id in self._user_map:
-            logging.info("User ID %s Found", user_id)
-            _user = self._user_map.get(user_id)
-
-            return_val = {
-                "username":  _user.get("username"),
-            }
+        # get user if user id is in the store
+        _mark = tracer.mark()
+        _user = user_store.get_user(user_id)
+        if _mark is not None:
+            tracer.record("lookup", _mark)
+        if _user is not None:
+            metrics.inc("user_lookups_total", (("result", "found"),))
+            if access_log.sampled():
+                logging.info("User ID %s Found", user_id)
 
-            # if user-icon feature is enabled, add icon location to return value
-            if "user-icon" in config.features:
-                return_val['icon'] = _user.get('icon')
+            return_val = cls._user_info(_user)
         else:
-            logging.info("User ID %s not found", user_id)
+            metrics.inc("user_lookups_total", (("result", "not_found"),))
+            if access_log.sampled():
+                logging.info("User ID %s not found", user_id)
 
         return return_val
 
-    def do_GET(self):
-        """ do_get handles GET HTTP request"""
-        # Set default response code
-        _response_code = 404
-        # Set default message
-        _msg = "path not found"
-        # empty variable for headers
-        _headers = {}
-
-        # check for user path
-        if self.path.startswith('/user'):
-            # get the user id from path
-            _user_id = self.path.split('/')[2]
-            # get the information about the user
-            _user_info = self._get_user(_user_id)
-
-            # if user doesn't exist, return user not found
-            if _user_info is None:
-                _msg = "user not found"
+    @staticmethod
+    def _user_info(user: UserRecord) -> dict:
+        """_user_info returns the fields of a user which are shown to clients
+
+        Args
+        ----
+        user (UserRecord): the user
+
+        Returns
+        -------
+        dict: a dict of user infomration
+        """
+        _info = {
+            "username":  user.username,
+        }
+
+        # if user-icon feature is enabled, add icon location to return value
+        if "user-icon" in config.features:
+            _info['icon'] = user.icon
+
+        return _info
+
+    @classmethod
+    def _get_user_response(cls, user_id: str) -> CachedResponse:
+        """_get_user_response returns the encoded response for a user,
+        serializing it only when it isn't already cached
+
+        Args
+        ----
+        user_id (str): id of the user requested
+
+        Returns
+        -------
+        CachedResponse: the encoded user or None if the user doesn't exist
+        """
+        # responses depend on the user data and the enabled features
+        _generation = (user_store, user_store.version, config.features)
+
+        if response_cache is not None:
+            _cached = response_cache.get(user_id, _generation)
+            if _cached is not None:
+                logging.debug("User ID %s served from cache", user_id)
+                return _cached
+            # a user written after this isn't cached from the old copy
+            _invalidations = response_cache.invalidations
+
+        # get the information about the user
+        _user_info = cls._get_user(user_id)
+        if _user_info is None:
+            return None
+
+        _mark = tracer.mark()
+        _body = bytes(json.dumps(_user_info), "utf-8")
+        if _mark is not None:
+            tracer.record("serialization", _mark)
+        # the response changes with the users and with the enabled features
+        _last_modified = formatdate(max(user_store.modified_at, config.loaded_at), usegmt=True)
+        if response_cache is None:
+            return CachedResponse(_body, _last_modified)
+
+        return response_cache.put(user_id, _generation, _body, _last_modified, _invalidations)
+
+    @classmethod
+    def _get_users(cls, user_ids: list) -> bytes:
+        """_get_users returns a JSON array with an item for each user_id,
+        users which don't exist are reported in their item
+
+        Args
+        ----
+        user_ids (list): ids of the users requested
+
+        Returns
+        -------
+        bytes: an encoded JSON array of users
+        """
+        _items = []
+
+        for _user_id in user_ids:
+            # get the encoded user, filtered like a single lookup
+            _response = cls._get_user_response(_user_id)
+            _encoded_id = bytes(json.dumps(_user_id), "utf-8")
+
+            if _response is None:
+                _items.append(b'{"id": ' + _encoded_id + b', "error": "user not found"}')
             else:
-                _response_code = 200
-                _msg = json.dumps(_user_info)
+                _items.append(b'{"id": ' + _encoded_id + b', "user": ' + _response.body + b'}')
+
+        return b"[" + b",".join(_items) + b"]"
+
+    @staticmethod
+    def _parse_batch_ids(query: str) -> list:
+        """_parse_batch_ids returns the user ids from an ids=1,2,3 query string
+
+        Args
+        ----
+        query (str): the query string of the request
+
+        Returns
+        -------
+        list: a list of user ids
+        """
+        _user_ids = []
+        for _value in parse_qs(query).get("ids", []):
+            _user_ids.extend(_id for _id in _value.split(",") if _id)
+        return _user_ids
+
+    @staticmethod
+    def _parse_batch_body(body: bytes) -> list:
+        """_parse_batch_body returns the user ids from a {"ids": [...]} body
+
+        Args
+        ----
+        body (bytes): the request body
+
+        Returns
+        -------
+        list: a list of user ids or None if the body is invalid
+        """
+        try:
+            _ids = json.loads(body).get("ids")
+        except (ValueError, AttributeError):
+            return None
+
+        if not isinstance(_ids, list):
+            return None
+
+        return [str(_id) for _id in _ids]
+
+    @staticmethod
+    def _get_config_status() -> str:
+        """_get_config_status describes the configuration in use
+
+        Returns
+        -------
+        str: a JSON object with the config version and refresh times
+        """
+        _status = {
+            "version": config.version,
+            "loaded_at": config.loaded_at,
+            "features": list(config.features),
+            "last_refresh": None,
+            "last_change": None
+        }
+
+        if config_refresher is not None:
+            _status["last_refresh"] = config_refresher.last_refresh
+            _status["last_change"] = config_refresher.last_change
+
+        return json.dumps(_status)
+
+    @staticmethod
+    def _get_metrics() -> str:
+        """_get_metrics renders the request metrics with the cache and store sizes
+
+        Returns
+        -------
+        str: metrics in the Prometheus text format
+        """
+        _extra = [("users", "gauge", "Users in the user store", user_store.count())]
+
+        if response_cache is not None:
+            _extra.extend([
+                ("cache_hits_total", "counter", "Responses served from the cache", response_cache.hits),
+                ("cache_misses_total", "counter", "Responses missing from the cache", response_cache.misses),
+                ("cache_entries", "gauge", "Responses in the cache", len(response_cache)),
+                ("cache_bytes", "gauge", "Bytes held by the cache", response_cache.size)
+            ])
+
+        if admission is not None:
+            _extra.extend([
+                ("admission_limit", "gauge", "Requests admitted at once", admission.limit),
+                ("admission_in_flight", "gauge", "Requests admitted and not finished", admission.in_flight),
+                ("requests_shed_total", "counter", "Requests refused with a 503", admission.shed)
+            ])
+
+        return metrics.render(_extra)
+
+    @classmethod
+    def _get_readiness(cls) -> tuple:
+        """_get_readiness reports whether the configuration and users have
+        loaded and the service isn't shutting down, without looking anything
+        up in the user store
+
+        Returns
+        -------
+        tuple: (response code, dict of headers, body bytes)
+        """
+        _checks = {
+            "config": config is not None,
+            "users": user_store is not None,
+            "serving": not draining
+        }
+        _ready = all(_checks.values())
+
+        _body = bytes(json.dumps({
+            "status": "ready" if _ready else "not ready",
+            "checks": _checks
+        }), "utf-8")
+
+        return (200 if _ready else 503), {"Content-type": "application/json", "Cache-Control": "no-store"}, _body
+
+    @classmethod
+    def handle_request(cls, method: str, path: str, headers=None, body: bytes = b"") -> tuple:
+        """handle_request answers a request independently of the transport,
+        it is shared by do_GET and the asyncio server and records metrics
+
+        Args
+        ----
+        method (str): the HTTP method
+        path (str): the request path
+        headers (HTTPMessage, optional): the request headers
+        body (bytes, optional): the request body
+
+        Returns
+        -------
+        tuple: (response code, dict of headers, body bytes)
+        """
+        # answer probes before routing, timing or touching the user store
+        if method == "GET" or method == "HEAD":
+            # probes may carry a query string, such as a load balancer's cache buster
+            _probe_path = path.partition("?")[0]
+            if _probe_path == HEALTH_PATH:
+                return cls._health_response
+            if _probe_path == READY_PATH:
+                return cls._get_readiness()
+
+        _start = time.perf_counter()
+        _token = metrics.request_started()
+        # the user store read isn't closed by a reload until the request finishes
+        _epoch = readers.enter()
+        _traced = tracer.start()
+        _route = "error"
+        _response_code = 500
+
+        try:
+            _route, _response_code, _headers, _msg = cls._route_request(method, path, headers, body)
+        except BaseException:
+            cls._request_finished(_token, _epoch, _route, _response_code, _start)
+            raise
+        finally:
+            # the phases of a streamed body, sent after this returns, aren't traced
+            if _traced:
+                tracer.finish(_route, _response_code, time.perf_counter() - _start)
+
+        if isinstance(_msg, bytes):
+            cls._request_finished(_token, _epoch, _route, _response_code, _start)
+        elif method == "HEAD":
+            # the body of a HEAD response is never read
+            if hasattr(_msg, "close"):
+                _msg.close()
+            _msg = iter(())
+            cls._request_finished(_token, _epoch, _route, _response_code, _start)
+        else:
+            # a streamed request is in flight, and reading the user store,
+            # until the transport has sent the last chunk
+            _msg = cls._finish_stream(_msg, _token, _epoch, _route, _response_code, _start)
+
+        return _response_code, _headers, _msg
+
+    @staticmethod
+    def _request_finished(token, epoch: int, route: str, response_code: int, start: float) -> None:
+        """_request_finished records a request as finished, and no longer reading the user store
+
+        Args
+        ----
+        token: the token from metrics.request_started
+        epoch (int): the epoch from readers.enter
+        route (str): the name of the route
+        response_code (int): the HTTP response code
+        start (float): when the request started
+        """
+        readers.exit(epoch)
+        metrics.request_finished(token, route, response_code, time.perf_counter() - start)
+
+    @classmethod
+    def _finish_stream(cls, chunks, token, epoch: int, route: str, response_code: int, start: float):
+        """_finish_stream yields the chunks of a streamed body, then records
+        the request as finished, see _request_finished
+
+        Args
+        ----
+        chunks (iterable): the chunks of the body
+        """
+        try:
+            yield from chunks
+        finally:
+            cls._request_finished(token, epoch, route, response_code, start)
+
+    @classmethod
+    def _route_request(cls, method: str, path: str, headers=None, body: bytes = b"") -> tuple:
+        """_route_request answers a request with the route registered in router
+
+        Args
+        ----
+        method (str): the HTTP method
+        path (str): the request path
+        headers (HTTPMessage, optional): the request headers
+        body (bytes, optional): the request body
+
+        Returns
+        -------
+        tuple: (route name, response code, dict of headers, body bytes or an iterable of body chunks)
+        """
+        _path, _, _query = path.partition("?")
+
+        if _path.startswith(ADMIN_PATH_PREFIX):
+            _refusal = cls._refuse_admin(headers)
+            if _refusal is not None:
+                return ("admin",) + _refusal
+
+        _mark = tracer.mark()
+        try:
+            _route, _params = router.resolve(method, _path)
+        except RouteNotFoundException:
+            return "not_found", 404, {}, b"path not found"
+        except MethodNotAllowedException as e:
+            return "method_not_allowed", 405, {"Allow": ", ".join(e.allowed)}, b"method not allowed"
+        if _mark is not None:
+            tracer.record("routing", _mark)
+
+        _response_code, _headers, _msg = _route.handler(_query, headers, body, *_params)
 
         # add content-type header if returing data
         if _response_code == 200:
-            _headers['Content-type'] = "application/json"
+            _headers.setdefault('Content-type', "application/json")
+
+        if isinstance(_msg, str):
+            _msg = bytes(_msg, "utf-8")
+
+        # streamed bodies are compressed as they are produced, their size is
+        # unknown but they are only streamed because they are large
+        if not isinstance(_msg, bytes):
+            if _response_code == 200 and 'Vary' not in _headers and config.compression_min_size > 0:
+                _headers['Vary'] = 'Accept-Encoding'
+                _encoding = cls._accepted_encoding(headers)
+                if _encoding is not None:
+                    _headers['Content-Encoding'] = _encoding
+                    _msg = compress_stream(_msg, _encoding, config.compression_level)
+            return _route.name, _response_code, _headers, _msg
+
+        # compress large responses, unless the route already negotiated a coding
+        if _response_code == 200 and 'Vary' not in _headers and cls._compressible(len(_msg)):
+            _headers['Vary'] = 'Accept-Encoding'
+            _encoding = cls._accepted_encoding(headers)
+            if _encoding is not None:
+                _headers['Content-Encoding'] = _encoding
+                _mark = tracer.mark()
+                _msg = compress(_msg, _encoding, config.compression_level)
+                if _mark is not None:
+                    tracer.record("compression", _mark)
+
+        return _route.name, _response_code, _headers, _msg
+
+    @staticmethod
+    def _refuse_admin(headers) -> tuple:
+        """_refuse_admin checks a request for an admin route carries the
+        admin token as a bearer token, the routes are disabled without one
+
+        Args
+        ----
+        headers (HTTPMessage): the request headers
+
+        Returns
+        -------
+        tuple: (response code, dict of headers, body bytes) refusing the request, or None to answer it
+        """
+        if config.admin_token is None:
+            return 503, {}, b"admin routes are not enabled"
+
+        _scheme, _, _token = (headers.get("Authorization", "") if headers is not None else "").partition(" ")
+        # compared in constant time, so the token can't be guessed a byte at a time
+        if _scheme.lower() != "bearer" or not hmac.compare_digest(
+                bytes(_token.strip(), "utf-8"), bytes(config.admin_token, "utf-8")):
+            return 401, {"WWW-Authenticate": 'Bearer realm="admin"'}, b"a valid admin token is required"
+
+        return None
+
+    @classmethod
+    def _handle_metrics(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_metrics answers GET /metrics"""
+        return 200, {'Content-type': METRICS_CONTENT_TYPE}, cls._get_metrics()
+
+    @classmethod
+    def _handle_config_status(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_config_status answers GET /admin/config"""
+        return 200, {}, cls._get_config_status()
+
+    @classmethod
+    def _handle_reload_users(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_reload_users answers POST /admin/reload-users by asking
+        the reloader to load the users source again in the background, a
+        reload isn't requested while one runs or straight after one"""
+        if users_reloader is None:
+            return 503, {}, "user reloading is not enabled"
+
+        if users_reloader.reloading:
+            return 409, {}, "users are already being reloaded"
+        _retry_after = users_reloader.retry_after()
+        if _retry_after > 0:
+            return 429, {'Retry-After': str(math.ceil(_retry_after))}, "users were reloaded too recently"
+
+        users_reloader.request_reload()
+        return 202, {'Content-type': "application/json"}, json.dumps({
+            "status": "reloading",
+            "users": user_store.count(),
+            "reloads": users_reloader.reloads,
+            "last_reload": users_reloader.last_reload,
+            "last_error": users_reloader.last_error
+        })
+
+    @classmethod
+    def _handle_profile(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_profile answers GET /admin/profile?seconds=10 by sampling
+        the stacks of every thread in the process, the collapsed stacks it
+        returns are the input of flamegraph.pl and speedscope. Each prefork
+        worker profiles only itself"""
+        if not config.profiling_enabled:
+            return 503, {}, "profiling is not enabled"
+
+        _query = parse_qs(query)
+        try:
+            _seconds = int(_query.get("seconds", [min(cls._default_profile_seconds,
+                                                      config.profiling_max_seconds)])[0])
+        except ValueError:
+            return 400, {}, "seconds must be a number"
+        if _seconds < 1 or _seconds > config.profiling_max_seconds:
+            return 400, {}, "seconds must be between 1 and {}".format(config.profiling_max_seconds)
+
+        logging.info("Profiling for %s seconds", _seconds)
+        try:
+            _stacks = profiler.profile(_seconds)
+        except ProfilerBusyException as e:
+            return 409, {}, e.message
+
+        _headers = {'Content-type': "text/plain; charset=utf-8", 'Cache-Control': "no-store"}
+        return 200, _headers, profiler.collapse(_stacks)
+
+    @classmethod
+    def _handle_traces(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_traces answers GET /admin/traces with the phase timings of
+        the latest traced requests, profiling/trace-sample-rate sets the
+        fraction of requests traced"""
+        if not config.profiling_enabled:
+            return 503, {}, "profiling is not enabled"
+
+        return 200, {'Cache-Control': "no-store"}, json.dumps({
+            "sample_rate": tracer.sample_rate,
+            "traces": tracer.recent()
+        })
+
+    @classmethod
+    def _handle_users(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_users answers GET /users?ids=1,2,3 with a batch, or
+        GET /users?limit=1000&cursor=... with a page of every user"""
+        _query = parse_qs(query, keep_blank_values=True)
+        if "ids" not in _query:
+            return cls._list_response(_query)
+
+        _user_ids = cls._parse_batch_ids(query)
+        if not _user_ids:
+            return 400, {}, "ids are required"
+        return cls._batch_response(_user_ids)
+
+    @classmethod
+    def _list_response(cls, query: dict) -> tuple:
+        """_list_response streams a page of users in order of id"""
+        try:
+            _limit = int(query.get("limit", [cls._default_list_limit])[0])
+        except ValueError:
+            return 400, {}, "limit must be a number"
+        if _limit < 1 or _limit > cls._max_list_limit:
+            return 400, {}, "limit must be between 1 and {}".format(cls._max_list_limit)
+
+        _after = None
+        if "cursor" in query:
+            _after = cls._decode_list_cursor(query["cursor"][0])
+            if _after is None:
+                return 400, {}, "invalid cursor: {}".format(query["cursor"][0])
+
+        return 200, {}, cls._stream_users(_after, _limit)
+
+    @staticmethod
+    def _encode_list_cursor(user_id: str) -> str:
+        """_encode_list_cursor returns the opaque cursor of the page after user_id"""
+        return base64.urlsafe_b64encode(bytes(user_id, "utf-8")).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _decode_list_cursor(cursor: str) -> str:
+        """_decode_list_cursor returns the user id of a cursor or None if it is invalid"""
+        try:
+            _user_id = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        except (ValueError, binascii.Error):
+            return None
+        return _user_id or None
+
+    @staticmethod
+    def _walk_users(after: str, limit: int):
+        """_walk_users yields up to limit users following the id after, in
+        one walk of the user store
+
+        A walk which fails because a reload closed its store continues from
+        the last user returned in the replacement, the id order is the same.
+        """
+        _store = user_store
+        _walk = _store.iter_users(after, limit)
+        while limit > 0:
+            try:
+                _user = next(_walk, None)
+            except Exception:
+                if user_store is _store:
+                    raise
+                _store = user_store
+                _walk = _store.iter_users(after, limit)
+                continue
+
+            if _user is None:
+                return
+            yield _user
+            after = _user.user_id
+            limit -= 1
+
+    @classmethod
+    def _stream_users(cls, after: str, limit: int):
+        """_stream_users yields a page of users as JSON, a chunk at a time,
+        so memory use doesn't grow with the size of the page
+
+        Args
+        ----
+        after (str): the id the page starts after or None
+        limit (int): the most users in the page
+
+        Yields
+        ------
+        bytes: chunks of an encoded JSON object of users
+        """
+        yield b'{"users": ['
+
+        # one user past the page is read, to know whether another page follows
+        _walk = cls._walk_users(after, limit + 1)
+        _sent = 0
+        _separator = b""
+        while _sent < limit:
+            _users = list(itertools.islice(_walk, min(cls._list_chunk_size, limit - _sent)))
+            if not _users:
+                break
+
+            _items = [b'{"id": ' + bytes(json.dumps(_user.user_id), "utf-8") +
+                      b', "user": ' + bytes(json.dumps(cls._user_info(_user)), "utf-8") + b'}'
+                      for _user in _users]
+            yield _separator + b",".join(_items)
+            _separator = b","
+            _sent += len(_users)
+            after = _users[-1].user_id
+
+        # only hand out a cursor when another user follows
+        _next_cursor = None
+        if _sent == limit and next(_walk, None) is not None:
+            _next_cursor = cls._encode_list_cursor(after)
+        yield b'], "next_cursor": ' + bytes(json.dumps(_next_cursor), "utf-8") + b'}'
+
+    @classmethod
+    def _handle_users_batch(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_users_batch answers POST /users/batch"""
+        _user_ids = cls._parse_batch_body(body)
+        if _user_ids is None:
+            return 400, {}, "invalid request body"
+        if not _user_ids:
+            return 400, {}, "ids are required"
+        return cls._batch_response(_user_ids)
+
+    @classmethod
+    def _handle_users_search(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_users_search answers GET /users/search?prefix=an&limit=20&cursor=..."""
+        if search_indexer is None:
+            return 503, {}, "user search is not enabled"
+
+        _query = parse_qs(query)
+        _prefix = _query.get("prefix", [""])[0]
+        if not _prefix:
+            return 400, {}, "prefix is required"
+
+        try:
+            _limit = int(_query.get("limit", [cls._default_search_limit])[0])
+        except ValueError:
+            return 400, {}, "limit must be a number"
+        if _limit < 1 or _limit > cls._max_search_limit:
+            return 400, {}, "limit must be between 1 and {}".format(cls._max_search_limit)
+
+        # the first search of a store, or after a write, starts building its
+        # index. Logged writes don't change the store's version, so they are
+        # told apart by the write log's
+        _store = user_store
+        _index = search_indexer.get(_store, (_store.version, write_log.version if write_log is not None else 0))
+        if _index is None:
+            return 503, {"Retry-After": "5"}, "the user search index is being built"
+
+        try:
+            _user_ids, _next_cursor = _index.search(_prefix, _limit, _query.get("cursor", [None])[0])
+        except InvalidCursorException as e:
+            return 400, {}, e.message
+
+        return 200, {}, cls._search_results(_user_ids, _next_cursor)
+
+    @classmethod
+    def _search_results(cls, user_ids: list, next_cursor: str) -> bytes:
+        """_search_results returns a page of search results with the encoded
+        users, like a batch without the users which no longer exist
+
+        Args
+        ----
+        user_ids (list): ids of the users found
+        next_cursor (str): the cursor of the next page or None
+
+        Returns
+        -------
+        bytes: an encoded JSON object of users
+        """
+        _items = []
+        for _user_id in user_ids:
+            # the index and user_store are swapped separately on a reload
+            _response = cls._get_user_response(_user_id)
+            if _response is not None:
+                _items.append(b'{"id": ' + bytes(json.dumps(_user_id), "utf-8") +
+                              b', "user": ' + _response.body + b'}')
+
+        return (b'{"users": [' + b",".join(_items) + b'], "next_cursor": ' +
+                bytes(json.dumps(next_cursor), "utf-8") + b'}')
+
+    @classmethod
+    def _batch_response(cls, user_ids: list) -> tuple:
+        """_batch_response looks up every user in a batch"""
+        if len(user_ids) > cls._max_batch_size:
+            return 400, {}, "at most {} ids can be requested".format(cls._max_batch_size)
+        return 200, {}, cls._get_users(user_ids)
+
+    @classmethod
+    def _handle_user(cls, query: str, headers, body: bytes, user_id: str) -> tuple:
+        """_handle_user answers GET /user/<user_id>"""
+        # get the encoded information about the user
+        _response = cls._get_user_response(user_id)
+
+        # if user doesn't exist, return user not found
+        if _response is None:
+            return 404, {}, "user not found"
+
+        _headers = {
+            'ETag': _response.etag,
+            'Last-Modified': _response.last_modified,
+            'Cache-Control': config.cache_control
+        }
+
+        _encoding = None
+        if cls._compressible(len(_response.body)):
+            _headers['Vary'] = 'Accept-Encoding'
+            _encoding = cls._accepted_encoding(headers)
+            if _encoding is not None:
+                _headers['ETag'] = variant_etag(_response.etag, _encoding)
+
+        # the client's copy is current, answer without the body
+        if cls._not_modified(headers, _headers['ETag'], _response.last_modified):
+            return 304, _headers, b""
+
+        if _encoding is None:
+            return 200, _headers, _response.body
+
+        # compress once per cached record, not once per request
+        _headers['Content-Encoding'] = _encoding
+        _mark = tracer.mark()
+        if response_cache is None:
+            _body = compress(_response.body, _encoding, config.compression_level)
+        else:
+            _body, _ = response_cache.get_variant(
+                user_id, _response, _encoding,
+                lambda body: compress(body, _encoding, config.compression_level)
+            )
+        if _mark is not None:
+            tracer.record("compression", _mark)
+        return 200, _headers, _body
+
+    @classmethod
+    def _handle_create_user(cls, query: str, headers, body: bytes) -> tuple:
+        """_handle_create_user answers POST /user, the id is generated when
+        the body doesn't have one"""
+        _user = cls._parse_user_body(body)
+        if _user is None:
+            return 400, {}, "invalid request body"
+        _user.setdefault("id", uuid.uuid4().hex)
+
+        _user_id, _reason = validate_user(_user)
+        if _reason is not None:
+            return 400, {}, _reason
+
+        # the log checks the user doesn't exist as it queues the write, so
+        # only one of concurrent creates of a user succeeds
+        return cls._write_user(_user_id, _user, 201, exclusive=True)
+
+    @classmethod
+    def _handle_put_user(cls, query: str, headers, body: bytes, user_id: str) -> tuple:
+        """_handle_put_user answers PUT /user/<user_id> by creating or replacing the user"""
+        _user = cls._parse_user_body(body)
+        if _user is None:
+            return 400, {}, "invalid request body"
+        if _user.setdefault("id", user_id) != user_id:
+            return 400, {}, "id doesn't match the path"
+
+        _user_id, _reason = validate_user(_user)
+        if _reason is not None:
+            return 400, {}, _reason
+
+        _mark = tracer.mark()
+        _exists = user_store.get_user(_user_id) is not None
+        if _mark is not None:
+            tracer.record("lookup", _mark)
+        return cls._write_user(_user_id, _user, 200 if _exists else 201)
+
+    @staticmethod
+    def _parse_user_body(body: bytes) -> dict:
+        """_parse_user_body returns the user from a JSON object body
+
+        Args
+        ----
+        body (bytes): the request body
+
+        Returns
+        -------
+        dict: the decoded user or None if the body isn't a JSON object
+        """
+        try:
+            _user = json.loads(body)
+        except ValueError:
+            return None
+        return _user if isinstance(_user, dict) else None
+
+    @classmethod
+    def _write_user(cls, user_id: str, user: dict, response_code: int, exclusive: bool = False) -> tuple:
+        """_write_user writes a user to the write log and answers with it
+
+        Args
+        ----
+        user_id (str): id of the user
+        user (dict): the validated user
+        response_code (int): 201 for a new user, 200 for a replaced one
+        exclusive (bool, optional): answer 409 if the user exists. Defaults to False.
+
+        Returns
+        -------
+        tuple: (response code, dict of headers, body)
+        """
+        if write_log is None:
+            return 503, {}, "user writes are not enabled"
+
+        _exists = None
+        if exclusive:
+            _exists = lambda _user_id: user_store.get_user(_user_id) is not None
+
+        _mark = tracer.mark()
+        try:
+            _record = write_log.write(user_id, user, _exists)
+        except UserExistsException:
+            return 409, {}, "user already exists"
+        except OSError as e:
+            logging.error("Unable to write user %s: %s", user_id, e)
+            return 503, {}, "unable to save the user"
+        if _mark is not None:
+            tracer.record("write", _mark)
+
+        # the write is applied before it returns, so a response cached from
+        # the old user is either dropped here or never cached
+        if response_cache is not None:
+            response_cache.invalidate(user_id)
+
+        _headers = {'Content-type': "application/json"}
+        if response_code == 201:
+            _headers['Location'] = "/user/{}".format(user_id)
+        _mark = tracer.mark()
+        _body = json.dumps(cls._user_info(_record))
+        if _mark is not None:
+            tracer.record("serialization", _mark)
+        return response_code, _headers, _body
+
+    @staticmethod
+    def _compressible(size: int) -> bool:
+        """_compressible returns True if a body of size bytes is large enough to compress"""
+        return 0 < config.compression_min_size <= size
+
+    @staticmethod
+    def _accepted_encoding(headers) -> str:
+        """_accepted_encoding returns the content coding to answer with
+
+        Args
+        ----
+        headers (HTTPMessage): the request headers
+
+        Returns
+        -------
+        str: a content coding like gzip or None for an uncompressed body
+        """
+        if headers is None:
+            return None
+        return negotiate(headers.get("Accept-Encoding"))
+
+    @staticmethod
+    def _not_modified(headers, etag: str, last_modified: str) -> bool:
+        """_not_modified evaluates If-None-Match, or If-Modified-Since when
+        there is no If-None-Match, against a response
+
+        Args
+        ----
+        headers (HTTPMessage): the request headers
+        etag (str): the entity tag of the response
+        last_modified (str): the Last-Modified date of the response
+
+        Returns
+        -------
+        bool: True if the client's copy is current
+        """
+        if headers is None:
+            return False
+
+        _if_none_match = headers.get("If-None-Match")
+        if _if_none_match is not None:
+            for _tag in _if_none_match.split(","):
+                _tag = _tag.strip()
+                # If-None-Match uses the weak comparison
+                if _tag.startswith("W/"):
+                    _tag = _tag[2:]
+                if _tag == etag or _tag == "*":
+                    return True
+            return False
+
+        _if_modified_since = headers.get("If-Modified-Since")
+        if _if_modified_since is not None and last_modified is not None:
+            _since = parsedate_tz(_if_modified_since)
+            if _since is None:
+                return False
+            return mktime_tz(parsedate_tz(last_modified)) <= mktime_tz(_since)
+
+        return False
+
+    def _send(self, response_code: int, headers: dict, body: bytes) -> None:
+        """_send writes a complete response to the client and logs it,
+        HEAD responses are sent without the body
+
+        Args
+        ----
+        response_code (int): the HTTP response code
+        headers (dict): headers to send
+        body (bytes): the response body, or an iterable of chunks to stream
+        """
+        if not isinstance(body, bytes):
+            self._send_stream(response_code, headers, body)
+            return
 
         # Send response Code
-        self.send_response(_response_code)
+        self.send_response(response_code)
+
+        # send headers
+        for key, value in headers.items():
+            self.send_header(key, value)
+        # a 304 has no body, so it doesn't describe one
+        if response_code != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        # send data
+        if self.command != "HEAD":
+            self.wfile.write(body)
 
-        # send headers if there are headers
-        if len(_headers) > 0:
-            for key, value in _headers.items():
+        access_log.log(self.client_address[0], self.command, self.path, response_code,
+                       len(body), time.perf_counter() - self._request_start)
+
+    def _send_stream(self, response_code: int, headers: dict, body) -> None:
+        """_send_stream writes a response whose body is sent a chunk at a time
+
+        HTTP/1.1 clients get the body with chunked transfer encoding, so a
+        truncated body can be told from a complete one. HTTP/1.0 has no
+        chunked encoding, so for those clients the body ends when the
+        connection is closed. Either way the connection isn't reused.
+
+        Args
+        ----
+        response_code (int): the HTTP response code
+        headers (dict): headers to send
+        body (iterable): the chunks of the response body
+        """
+        self.close_connection = True
+        _chunked = self.request_version == "HTTP/1.1"
+        if _chunked:
+            # only this response is framed as HTTP/1.1, the handler stays HTTP/1.0
+            self.protocol_version = "HTTP/1.1"
+        _sent = 0
+        try:
+            self.send_response(response_code)
+            for key, value in headers.items():
                 self.send_header(key, value)
-            
+            if _chunked:
+                self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('Connection', 'close')
             self.end_headers()
-        # send data
-        self.wfile.write(bytes(_msg, "utf-8"))
\ No newline at end of file
+
+            if self.command != "HEAD":
+                for _chunk in body:
+                    # an empty chunk would end a chunked body early
+                    if not _chunk:
+                        continue
+                    if _chunked:
+                        self.wfile.write(b"%x\r\n" % len(_chunk) + _chunk + b"\r\n")
+                    else:
+                        self.wfile.write(_chunk)
+                    _sent += len(_chunk)
+                if _chunked:
+                    self.wfile.write(b"0\r\n\r\n")
+        finally:
+            # lets the route release whatever the body was reading
+            if hasattr(body, "close"):
+                body.close()
+
+        access_log.log(self.client_address[0], self.command, self.path, response_code,
+                       _sent, time.perf_counter() - self._request_start)
+
+    def setup(self) -> None:
+        """setup applies the configured request timeout to the connection, so
+        a client which connects and stops sending frees its worker"""
+        self.timeout = config.server_request_timeout or None
+        super().setup()
+
+    def parse_request(self) -> bool:
+        """parse_request records when the request started before parsing it"""
+        self._request_start = time.perf_counter()
+        return super().parse_request()
+
+    def log_request(self, code='-', size='-') -> None:
+        """log_request is replaced by the structured access log written in _send"""
+
+    def log_message(self, format: str, *args) -> None:
+        """log_message sends the handler's own messages to logging"""
+        logging.info("%s - %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        """ do_get handles GET HTTP request"""
+        self._send(*self.handle_request("GET", self.path, self.headers))
+
+    def do_HEAD(self):
+        """ do_HEAD handles HEAD HTTP request"""
+        self._send(*self.handle_request("HEAD", self.path, self.headers))
+
+    def _handle_body_request(self, method: str) -> None:
+        """_handle_body_request reads the request body and answers the request"""
+        try:
+            _length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            _length = -1
+
+        if _length < 0 or _length > self._max_body_size:
+            self._send(400, {}, b"invalid content-length")
+            return
+
+        _body = self.rfile.read(_length)
+        self._send(*self.handle_request(method, self.path, self.headers, _body))
+
+    def do_POST(self):
+        """ do_POST handles POST HTTP request"""
+        self._handle_body_request("POST")
+
+    def do_PUT(self):
+        """ do_PUT handles PUT HTTP request"""
+        self._handle_body_request("PUT")
+
+
+# The routes of the user service, compiled once when the module is imported
+router = Router()
+router.add("GET", "/metrics", "metrics", UserService._handle_metrics)
+router.add("GET", "/admin/config", "admin_config", UserService._handle_config_status)
+router.add("POST", "/admin/reload-users", "admin_reload_users", UserService._handle_reload_users)
+router.add("GET", PROFILE_PATH, "admin_profile", UserService._handle_profile)
+router.add("GET", "/admin/traces", "admin_traces", UserService._handle_traces)
+router.add("GET", "/users", "users", UserService._handle_users)
+router.add("GET", "/users/search", "users_search", UserService._handle_users_search)
+router.add("POST", "/users/batch", "users_batch", UserService._handle_users_batch)
+router.add("POST", "/user", "create_user", UserService._handle_create_user)
+router.add("GET", "/user/{user_id}", "user", UserService._handle_user)
+router.add("PUT", "/user/{user_id}", "put_user", UserService._handle_put_user)
+router.compile()
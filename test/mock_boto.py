@@ -13,19 +13,30 @@ class MockGenericClient:
                  aws_access_key_id=None,
                  aws_secret_access_key=None, 
                  aws_session_token=None,
-                 region_name=None):
+                 region_name=None,
+                 config=None):
         self._client_type = client_type
         self._aws_access_key_id = aws_access_key_id
         self._aws_secret_access_key = aws_secret_access_key
         self._aws_session_token = aws_session_token
         self._region_name = region_name
+        self._config = config
 
 
 class MockSSM:
     def __init__(self, value_map:dict = None):
         self._value_map = value_map
+        self.calls = []
+        # when set, every call raises MockAWSException with this error code
+        self.error_code = None
 
-    def get_parameter(self, Name:str) -> dict:
+    def _call(self, name:str) -> None:
+        self.calls.append(name)
+        if self.error_code is not None:
+            raise MockAWSException(self.error_code)
+
+    def get_parameter(self, Name:str, WithDecryption:bool=False) -> dict:
+        self._call('get_parameter')
         if Name not in self._value_map:
             raise MockAWSException('ParameterNotFound')
 
@@ -37,7 +48,25 @@ class MockSSM:
 
         return _ret_value
 
+    def get_parameters_by_path(self, Path:str, Recursive:bool=False, WithDecryption:bool=False,
+                               MaxResults:int=10, NextToken:str=None) -> dict:
+        self._call('get_parameters_by_path')
+        _prefix = Path.rstrip('/') + '/'
+        _names = sorted(name for name in self._value_map if name.startswith(_prefix))
+
+        _start = int(NextToken or 0)
+        _page = _names[_start:_start + MaxResults]
+
+        _ret_value = {
+            "Parameters": [{"Name": name, "Value": self._value_map.get(name)} for name in _page]
+        }
+        if _start + MaxResults < len(_names):
+            _ret_value["NextToken"] = str(_start + MaxResults)
+
+        return _ret_value
+
     def put_parameter(self, Name:str, Value:str, **kwargs):
+        self._call('put_parameter')
         self._value_map[Name] = Value
 
 
@@ -49,6 +78,7 @@ class MockBoto:
         _secret_access_key = kwargs.get('aws_secret_access_key')
         _aws_session_token = kwargs.get('aws_session_token')
         _region_name = kwargs.get('region_name')
+        _config = kwargs.get('config')
 
         if client_type == "None":
             return None
@@ -57,4 +87,5 @@ class MockBoto:
                                      aws_access_key_id=_aws_access_key_id,
                                      aws_secret_access_key=_secret_access_key,
                                      aws_session_token=_aws_session_token,
-                                     region_name=_region_name)
\ No newline at end of file
+                                     region_name=_region_name,
+                                     config=_config)
\ No newline at end of file
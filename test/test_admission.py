@@ -0,0 +1,77 @@
+import unittest
+from src.libs.admission import AdmissionController
+
+
+class TestAdmissionController(unittest.TestCase):
+    def setUp(self) -> None:
+        self._now = 0.0
+        self._admission = AdmissionController(limit=2, min_limit=1, latency_target=0.5,
+                                              priority_paths=("/admin/", "/metrics"),
+                                              clock=lambda: self._now)
+
+    def test_fixed_limit(self):
+        self.assertTrue(self._admission.try_acquire())
+        self.assertTrue(self._admission.try_acquire())
+        self.assertFalse(self._admission.try_acquire())
+        self.assertTrue(self._admission.try_acquire(priority=True))
+        self.assertEqual(3, self._admission.in_flight)
+        self.assertEqual(1, self._admission.shed)
+
+        for _ in range(3):
+            self._admission.release(5.0)
+        self.assertEqual(0, self._admission.in_flight)
+        # slow requests don't change a fixed limit
+        self.assertEqual(2, self._admission.limit)
+
+    def test_off(self):
+        self._admission.configure("off", limit=1, min_limit=1, latency_target=0.5, retry_after=1)
+        self.assertFalse(self._admission.enabled)
+        for _ in range(5):
+            self.assertTrue(self._admission.try_acquire())
+        self.assertEqual(0, self._admission.shed)
+
+    def test_adaptive_limit(self):
+        self._admission.configure("adaptive", limit=100, min_limit=10, latency_target=0.5, retry_after=1)
+        self.assertEqual(100, self._admission.limit)
+
+        # a burst of slow requests cuts the limit once
+        for _ in range(50):
+            self._admission.try_acquire()
+        for _ in range(50):
+            self._admission.release(1.0)
+        self.assertEqual(90, self._admission.limit)
+
+        # and another burst once latency_target has passed
+        self._now = 1.0
+        self._admission.try_acquire()
+        self._admission.release(1.0)
+        self.assertEqual(81, self._admission.limit)
+
+        # fast requests only grow the limit while it is in use
+        self._admission.try_acquire()
+        self._admission.release(0.01)
+        self.assertEqual(81, self._admission.limit)
+        for _ in range(60):
+            self._admission.try_acquire()
+        for _ in range(20):
+            self._admission.release(0.01)
+        self.assertEqual(81.2, round(self._admission._limit, 1))
+
+    def test_adaptive_floor(self):
+        self._admission.configure("adaptive", limit=10, min_limit=8, latency_target=0.5, retry_after=1)
+        for _ in range(5):
+            self._now += 1.0
+            self._admission.try_acquire()
+            self._admission.release(1.0)
+        self.assertEqual(8, self._admission.limit)
+
+    def test_is_priority(self):
+        self.assertTrue(self._admission.is_priority("/admin/config"))
+        self.assertTrue(self._admission.is_priority("/metrics"))
+        self.assertFalse(self._admission.is_priority("/user/1"))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            self._admission.configure("eager", limit=1, min_limit=1, latency_target=0.5, retry_after=1)
+        with self.assertRaises(ValueError):
+            self._admission.configure("fixed", limit=0, min_limit=1, latency_target=0.5, retry_after=1)
@@ -0,0 +1,196 @@
+import socket
+import threading
+import time
+import unittest
+from http.client import HTTPConnection
+from src.libs.admission import AdmissionController
+from src.libs.async_server import AsyncHTTPServer
+
+
+def mock_stream(fail:bool):
+    yield b"first,"
+    yield b""
+    if fail:
+        raise RuntimeError("mock failure")
+    yield b"second"
+
+
+# set to let PUT /wait requests finish
+release = threading.Event()
+
+
+def mock_app(method, path, headers, body):
+    if path == "/wait":
+        release.wait(5)
+    if path == "/error":
+        raise RuntimeError("mock failure")
+    if path.startswith("/stream"):
+        return 200, {"Content-type": "text/plain"}, mock_stream(path == "/stream-error")
+    if path == "/thread":
+        return 200, {"Content-type": "text/plain"}, bytes(threading.current_thread().name, "utf-8")
+    if path == "/echo":
+        return 200, {"Content-type": "text/plain"}, body
+    return 200, {"Content-type": "text/plain"}, bytes(path, "utf-8")
+
+
+class TestAsyncHTTPServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self._server = AsyncHTTPServer(("127.0.0.1", 0), mock_app, keep_alive_timeout=5)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def tearDown(self) -> None:
+        self._server.shutdown()
+        self._thread.join()
+        self._server.server_close()
+
+    def _raw(self, data: bytes) -> bytes:
+        _sock = socket.create_connection(self._server.server_address, timeout=5)
+        _sock.sendall(data)
+        _chunks = []
+        while True:
+            _chunk = _sock.recv(65536)
+            if not _chunk:
+                break
+            _chunks.append(_chunk)
+        _sock.close()
+        return b"".join(_chunks)
+
+    def test_keep_alive(self):
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        for _path in ("/user/1", "/user/2"):
+            _conn.request("GET", _path)
+            _response = _conn.getresponse()
+            self.assertEqual(200, _response.status)
+            self.assertEqual(str(len(_path)), _response.getheader("Content-Length"))
+            self.assertEqual(bytes(_path, "utf-8"), _response.read())
+            self.assertFalse(_response.will_close)
+        # both requests were served on the same socket
+        self.assertIsNotNone(_conn.sock)
+        _conn.close()
+
+    def test_pipelining(self):
+        _response = self._raw(b"GET /a HTTP/1.1\r\nHost: x\r\n\r\n"
+                              b"GET /bb HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        self.assertEqual(2, _response.count(b"HTTP/1.1 200 OK"))
+        self.assertLess(_response.index(b"\r\n\r\n/a"), _response.index(b"\r\n\r\n/bb"))
+
+    def test_http10_closes(self):
+        _response = self._raw(b"GET /a HTTP/1.0\r\n\r\n")
+        self.assertTrue(_response.startswith(b"HTTP/1.0 200 OK"))
+        self.assertIn(b"Connection: close", _response)
+
+    def test_head(self):
+        _response = self._raw(b"HEAD /abc HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertIn(b"Content-Length: 4", _response)
+        self.assertTrue(_response.endswith(b"\r\n\r\n"))
+
+    def test_body(self):
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        _conn.request("POST", "/echo", body=b"hello")
+        self.assertEqual(b"hello", _conn.getresponse().read())
+        _conn.close()
+
+    def test_blocking_methods(self):
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        _conn.request("PUT", "/thread")
+        self.assertNotEqual(bytes(self._thread.name, "utf-8"), _conn.getresponse().read())
+        _conn.close()
+
+    def test_blocking_paths(self):
+        self._server.blocking_paths = ("/thread",)
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        _conn.request("GET", "/thread?now")
+        self.assertNotEqual(bytes(self._thread.name, "utf-8"), _conn.getresponse().read())
+        _conn.close()
+
+    def test_stream(self):
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        for _ in range(2):
+            _conn.request("GET", "/stream")
+            _response = _conn.getresponse()
+            self.assertEqual("chunked", _response.getheader("Transfer-Encoding"))
+            self.assertIsNone(_response.getheader("Content-Length"))
+            self.assertEqual(b"first,second", _response.read())
+            self.assertFalse(_response.will_close)
+        _conn.close()
+
+    def test_stream_http10_closes(self):
+        _response = self._raw(b"GET /stream HTTP/1.0\r\nConnection: keep-alive\r\n\r\n")
+        self.assertIn(b"Connection: close", _response)
+        self.assertNotIn(b"Transfer-Encoding", _response)
+        self.assertTrue(_response.endswith(b"\r\n\r\nfirst,second"))
+
+    def test_stream_error(self):
+        # the body is cut short, without the last chunk
+        _response = self._raw(b"GET /stream-error HTTP/1.1\r\n\r\n")
+        self.assertTrue(_response.startswith(b"HTTP/1.1 200"))
+        self.assertTrue(_response.endswith(b"6\r\nfirst,\r\n"))
+
+    def test_app_error(self):
+        _response = self._raw(b"GET /error HTTP/1.1\r\nConnection: close\r\n\r\n")
+        self.assertTrue(_response.startswith(b"HTTP/1.1 500"))
+
+    def test_bad_request(self):
+        _response = self._raw(b"NONSENSE\r\n\r\n")
+        self.assertTrue(_response.startswith(b"HTTP/1.1 400"))
+
+    def test_chunked_request_rejected(self):
+        _response = self._raw(b"POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n0\r\n\r\n")
+        self.assertTrue(_response.startswith(b"HTTP/1.1 411"))
+
+    def test_admission(self):
+        self._server.admission = AdmissionController(limit=1, retry_after=2, priority_paths=("/metrics",))
+        self._server.probe_paths = ("/health",)
+
+        # fill the limit with a request running off the event loop
+        release.clear()
+        _waiting = HTTPConnection(*self._server.server_address, timeout=5)
+        _waiting.request("PUT", "/wait")
+        while self._server.admission.in_flight < 1:
+            time.sleep(0.01)
+
+        _response = self._raw(b"GET /a HTTP/1.1\r\n\r\n")
+        self.assertTrue(_response.startswith(b"HTTP/1.1 503"))
+        self.assertIn(b"Retry-After: 2", _response)
+        self.assertIn(b"Connection: close", _response)
+
+        for _path in (b"/health", b"/metrics"):
+            _response = self._raw(b"GET " + _path + b" HTTP/1.1\r\nConnection: close\r\n\r\n")
+            self.assertTrue(_response.startswith(b"HTTP/1.1 200"))
+
+        release.set()
+        self.assertEqual(200, _waiting.getresponse().status)
+        _waiting.close()
+        self.assertEqual(1, self._server.admission.shed)
+
+    def test_drain(self):
+        self._server.drain_timeout = 5
+        # an idle keep-alive connection is closed
+        _idle = HTTPConnection(*self._server.server_address, timeout=5)
+        _idle.request("GET", "/a")
+        _idle.getresponse().read()
+        # and a request which has started to arrive is answered
+        _sock = socket.create_connection(self._server.server_address, timeout=5)
+        _sock.sendall(b"GET /b HTTP/1.1\r\n")
+        time.sleep(0.1)
+
+        _stopping = threading.Thread(target=self._server.shutdown)
+        _stopping.start()
+        time.sleep(0.1)
+        self.assertEqual(b"", _idle.sock.recv(1024))
+        _idle.close()
+
+        _sock.sendall(b"\r\n")
+        _chunks = []
+        while True:
+            _chunk = _sock.recv(65536)
+            if not _chunk:
+                break
+            _chunks.append(_chunk)
+        _sock.close()
+        _response = b"".join(_chunks)
+        self.assertTrue(_response.startswith(b"HTTP/1.1 200"))
+        self.assertIn(b"Connection: close", _response)
+        self.assertTrue(_response.endswith(b"/b"))
+        _stopping.join()
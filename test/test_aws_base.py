@@ -2,7 +2,7 @@ import os
 import unittest
 from unittest.mock import patch
 from .mock_boto import MockBoto, MockGenericClient
-from src.libs.aws_base import AWSBase
+from src.libs.aws_base import AWSBase, clear_clients
 
 class TestAWSBase(unittest.TestCase):
     def setUp(self) -> None:
@@ -17,13 +17,20 @@ class TestAWSBase(unittest.TestCase):
             'AWS_ACCESS_KEY_ID',
             'AWS_SECRET_ACCESS_KEY',
             'AWS_SESSION_TOKEN',
-            'AWS_REGION'
+            'AWS_REGION',
+            'AWS_MAX_POOL_CONNECTIONS',
+            'AWS_CONNECT_TIMEOUT',
+            'AWS_READ_TIMEOUT',
+            'AWS_MAX_ATTEMPTS',
+            'AWS_RETRY_MODE'
         ]
 
         for env_var in env_vars:
             if env_var in os.environ:
                 del(os.environ[env_var])
 
+        clear_clients()
+
     def test_initializor_with_arg(self):
         _client = AWSBase("Test3", client=self._client)
         self.assertEqual("Generic", _client._client._client_type)
@@ -90,4 +97,41 @@ class TestAWSBase(unittest.TestCase):
         self.assertEqual(self._access_key_id, _new_client._aws_access_key_id)
         self.assertEqual(self._secret_access_key, _new_client._aws_secret_access_key)
         self.assertEqual(self._session_token, _new_client._aws_session_token)
-        self.assertEqual(self._region, _new_client._region_name)
\ No newline at end of file
+        self.assertEqual(self._region, _new_client._region_name)
+
+    @patch("boto3.client", MockBoto.client)
+    def test__generate_client_config(self):
+        os.environ['AWS_READ_TIMEOUT'] = '1.5'
+        os.environ['AWS_RETRY_MODE'] = 'standard'
+
+        _config = self._aws_base._generate_client(client_type="test")._config
+        self.assertEqual(10, _config.max_pool_connections)
+        self.assertEqual(2, _config.connect_timeout)
+        self.assertEqual(1.5, _config.read_timeout)
+        self.assertEqual({"total_max_attempts": 3, "mode": "standard"}, _config.retries)
+
+    def test__get_client_settings_invalid(self):
+        for _env_var, _value in (('AWS_CONNECT_TIMEOUT', 'soon'),
+                                 ('AWS_MAX_POOL_CONNECTIONS', '0'),
+                                 ('AWS_RETRY_MODE', 'eager')):
+            os.environ[_env_var] = _value
+            with self.assertRaises(ValueError):
+                self._aws_base._get_client_settings()
+            del(os.environ[_env_var])
+
+    @patch("boto3.client", MockBoto.client)
+    def test_clients_are_shared(self):
+        _client = AWSBase("ssm")._client
+        self.assertIs(_client, AWSBase("ssm")._client)
+        self.assertIsNot(_client, AWSBase("s3")._client)
+
+        # new credentials or settings build a new client
+        os.environ['AWS_ACCESS_KEY_ID'] = self._access_key_id
+        os.environ['AWS_SECRET_ACCESS_KEY'] = self._secret_access_key
+        _new_client = AWSBase("ssm")._client
+        self.assertIsNot(_client, _new_client)
+        os.environ['AWS_READ_TIMEOUT'] = '10'
+        self.assertIsNot(_new_client, AWSBase("ssm")._client)
+
+        clear_clients()
+        self.assertIsNot(_client, AWSBase("ssm")._client)
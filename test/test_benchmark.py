@@ -0,0 +1,30 @@
+import unittest
+from bench.user_service_bench import compare_results, percentile, setting_to_env
+
+
+def _result(rps, p50, p99, errors=0):
+    return {"requests_per_second": rps, "errors": errors, "latency_ms": {"p50": p50, "p99": p99}}
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_percentile(self):
+        _values = list(range(1, 101))
+        self.assertEqual(50, percentile(_values, 0.5))
+        self.assertEqual(99, percentile(_values, 0.99))
+        self.assertEqual(1, percentile(_values, 0))
+        self.assertEqual(0.0, percentile([], 0.5))
+
+    def test_setting_to_env(self):
+        self.assertEqual("LOG_SAMPLE_RATE", setting_to_env("log/sample-rate"))
+
+    def test_compare_within_threshold(self):
+        _baseline = {"scenarios": {"hit-keep-alive": _result(1000, 1.0, 4.0)}}
+        _current = {"scenarios": {"hit-keep-alive": _result(950, 1.05, 4.2)}}
+        self.assertEqual([], compare_results(_baseline, _current, 0.1))
+
+    def test_compare_regression(self):
+        _baseline = {"scenarios": {"hit-keep-alive": _result(1000, 1.0, 4.0)}}
+        _current = {"scenarios": {"hit-keep-alive": _result(800, 1.0, 6.0, errors=3),
+                                  "new-scenario": _result(1, 100, 100)}}
+        _regressions = compare_results(_baseline, _current, 0.1)
+        self.assertEqual(3, len(_regressions))
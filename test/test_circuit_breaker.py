@@ -0,0 +1,57 @@
+import unittest
+from src.libs.circuit_breaker import CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN
+from src.libs.circuit_breaker import CircuitBreaker, CircuitOpenException
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self) -> None:
+        self._now = 100.0
+        self._breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=10,
+                                       clock=lambda: self._now)
+
+    def _fail(self, times:int) -> None:
+        for _ in range(times):
+            self._breaker.allow()
+            self._breaker.record_failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self._fail(2)
+        self._breaker.record_success()
+        self._fail(2)
+        self.assertEqual(CIRCUIT_CLOSED, self._breaker.state)
+
+        self._fail(1)
+        self.assertEqual(CIRCUIT_OPEN, self._breaker.state)
+        self._now += 4
+        with self.assertRaises(CircuitOpenException) as _context:
+            self._breaker.allow()
+        self.assertEqual(6, _context.exception.retry_in)
+        self.assertEqual(1, self._breaker.opened)
+
+    def test_half_open_trial(self):
+        self._fail(3)
+        self._now += 10
+
+        # a single trial call is let through
+        self._breaker.allow()
+        self.assertEqual(CIRCUIT_HALF_OPEN, self._breaker.state)
+        with self.assertRaises(CircuitOpenException):
+            self._breaker.allow()
+
+        # its failure opens the circuit for another reset_timeout
+        self._breaker.record_failure()
+        self.assertEqual(CIRCUIT_OPEN, self._breaker.state)
+        self.assertEqual(2, self._breaker.opened)
+        with self.assertRaises(CircuitOpenException):
+            self._breaker.allow()
+
+        # and its success closes it
+        self._now += 10
+        self._breaker.allow()
+        self._breaker.record_success()
+        self.assertEqual(CIRCUIT_CLOSED, self._breaker.state)
+        self._breaker.allow()
+
+    def test_invalid_threshold(self):
+        with self.assertRaises(ValueError):
+            CircuitBreaker("test", failure_threshold=0)
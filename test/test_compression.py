@@ -0,0 +1,60 @@
+import gzip
+import unittest
+import zlib
+from src.libs.compression import compress, compress_stream, negotiate
+
+
+class TestNegotiate(unittest.TestCase):
+    def test_no_header(self):
+        self.assertIsNone(negotiate(None))
+        self.assertIsNone(negotiate(""))
+
+    def test_preference(self):
+        self.assertEqual("gzip", negotiate("gzip, deflate, br"))
+        self.assertEqual("deflate", negotiate("deflate, gzip;q=0.5"))
+        self.assertEqual("gzip", negotiate("*"))
+
+    def test_refused(self):
+        self.assertIsNone(negotiate("gzip;q=0, deflate;q=0"))
+        self.assertIsNone(negotiate("br, identity"))
+        self.assertEqual("deflate", negotiate("*, gzip;q=0"))
+
+
+class TestCompress(unittest.TestCase):
+    def test_round_trip(self):
+        _body = b'{"username": "dudeduerson"}' * 100
+        self.assertEqual(_body, gzip.decompress(compress(_body, "gzip")))
+        self.assertEqual(_body, zlib.decompress(compress(_body, "deflate", level=1)))
+
+    def test_stable_output(self):
+        self.assertEqual(compress(b"body", "gzip"), compress(b"body", "gzip"))
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            compress(b"body", "br")
+
+
+class TestCompressStream(unittest.TestCase):
+    def test_round_trip(self):
+        _chunks = [b'{"username": "dudeduerson"}' * 100 for _ in range(10)]
+        self.assertEqual(b"".join(_chunks), gzip.decompress(b"".join(compress_stream(_chunks, "gzip"))))
+        self.assertEqual(b"".join(_chunks), zlib.decompress(b"".join(compress_stream(_chunks, "deflate", level=1))))
+
+    def test_source_closed(self):
+        _closed = []
+
+        def _chunks():
+            try:
+                yield b"first"
+                yield b"second"
+            finally:
+                _closed.append(True)
+
+        _stream = compress_stream(_chunks(), "gzip")
+        next(_stream)
+        _stream.close()
+        self.assertEqual([True], _closed)
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            compress_stream([b"body"], "br")
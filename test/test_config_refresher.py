@@ -0,0 +1,102 @@
+import os
+import sys
+import threading
+import unittest
+from src.libs.config_refresher import ConfigRefresher
+from .mock_boto import MockSSM
+
+# app_config uses the flat imports of src/, as it does when app.py runs it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from app_config import AppConfig
+from libs.parameters import AWSParameter
+
+
+class MockConfig:
+    def __init__(self, version):
+        self.version = version
+
+
+class TestConfigRefresher(unittest.TestCase):
+    def setUp(self) -> None:
+        self._versions = ["v1"]
+        self._applied = []
+        self._refresher = ConfigRefresher(load=self._load,
+                                          apply=self._applied.append,
+                                          interval=10,
+                                          version="v1")
+
+    def _load(self):
+        _version = self._versions[-1]
+        if isinstance(_version, Exception):
+            raise _version
+        return MockConfig(_version)
+
+    def test_unchanged_config_not_applied(self):
+        self.assertTrue(self._refresher.refresh())
+        self.assertEqual([], self._applied)
+        self.assertIsNotNone(self._refresher.last_refresh)
+        self.assertIsNone(self._refresher.last_change)
+
+    def test_changed_config_applied(self):
+        self._versions.append("v2")
+        self.assertTrue(self._refresher.refresh())
+        self.assertEqual(["v2"], [config.version for config in self._applied])
+        self.assertEqual("v2", self._refresher.version)
+        self.assertEqual(self._refresher.last_refresh, self._refresher.last_change)
+
+    def test_failure_backs_off(self):
+        self._versions.append(Exception("ThrottlingException"))
+        self.assertFalse(self._refresher.refresh())
+        self.assertFalse(self._refresher.refresh())
+        self.assertEqual(2, self._refresher.failures)
+        self.assertGreaterEqual(self._refresher.next_delay(), 40 * 0.9)
+
+        self._versions.append("v1")
+        self.assertTrue(self._refresher.refresh())
+        self.assertEqual(0, self._refresher.failures)
+
+    def test_backoff_is_capped(self):
+        self._refresher.failures = 20
+        self.assertLessEqual(self._refresher.next_delay(), self._refresher.max_backoff * 1.1)
+
+    def test_jitter(self):
+        _delays = set(self._refresher.next_delay() for _ in range(20))
+        self.assertGreater(len(_delays), 1)
+        for _delay in _delays:
+            self.assertTrue(9 <= _delay <= 11)
+
+    def test_background_thread(self):
+        _applied = threading.Event()
+        _refresher = ConfigRefresher(load=lambda: MockConfig("v2"),
+                                     apply=lambda config: _applied.set(),
+                                     interval=0.01,
+                                     version="v1")
+        _refresher.start()
+        self.assertTrue(_applied.wait(5))
+        _refresher.stop()
+        self.assertEqual("v2", _refresher.version)
+
+
+class TestAppConfigRefresh(unittest.TestCase):
+    def test_throttled_refresh_backs_off(self):
+        _client = MockSSM({"/user-service/config/refresh-interval": "10"})
+        _config = AppConfig(parameter_client=AWSParameter(_client))
+        _refresher = ConfigRefresher(load=_config.reload, apply=self.fail,
+                                     interval=_config.refresh_interval, version=_config.version,
+                                     jitter=0)
+        self.assertEqual(10, _refresher.next_delay())
+
+        _client.error_code = "ThrottlingException"
+        _client.calls = []
+        self.assertFalse(_refresher.refresh())
+        self.assertEqual(20, _refresher.next_delay())
+        self.assertFalse(_refresher.refresh())
+        self.assertEqual(40, _refresher.next_delay())
+        # each refresh tried one bulk read, not one read per setting
+        self.assertEqual(['get_parameters_by_path'] * 2, _client.calls)
+
+        # the snapshot in use is kept, and refreshes recover with the store
+        _client.error_code = None
+        self.assertTrue(_refresher.refresh())
+        self.assertEqual(10, _refresher.next_delay())
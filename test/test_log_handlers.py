@@ -0,0 +1,107 @@
+import io
+import json
+import logging
+import queue
+import unittest
+from src.libs.log_handlers import AccessLog, DeferredQueueHandler, JsonAccessFormatter
+from src.libs.log_handlers import ACCESS_LOGGER_NAME, configure_logging
+
+
+class TestDeferredQueueHandler(unittest.TestCase):
+    def test_record_not_formatted(self):
+        _handler = DeferredQueueHandler(queue.Queue())
+        _record = logging.makeLogRecord({"msg": "User ID %s Found", "args": ("1",)})
+        _handler.handle(_record)
+
+        _queued = _handler.queue.get_nowait()
+        self.assertIs(_record, _queued)
+        self.assertEqual(("1",), _queued.args)
+
+    def test_full_queue_drops(self):
+        _handler = DeferredQueueHandler(queue.Queue(maxsize=1))
+        for _ in range(3):
+            _handler.handle(logging.makeLogRecord({"msg": "message"}))
+
+        self.assertEqual(2, _handler.dropped)
+
+
+class TestJsonAccessFormatter(unittest.TestCase):
+    def test_format(self):
+        _record = logging.makeLogRecord({"msg": "access", "access": {"status": 200, "path": "/user/1"}})
+        _line = json.loads(JsonAccessFormatter().format(_record))
+
+        self.assertEqual(200, _line.get("status"))
+        self.assertEqual("/user/1", _line.get("path"))
+        self.assertIn("time", _line)
+
+
+class TestAccessLog(unittest.TestCase):
+    def setUp(self) -> None:
+        self._records = []
+        self._logger = logging.getLogger(ACCESS_LOGGER_NAME)
+        self._saved = (self._logger.handlers, self._logger.level, self._logger.propagate)
+
+        _handler = logging.Handler()
+        _handler.emit = self._records.append
+        self._logger.handlers = [_handler]
+        self._logger.setLevel(logging.INFO)
+        self._logger.propagate = False
+
+    def tearDown(self) -> None:
+        self._logger.handlers, self._logger.level, self._logger.propagate = self._saved
+
+    def test_log(self):
+        AccessLog().log("127.0.0.1", "GET", "/user/1", 200, 27, 0.0015)
+
+        self.assertEqual(1, len(self._records))
+        self.assertEqual(1.5, self._records[0].access.get("duration_ms"))
+
+    def test_sampling(self):
+        _access_log = AccessLog(sample_rate=0.0)
+        self.assertFalse(_access_log.sampled())
+
+        _access_log.log("127.0.0.1", "GET", "/user/1", 200, 27, 0.001)
+        self.assertEqual(0, len(self._records))
+
+        # errors are always logged
+        _access_log.log("127.0.0.1", "GET", "/user/1", 500, 21, 0.001)
+        self.assertEqual(1, len(self._records))
+
+
+class TestConfigureLogging(unittest.TestCase):
+    def setUp(self) -> None:
+        _root = logging.getLogger()
+        _access = logging.getLogger(ACCESS_LOGGER_NAME)
+        self._saved = (_root.handlers[:], _root.level, _access.handlers[:], _access.propagate)
+
+    def tearDown(self) -> None:
+        _root = logging.getLogger()
+        _access = logging.getLogger(ACCESS_LOGGER_NAME)
+        _root.handlers, _root.level, _access.handlers, _access.propagate = self._saved
+
+    def test_queue_mode(self):
+        _stream = io.StringIO()
+        _handler = logging.StreamHandler(_stream)
+        _handler.setLevel(logging.INFO)
+
+        _listener = configure_logging([_handler], logging.INFO, mode="queue")
+        self.assertIsNotNone(_listener)
+        self.assertIsInstance(logging.getLogger().handlers[0], DeferredQueueHandler)
+        self.assertEqual(logging.NOTSET, _handler.level)
+
+        logging.getLogger().info("application line")
+        logging.getLogger(ACCESS_LOGGER_NAME).info("access", extra={"access": {"status": 200}})
+        _listener.stop()
+
+        # access records are written by the JSON handler, not the application handler
+        self.assertEqual("application line\n", _stream.getvalue())
+
+    def test_stream_mode(self):
+        _handler = logging.StreamHandler(io.StringIO())
+        self.assertIsNone(configure_logging([_handler], logging.DEBUG, mode="stream"))
+        self.assertIs(_handler, logging.getLogger().handlers[0])
+        self.assertEqual(logging.DEBUG, logging.getLogger().level)
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            configure_logging([], logging.INFO, mode="bad-mode")
@@ -0,0 +1,73 @@
+import threading
+import time
+import unittest
+from src.libs.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self) -> None:
+        self._metrics = Metrics(buckets=(0.001, 0.01))
+
+    def _record(self, route, status, duration):
+        _token = self._metrics.request_started()
+        self._metrics.request_finished(_token, route, status, duration)
+
+    def test_request_counts(self):
+        self._record("user", 200, 0.0005)
+        self._record("user", 200, 0.0005)
+        self._record("user", 404, 0.0005)
+
+        _output = self._metrics.render()
+        self.assertIn('user_service_requests_total{route="user",status="200"} 2', _output)
+        self.assertIn('user_service_requests_total{route="user",status="404"} 1', _output)
+
+    def test_histogram(self):
+        self._record("user", 200, 0.0005)
+        self._record("user", 200, 0.005)
+        self._record("user", 200, 1.0)
+
+        _output = self._metrics.render()
+        self.assertIn('user_service_request_duration_seconds_bucket{route="user",le="0.001"} 1', _output)
+        self.assertIn('user_service_request_duration_seconds_bucket{route="user",le="0.01"} 2', _output)
+        self.assertIn('user_service_request_duration_seconds_bucket{route="user",le="+Inf"} 3', _output)
+        self.assertIn('user_service_request_duration_seconds_count{route="user"} 3', _output)
+        self.assertIn('user_service_request_duration_seconds_sum{route="user"} 1.0055', _output)
+
+    def test_in_flight(self):
+        _token = self._metrics.request_started()
+        self.assertIn("user_service_requests_in_flight 1", self._metrics.render())
+        self._metrics.request_finished(_token, "user", 200, 0.001)
+        self.assertIn("user_service_requests_in_flight 0", self._metrics.render())
+
+    def test_counters(self):
+        self._metrics.describe("lookups_total", "Lookups")
+        self._metrics.inc("lookups_total", (("result", "found"),))
+        self._metrics.inc("lookups_total", (("result", "found"),), amount=2)
+
+        _output = self._metrics.render()
+        self.assertIn("# HELP user_service_lookups_total Lookups", _output)
+        self.assertIn('user_service_lookups_total{result="found"} 3', _output)
+
+    def test_extra(self):
+        _output = self._metrics.render([("cache_entries", "gauge", "Cached responses", 7)])
+        self.assertIn("# TYPE user_service_cache_entries gauge", _output)
+        self.assertIn("user_service_cache_entries 7", _output)
+
+    def test_threads_are_summed(self):
+        _threads = [threading.Thread(target=self._record, args=("user", 200, 0.001)) for _ in range(4)]
+        for _thread in _threads:
+            _thread.start()
+        for _thread in _threads:
+            _thread.join()
+
+        self.assertIn('user_service_requests_total{route="user",status="200"} 4', self._metrics.render())
+
+    def test_overhead(self):
+        _count = 100000
+        _start = time.perf_counter()
+        for _ in range(_count):
+            self._record("user", 200, 0.0005)
+        _per_request = (time.perf_counter() - _start) / _count
+
+        # generous bound so slow CI machines don't fail, typically well under 1us
+        self.assertLess(_per_request, 0.00001)
@@ -1,5 +1,6 @@
-from src.libs.parameters import AWSParameter
-from src.libs.parameters import ParameterNotFoundException
+from src.libs.parameters import AWSParameter, CachedParameter, Parameter
+from src.libs.parameters import ParameterNotFoundException, ParameterUnavailableException
+from src.libs.circuit_breaker import CIRCUIT_OPEN, CircuitBreaker, CircuitOpenException
 from .mock_boto import MockSSM
 import unittest
 
@@ -21,9 +22,12 @@ class TestAWSParameter(unittest.TestCase):
             "_param1": self._param1
         }
 
-        _client = MockSSM(self._param_map)
+        self._client = MockSSM(self._param_map)
+        self._now = 0.0
+        self._breaker = CircuitBreaker("ssm", failure_threshold=2, reset_timeout=30,
+                                       clock=lambda: self._now)
 
-        self._aws_paramter = AWSParameter(_client)
+        self._aws_paramter = AWSParameter(self._client, breaker=self._breaker)
 
     def test_get_non_existent_param(self):
         with self.assertRaises(ParameterNotFoundException):
@@ -39,4 +43,103 @@ class TestAWSParameter(unittest.TestCase):
 
         self._aws_paramter.put_parameter(_name, _value, 'test_description')
 
-        self.assertEqual(_value, self._param_map.get(_name))
\ No newline at end of file
+        self.assertEqual(_value, self._param_map.get(_name))
+
+    def test_get_values_by_path(self):
+        for i in range(25):
+            self._param_map["/app/setting{}".format(i)] = str(i)
+
+        _values = self._aws_paramter.get_values_by_path("/app")
+
+        self.assertEqual(25, len(_values))
+        self.assertEqual("7", _values.get("/app/setting7"))
+        self.assertNotIn("_param1", _values)
+
+    def test_throttled_uses_last_value(self):
+        self.assertEqual(self._param1, self._aws_paramter.get_value("_param1"))
+
+        self._client.error_code = "ThrottlingException"
+        self.assertEqual(self._param1, self._aws_paramter.get_value("_param1"))
+        with self.assertRaises(ParameterUnavailableException):
+            self._aws_paramter.get_value("_param2")
+
+    def test_circuit_opens(self):
+        self.assertEqual(self._param1, self._aws_paramter.get_value("_param1"))
+        self._client.error_code = "ThrottlingException"
+        for _ in range(2):
+            with self.assertRaises(ParameterUnavailableException):
+                self._aws_paramter.get_value("_param2")
+        self.assertEqual(CIRCUIT_OPEN, self._breaker.state)
+
+        # calls fail fast without reaching SSM
+        self._client.calls = []
+        self.assertEqual(self._param1, self._aws_paramter.get_value("_param1"))
+        with self.assertRaises(CircuitOpenException):
+            self._aws_paramter.get_values_by_path("/app")
+        self.assertEqual([], self._client.calls)
+
+        # once SSM recovers a trial call closes the circuit
+        self._client.error_code = None
+        self._now = 30.0
+        self.assertEqual(self._param1, self._aws_paramter.get_value("_param1"))
+        self.assertEqual(['get_parameter'], self._client.calls)
+        self.assertEqual(0, self._breaker.failures)
+
+    def test_not_found_isnt_a_failure(self):
+        for _ in range(3):
+            with self.assertRaises(ParameterNotFoundException):
+                self._aws_paramter.get_value("bad_value")
+        self.assertEqual(0, self._breaker.failures)
+
+
+class TestCachedParameter(unittest.TestCase):
+    def setUp(self) -> None:
+        self._param_map = {
+            "/app/log-level": "debug",
+            "/app/feature/user-icon": "on",
+            "/other/value": "other"
+        }
+        self._client = MockSSM(self._param_map)
+        self._cached = CachedParameter(AWSParameter(self._client))
+        self.assertTrue(self._cached.load("/app"))
+        self._client.calls = []
+
+    def test_get_value_from_cache(self):
+        self.assertEqual("debug", self._cached.get_value("/app/log-level"))
+        self.assertEqual("on", self._cached.get_value("/app/feature/user-icon"))
+        self.assertEqual([], self._client.calls)
+
+    def test_missing_value_in_path(self):
+        with self.assertRaises(ParameterNotFoundException):
+            self._cached.get_value("/app/missing")
+        self.assertEqual([], self._client.calls)
+
+    def test_value_outside_path(self):
+        self.assertEqual("other", self._cached.get_value("/other/value"))
+        self.assertEqual(['get_parameter'], self._client.calls)
+
+    def test_deferred_put(self):
+        self._cached.put_parameter("/app/new", "value", "description")
+        self.assertEqual("value", self._cached.get_value("/app/new"))
+        self.assertNotIn("/app/new", self._param_map)
+
+        self.assertEqual(1, self._cached.flush())
+        self.assertEqual("value", self._param_map.get("/app/new"))
+        self.assertEqual(0, self._cached.flush())
+
+    def test_throttled_load(self):
+        self._client.error_code = "ThrottlingException"
+        with self.assertRaises(ParameterUnavailableException):
+            self._cached.load("/app")
+        # the parameters aren't read one at a time instead
+        with self.assertRaises(ParameterUnavailableException):
+            self._cached.get_value("/app/log-level")
+        self.assertEqual(['get_parameters_by_path'], self._client.calls)
+
+        self._client.error_code = None
+        self.assertTrue(self._cached.load("/app"))
+        self.assertEqual("debug", self._cached.get_value("/app/log-level"))
+
+    def test_client_without_path_support(self):
+        _cached = CachedParameter(Parameter())
+        self.assertFalse(_cached.load("/app"))
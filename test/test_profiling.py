@@ -0,0 +1,112 @@
+import threading
+import time
+import unittest
+from src.libs.metrics import Metrics
+from src.libs.profiling import ProfilerBusyException, RequestTracer, SamplingProfiler
+
+
+def _spin(stop):
+    while not stop.is_set():
+        pass
+
+
+class TestSamplingProfiler(unittest.TestCase):
+    def setUp(self) -> None:
+        self._profiler = SamplingProfiler(interval=0.001)
+
+    def test_profile(self):
+        _stop = threading.Event()
+        _thread = threading.Thread(target=_spin, args=(_stop,), name="spinner-3")
+        _thread.start()
+        try:
+            _stacks = self._profiler.profile(0.2)
+        finally:
+            _stop.set()
+            _thread.join()
+
+        _spinning = [_stack for _stack in _stacks if _stack[-1] == "test_profiling:_spin"]
+        self.assertTrue(_spinning)
+        # the thread number is dropped and the stack runs from the thread down
+        self.assertEqual("spinner", _spinning[0][0])
+        # the profiling thread isn't sampled
+        self.assertFalse([_stack for _stack in _stacks if "profiling:SamplingProfiler.profile" in _stack])
+
+    def test_busy(self):
+        _started = threading.Event()
+
+        def _sleep(seconds):
+            _started.set()
+            time.sleep(seconds)
+
+        _profiler = SamplingProfiler(interval=0.05, sleep=_sleep)
+        _thread = threading.Thread(target=_profiler.profile, args=(0.2,))
+        _thread.start()
+        _started.wait(5)
+
+        self.assertTrue(_profiler.running)
+        with self.assertRaises(ProfilerBusyException):
+            _profiler.profile(0.1)
+        _thread.join()
+        self.assertFalse(_profiler.running)
+
+    def test_collapse(self):
+        _output = SamplingProfiler.collapse({
+            ("main", "app:main", "servers:serve"): 3,
+            ("worker", "user_service:UserService._get_user"): 1
+        })
+        self.assertEqual("main;app:main;servers:serve 3\nworker;user_service:UserService._get_user 1\n", _output)
+
+
+class TestRequestTracer(unittest.TestCase):
+    def setUp(self) -> None:
+        self._metrics = Metrics()
+        self._tracer = RequestTracer(sample_rate=1.0, max_traces=2, counters=self._metrics)
+
+    def test_off(self):
+        self._tracer.sample_rate = 0.0
+        self.assertFalse(self._tracer.start())
+        self.assertIsNone(self._tracer.mark())
+        self.assertEqual([], self._tracer.recent())
+
+    def test_trace(self):
+        self.assertTrue(self._tracer.start())
+        _mark = self._tracer.mark()
+        time.sleep(0.01)
+        self._tracer.record("lookup", _mark)
+        self._tracer.record("lookup", self._tracer.mark())
+        self._tracer.record("serialization", self._tracer.mark())
+        self._tracer.finish("user", 200, 0.02)
+
+        _trace = self._tracer.recent()[0]
+        self.assertEqual("user", _trace["route"])
+        self.assertEqual(200, _trace["status"])
+        self.assertEqual(["lookup", "serialization"], sorted(_trace["phases"]))
+        self.assertGreaterEqual(_trace["phases"]["lookup"], 0.01)
+
+        _output = self._metrics.render()
+        self.assertIn('user_service_traced_requests_total{route="user"} 1', _output)
+        self.assertIn('user_service_request_phase_seconds_total{phase="lookup"}', _output)
+
+        # phases running when the request is finished aren't recorded
+        _lookup = _trace["phases"]["lookup"]
+        self.assertIsNone(self._tracer.mark())
+        self._tracer.record("lookup", _mark)
+        self.assertEqual(_lookup, self._tracer.recent()[0]["phases"]["lookup"])
+
+    def test_latest_traces(self):
+        for _route in ("a", "b", "c"):
+            self._tracer.start()
+            self._tracer.finish(_route, 200, 0.001)
+
+        self.assertEqual(["b", "c"], [_trace["route"] for _trace in self._tracer.recent()])
+
+    def test_threads(self):
+        # phases timed on another thread aren't added to this thread's trace
+        self._tracer.start()
+        _marks = []
+        _thread = threading.Thread(target=lambda: _marks.append(self._tracer.mark()))
+        _thread.start()
+        _thread.join()
+        self.assertEqual([None], _marks)
+        self._tracer.finish("user", 200, 0.001)
+        self.assertEqual({}, self._tracer.recent()[0]["phases"])
@@ -0,0 +1,102 @@
+import unittest
+from src.libs.response_cache import CachedResponse, ResponseCache, ENTRY_OVERHEAD
+
+
+class TestCachedResponse(unittest.TestCase):
+    def test_etag(self):
+        _first = CachedResponse(b'{"username": "a"}')
+        _second = CachedResponse(b'{"username": "a"}')
+        _third = CachedResponse(b'{"username": "b"}')
+
+        self.assertTrue(_first.etag.startswith('"'))
+        self.assertEqual(_first.etag, _second.etag)
+        self.assertNotEqual(_first.etag, _third.etag)
+
+    def test_last_modified(self):
+        self.assertIsNone(CachedResponse(b"body").last_modified)
+
+        _cache = ResponseCache()
+        _entry = _cache.put("1", "gen", b"body", "Sun, 18 Oct 2026 10:00:00 GMT")
+        self.assertEqual("Sun, 18 Oct 2026 10:00:00 GMT", _cache.get("1", "gen").last_modified)
+        self.assertIs(_entry, _cache.get("1", "gen"))
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self._cache = ResponseCache(max_entries=2)
+
+    def test_get_and_put(self):
+        self.assertIsNone(self._cache.get("1", "gen"))
+        _entry = self._cache.put("1", "gen", b"body")
+        self.assertIs(_entry, self._cache.get("1", "gen"))
+        self.assertEqual(1, self._cache.hits)
+        self.assertEqual(1, self._cache.misses)
+
+    def test_invalidate(self):
+        self._cache.put("1", "gen", b"one")
+        self._cache.put("2", "gen", b"two")
+        self._cache.invalidate("1")
+        self.assertIsNone(self._cache.get("1", "gen"))
+        self.assertIsNotNone(self._cache.get("2", "gen"))
+        self.assertEqual(len(b"two") + ENTRY_OVERHEAD, self._cache.size)
+
+    def test_put_after_invalidate(self):
+        # the data was read before the key was invalidated, so it may be stale
+        _invalidations = self._cache.invalidations
+        self._cache.invalidate("1")
+        self._cache.put("1", "gen", b"stale", invalidations=_invalidations)
+        self.assertIsNone(self._cache.get("1", "gen"))
+
+        self._cache.put("1", "gen", b"fresh", invalidations=self._cache.invalidations)
+        self.assertEqual(b"fresh", self._cache.get("1", "gen").body)
+
+    def test_lru_eviction(self):
+        self._cache.put("1", "gen", b"one")
+        self._cache.put("2", "gen", b"two")
+        # use 1 so 2 becomes the least recently used
+        self._cache.get("1", "gen")
+        self._cache.put("3", "gen", b"three")
+
+        self.assertEqual(2, len(self._cache))
+        self.assertIsNotNone(self._cache.get("1", "gen"))
+        self.assertIsNone(self._cache.get("2", "gen"))
+
+    def test_size_cap(self):
+        _cache = ResponseCache(max_entries=10, max_bytes=2 * (ENTRY_OVERHEAD + 4))
+        for key in ("1", "2", "3"):
+            _cache.put(key, "gen", b"abcd")
+
+        self.assertEqual(2, len(_cache))
+        self.assertLessEqual(_cache.size, _cache.max_bytes)
+
+    def test_generation_change_invalidates(self):
+        self._cache.put("1", ("store", 1, ("user-icon",)), b"with icon")
+        self.assertIsNone(self._cache.get("1", ("store", 1, ())))
+        self.assertEqual(0, len(self._cache))
+
+    def test_disabled(self):
+        _cache = ResponseCache(max_entries=0)
+        self.assertEqual(b"body", _cache.put("1", "gen", b"body").body)
+        self.assertIsNone(_cache.get("1", "gen"))
+
+    def test_get_variant(self):
+        _calls = []
+
+        def _encode(body):
+            _calls.append(body)
+            return body.upper()
+
+        _entry = self._cache.put("1", "gen", b"body")
+        _size = self._cache.size
+
+        self.assertEqual((b"BODY", _entry.etag[:-1] + '-gzip"'),
+                         self._cache.get_variant("1", _entry, "gzip", _encode))
+        self.assertEqual(b"BODY", self._cache.get_variant("1", _entry, "gzip", _encode)[0])
+        self.assertEqual(1, len(_calls))
+        self.assertEqual(_size + 4, self._cache.size)
+
+    def test_clear(self):
+        self._cache.put("1", "gen", b"one")
+        self._cache.clear()
+        self.assertEqual(0, len(self._cache))
+        self.assertEqual(0, self._cache.size)
@@ -0,0 +1,57 @@
+import unittest
+from src.libs.router import MethodNotAllowedException, RouteNotFoundException, Router
+
+
+class TestRouter(unittest.TestCase):
+    def setUp(self) -> None:
+        self._router = Router()
+        self._router.add("GET", "/users", "users", "list")
+        self._router.add("POST", "/users/batch", "users_batch", "batch")
+        self._router.add("GET", "/users/search", "users_search", "search")
+        self._router.add("GET", "/user/{user_id}", "user", "get")
+        self._router.add("PUT", "/user/{user_id}", "user_update", "update")
+        self._router.add("GET", "/user/{user_id}/icon/{size}", "user_icon", "icon")
+
+    def test_exact(self):
+        _route, _params = self._router.resolve("GET", "/users")
+        self.assertEqual("users", _route.name)
+        self.assertEqual((), _params)
+
+    def test_parameter(self):
+        _route, _params = self._router.resolve("GET", "/user/42")
+        self.assertEqual("user", _route.name)
+        self.assertEqual(("42",), _params)
+
+        _route, _params = self._router.resolve("GET", "/user/42/icon/small")
+        self.assertEqual("user_icon", _route.name)
+        self.assertEqual(("42", "small"), _params)
+
+    def test_method_dispatch(self):
+        _route, _ = self._router.resolve("PUT", "/user/42")
+        self.assertEqual("user_update", _route.name)
+
+    def test_head_uses_get(self):
+        _route, _ = self._router.resolve("HEAD", "/user/42")
+        self.assertEqual("user", _route.name)
+
+    def test_static_before_parameter(self):
+        _route, _ = self._router.resolve("GET", "/users/search")
+        self.assertEqual("users_search", _route.name)
+
+    def test_not_found(self):
+        for _path in ("/", "/user", "/user/", "/usersomething", "/user/42/", "/user/42/icon", "users"):
+            with self.assertRaises(RouteNotFoundException, msg=_path):
+                self._router.resolve("GET", _path)
+
+    def test_method_not_allowed(self):
+        with self.assertRaises(MethodNotAllowedException) as e:
+            self._router.resolve("DELETE", "/user/42")
+        self.assertEqual(("GET", "HEAD", "PUT"), e.exception.allowed)
+
+    def test_duplicate_route(self):
+        with self.assertRaises(ValueError):
+            self._router.add("GET", "/users", "users", "list")
+
+    def test_invalid_pattern(self):
+        with self.assertRaises(ValueError):
+            self._router.add("GET", "users", "users", "list")
@@ -0,0 +1,292 @@
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from src.libs.admission import AdmissionController
+from src.libs.servers import ThreadPoolHTTPServer, PreForkServer, create_server
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # set to hold requests for /block until the test releases them
+    release = threading.Event()
+
+    def do_GET(self):
+        if self.path == "/block":
+            self.release.wait(5)
+        _body = bytes(threading.current_thread().name, "utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestThreadPoolHTTPServer(unittest.TestCase):
+    def setUp(self) -> None:
+        self._server = ThreadPoolHTTPServer(("127.0.0.1", 0), MockHandler,
+                                            threads=2, backlog=8)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def tearDown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _get(self) -> str:
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        _conn.request("GET", "/")
+        _response = _conn.getresponse()
+        _body = _response.read().decode("utf-8")
+        _conn.close()
+        return _body
+
+    def test_backlog(self):
+        self.assertEqual(8, self._server.request_queue_size)
+
+    def test_requests_run_on_workers(self):
+        _body = self._get()
+        self.assertTrue(_body.startswith("user-service"))
+
+    def test_slow_client_does_not_block(self):
+        # hold a connection open without sending a request
+        _idle = HTTPConnection(*self._server.server_address, timeout=5)
+        _idle.connect()
+        try:
+            self.assertTrue(self._get().startswith("user-service"))
+        finally:
+            _idle.close()
+
+    def test_invalid_threads(self):
+        with self.assertRaises(ValueError):
+            ThreadPoolHTTPServer(("127.0.0.1", 0), MockHandler, threads=0)
+
+
+class TestProbeWorker(unittest.TestCase):
+    def setUp(self) -> None:
+        self._server = ThreadPoolHTTPServer(("127.0.0.1", 0), MockHandler, threads=1,
+                                            probe_paths=("/health",))
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        MockHandler.release.clear()
+
+    def tearDown(self) -> None:
+        MockHandler.release.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def test_probe_answered_when_busy(self):
+        # occupy the only worker
+        _busy = HTTPConnection(*self._server.server_address, timeout=5)
+        _busy.request("GET", "/block")
+
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        _conn.request("GET", "/health")
+        _body = _conn.getresponse().read().decode("utf-8")
+        _conn.close()
+        self.assertTrue(_body.startswith("user-service-probe"))
+
+        MockHandler.release.set()
+        self.assertEqual(200, _busy.getresponse().status)
+        _busy.close()
+
+
+class TestDrain(unittest.TestCase):
+    def setUp(self) -> None:
+        self._server = ThreadPoolHTTPServer(("127.0.0.1", 0), MockHandler, threads=2,
+                                            drain_timeout=5)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        MockHandler.release.clear()
+
+    def tearDown(self) -> None:
+        MockHandler.release.set()
+        self._thread.join()
+
+    def test_requests_finish(self):
+        _busy = HTTPConnection(*self._server.server_address, timeout=5)
+        _busy.request("GET", "/block")
+        while not self._server._requests:
+            time.sleep(0.01)
+
+        self._server.shutdown()
+        _closing = threading.Thread(target=self._server.server_close)
+        _closing.start()
+        # the socket is closed straight away, the request in progress is answered
+        time.sleep(0.1)
+        with self.assertRaises(OSError):
+            HTTPConnection(*self._server.server_address, timeout=1).request("GET", "/")
+        self.assertTrue(_closing.is_alive())
+
+        MockHandler.release.set()
+        self.assertEqual(200, _busy.getresponse().status)
+        _busy.close()
+        _closing.join()
+
+    def test_deadline(self):
+        # a request which never arrives holds a worker until its connection is cut
+        _idle = socket.create_connection(self._server.server_address, timeout=5)
+        while not self._server._requests:
+            time.sleep(0.01)
+
+        self._server.drain_timeout = 0.1
+        self._server.shutdown()
+        _start = time.monotonic()
+        self._server.server_close()
+        self.assertLess(time.monotonic() - _start, 2)
+        self.assertEqual(b"", _idle.recv(1024))
+        _idle.close()
+
+
+class TestAdmission(unittest.TestCase):
+    def setUp(self) -> None:
+        self._admission = AdmissionController(limit=1, retry_after=3, priority_paths=("/metrics",))
+        self._server = ThreadPoolHTTPServer(("127.0.0.1", 0), MockHandler, threads=1,
+                                            probe_paths=("/health",), admission=self._admission)
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+        MockHandler.release.clear()
+
+    def tearDown(self) -> None:
+        MockHandler.release.set()
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _get(self, path:str) -> tuple:
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        _conn.request("GET", path)
+        _response = _conn.getresponse()
+        _result = (_response.status, _response.getheader("Retry-After"), _response.read())
+        _conn.close()
+        return _result
+
+    def test_shed_over_limit(self):
+        # fill the limit with a request the worker holds
+        _busy = HTTPConnection(*self._server.server_address, timeout=5)
+        _busy.request("GET", "/block")
+        while self._admission.in_flight < 1:
+            time.sleep(0.01)
+
+        _status, _retry_after, _body = self._get("/")
+        self.assertEqual(503, _status)
+        self.assertEqual("3", _retry_after)
+        self.assertEqual(1, self._admission.shed)
+
+        # probes skip the queue and priority requests are queued over the limit
+        self.assertEqual(b"user-service-probe_0", self._get("/health")[2])
+        _priority = HTTPConnection(*self._server.server_address, timeout=5)
+        _priority.request("GET", "/metrics")
+        while self._admission.in_flight < 2:
+            time.sleep(0.01)
+
+        MockHandler.release.set()
+        self.assertEqual(200, _busy.getresponse().status)
+        self.assertEqual(200, _priority.getresponse().status)
+        _busy.close()
+        _priority.close()
+
+        self.assertEqual(200, self._get("/")[0])
+        # the worker releases the request once it has closed the connection
+        _deadline = time.monotonic() + 5
+        while self._admission.in_flight and time.monotonic() < _deadline:
+            time.sleep(0.01)
+        self.assertEqual(0, self._admission.in_flight)
+
+
+    def test_silent_clients_do_not_block_accepts(self):
+        _busy = HTTPConnection(*self._server.server_address, timeout=5)
+        _busy.request("GET", "/block")
+        while self._admission.in_flight < 1:
+            time.sleep(0.01)
+
+        # clients which connect over the limit and send nothing wait for
+        # their request line together, each would take probe_wait one at a time
+        _silent = [socket.create_connection(self._server.server_address, timeout=5) for _ in range(20)]
+        try:
+            _start = time.monotonic()
+            self.assertEqual(b"user-service-probe_0", self._get("/health")[2])
+            self.assertLess(time.monotonic() - _start, 20 * self._server.probe_wait / 2)
+
+            # and are shed once they have had probe_wait to send it
+            for _sock in _silent:
+                self.assertTrue(_sock.recv(1024).startswith(b"HTTP/1.0 503"))
+        finally:
+            for _sock in _silent:
+                _sock.close()
+
+        MockHandler.release.set()
+        self.assertEqual(200, _busy.getresponse().status)
+        _busy.close()
+
+
+class TestPreForkDrain(unittest.TestCase):
+    def _get(self, address:tuple) -> int:
+        _conn = HTTPConnection(*address, timeout=5)
+        try:
+            _conn.request("GET", "/")
+            _response = _conn.getresponse()
+            _response.read()
+            return _response.status
+        finally:
+            _conn.close()
+
+    def test_worker_deregisters(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _marker = os.path.join(_dir, "draining")
+            _server = create_server("prefork", ("127.0.0.1", 0), MockHandler, processes=1,
+                                    drain_timeout=5, on_drain=lambda: open(_marker, "w").close(),
+                                    deregistration_delay=1)
+            _address = _server.server.server_address
+            _thread = threading.Thread(target=_server.serve_forever)
+            _thread.start()
+            self.assertEqual(200, self._get(_address))
+
+            _shutdown = threading.Thread(target=_server.shutdown)
+            _shutdown.start()
+            _deadline = time.monotonic() + 5
+            while not os.path.exists(_marker) and time.monotonic() < _deadline:
+                time.sleep(0.01)
+            self.assertTrue(os.path.exists(_marker))
+            # the worker answers until the load balancer has had time to notice
+            self.assertEqual(200, self._get(_address))
+
+            _shutdown.join()
+            _thread.join()
+            _server.server_close()
+
+
+class TestCreateServer(unittest.TestCase):
+    def test_single(self):
+        _server = create_server("single", ("127.0.0.1", 0), MockHandler, backlog=4)
+        self.assertIs(HTTPServer, type(_server))
+        self.assertEqual(4, _server.request_queue_size)
+        _server.server_close()
+
+    def test_threaded(self):
+        _server = create_server("threaded", ("127.0.0.1", 0), MockHandler, threads=3)
+        self.assertIsInstance(_server, ThreadPoolHTTPServer)
+        self.assertEqual(3, _server.threads)
+        _server.server_close()
+
+    def test_prefork(self):
+        _server = create_server("prefork", ("127.0.0.1", 0), MockHandler, processes=2)
+        self.assertIsInstance(_server, PreForkServer)
+        self.assertEqual(2, _server.processes)
+        _server.server_close()
+
+    def test_prefork_default_processes(self):
+        _server = create_server("prefork", ("127.0.0.1", 0), MockHandler, processes=0)
+        self.assertGreaterEqual(_server.processes, 1)
+        _server.server_close()
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            create_server("bad-mode", ("127.0.0.1", 0), MockHandler)
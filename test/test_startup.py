@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+from src.libs.startup import StartupTimer
+
+# The source directory app.py runs from
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+# The most seconds local-mode startup may take, from the first import to a
+# bound socket. It typically takes around 0.1 seconds, importing boto3
+# alone used to take 0.3
+STARTUP_BUDGET = 0.5
+
+
+def _run_in_src(*args) -> subprocess.CompletedProcess:
+    # settings from the environment would change what starts up
+    _env = {name: value for name, value in os.environ.items()
+            if not name.startswith(("USERS_", "SERVER_", "LOG_", "CACHE_", "AWS_"))}
+    return subprocess.run([sys.executable] + list(args), cwd=SRC_DIR, env=_env,
+                          capture_output=True, text=True, timeout=60)
+
+
+class TestStartupTimer(unittest.TestCase):
+    def test_laps(self):
+        _timer = StartupTimer(started_at=time.perf_counter())
+        _timer.lap("config")
+        _timer.lap("users")
+        _timer.lap("config")
+
+        _report = _timer.report()
+        self.assertEqual(["config", "users"], list(_report["phases"]))
+        self.assertAlmostEqual(_timer.total, sum(_timer.phases.values()))
+
+
+class TestStartup(unittest.TestCase):
+    def test_boto3_is_imported_lazily(self):
+        _result = _run_in_src("-c", "import sys, app; print('boto3' in sys.modules)")
+        self.assertEqual("False", _result.stdout.strip(), _result.stderr)
+
+    def test_local_startup_budget(self):
+        _result = _run_in_src("app.py", "--check", "--startup-report", "--port", "0")
+        self.assertEqual(0, _result.returncode, _result.stderr)
+
+        _line = next(line for line in _result.stderr.splitlines() if "Startup report: " in line)
+        _report = json.loads(_line.split("Startup report: ", 1)[1])
+        self.assertIn("import", _report["phases"])
+        self.assertIn("bind", _report["phases"])
+        self.assertLess(_report["total"], STARTUP_BUDGET, _report)
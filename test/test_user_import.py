@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import tracemalloc
+import unittest
+from src.libs.user_import import InvalidUserRecordException, detect_format, import_users, read_users
+from src.libs.user_store import MemoryUserStore, SQLiteUserStore
+from test.test_user_store import USERS, generate_users
+
+
+def write_ndjson(path: str, users):
+    with open(path, "w") as users_file:
+        for user_id, user in users:
+            users_file.write(json.dumps(dict(user, id=user_id)) + "\n")
+
+
+class TestUserImport(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self._dir.name, name)
+
+    def test_detect_format(self):
+        self.assertEqual("ndjson", detect_format("users.jsonl"))
+        self.assertEqual("csv", detect_format("USERS.CSV"))
+        with self.assertRaises(ValueError):
+            detect_format("users.xml")
+
+    def test_ndjson(self):
+        _path = self._path("users.ndjson")
+        write_ndjson(_path, USERS.items())
+
+        _store = MemoryUserStore()
+        _stats = import_users(_store, _path)
+        self.assertEqual(2, _stats.imported)
+        self.assertEqual(USERS["2"], _store.get_user("2").to_dict())
+
+    def test_csv(self):
+        _path = self._path("users.csv")
+        with open(_path, "w") as users_file:
+            users_file.write("id,first_name,last_name,username,icon,extra\n")
+            users_file.write('1,Dude,Duder,dudeduerson,default.png,x\n')
+            users_file.write('2,"Mike, Jr",Mikerson,reallycoolguy,default.png,y\n')
+
+        self.assertEqual([("1", USERS["1"]), ("2", dict(USERS["2"], first_name="Mike, Jr"))],
+                         list(read_users(_path)))
+
+    def test_invalid_record(self):
+        _path = self._path("users.ndjson")
+        with open(_path, "w") as users_file:
+            users_file.write(json.dumps(dict(USERS["1"], id="1")) + "\n")
+            users_file.write(json.dumps({"id": "2", "username": "nobody"}) + "\n")
+            users_file.write("not json\n")
+
+        with self.assertRaises(InvalidUserRecordException) as e:
+            import_users(MemoryUserStore(), _path)
+        self.assertEqual(2, e.exception.line_number)
+
+        _store = MemoryUserStore()
+        _stats = import_users(_store, _path, skip_invalid=True)
+        self.assertEqual(1, _stats.imported)
+        self.assertEqual(2, _stats.skipped)
+        self.assertEqual(1, _store.count())
+
+    def test_peak_memory_is_bounded(self):
+        # importing into SQLite holds one insert batch, however large the file
+        _peaks = []
+        for _count in (15000, 45000):
+            _path = self._path("users-{}.ndjson".format(_count))
+            write_ndjson(_path, generate_users(_count))
+            _store = SQLiteUserStore(self._path("users-{}.db".format(_count)))
+
+            tracemalloc.start()
+            try:
+                import_users(_store, _path)
+                _peaks.append(tracemalloc.get_traced_memory()[1])
+                self.assertEqual(_count, _store.count())
+            finally:
+                tracemalloc.stop()
+                _store.close()
+
+        self.assertLess(_peaks[1], _peaks[0] * 1.25)
@@ -0,0 +1,216 @@
+import os
+import tempfile
+import threading
+import unittest
+from src.libs.user_log import LoggedUserStore, UserExistsException, UserLogCorruptException, UserWriteLog
+from src.libs.user_log import persist_users
+from src.libs.user_snapshot import SnapshotUserStore, write_snapshot
+from src.libs.user_store import MemoryUserStore, SQLiteUserStore, UserRecord
+from test.test_user_store import USERS, generate_users
+
+
+class TestUserWriteLog(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "users.log")
+        self._log = UserWriteLog(self._path)
+        self._log.start()
+
+    def tearDown(self) -> None:
+        self._log.close()
+        self._dir.cleanup()
+
+    def _reopen(self) -> UserWriteLog:
+        self._log.close()
+        self._log = UserWriteLog(self._path)
+        self._log.start()
+        return self._log
+
+    def test_write(self):
+        _record = self._log.write("1", USERS["1"])
+        self.assertEqual(UserRecord("1", "Dude", "Duder", "dudeduerson", "default.png"), _record)
+        self.assertEqual(_record, self._log.users.get_user("1"))
+
+    def test_replay(self):
+        self._log.write("1", USERS["1"])
+        self._log.write("1", dict(USERS["1"], username="renamed"))
+        self._log.write("2", USERS["2"])
+
+        _log = self._reopen()
+        self.assertEqual(2, _log.users.count())
+        self.assertEqual("renamed", _log.users.get_user("1").username)
+        self.assertIsNone(_log.users.get_user_by_username("dudeduerson"))
+
+    def test_partial_record_is_truncated(self):
+        self._log.write("1", USERS["1"])
+        self._log.close()
+        _size = os.path.getsize(self._path)
+        with open(self._path, "ab") as log_file:
+            log_file.write(b'{"id": "2", "first_na')
+
+        _log = self._reopen()
+        self.assertEqual(1, _log.users.count())
+        self.assertEqual(_size, os.path.getsize(self._path))
+        _log.write("2", USERS["2"])
+        self.assertEqual(2, self._reopen().users.count())
+
+    def test_corrupt_record(self):
+        self._log.close()
+        with open(self._path, "ab") as log_file:
+            log_file.write(b'not json\n{"id": "1"}\n')
+
+        with self.assertRaises(UserLogCorruptException):
+            UserWriteLog(self._path)
+
+    def test_group_commit(self):
+        _threads = [threading.Thread(target=self._log.write, args=(str(i), USERS["1"])) for i in range(50)]
+        for _thread in _threads:
+            _thread.start()
+        for _thread in _threads:
+            _thread.join()
+
+        self.assertEqual(50, self._log.writes)
+        # writes queued while the log was syncing shared a sync
+        self.assertLessEqual(self._log.syncs, 50)
+        self.assertEqual(50, self._reopen().users.count())
+
+    def test_exclusive_write(self):
+        _exists = lambda user_id: self._log.users.get_user(user_id) is not None
+        self._log.write("1", USERS["1"], _exists)
+        with self.assertRaises(UserExistsException):
+            self._log.write("1", USERS["2"], _exists)
+        self.assertEqual("dudeduerson", self._log.users.get_user("1").username)
+
+    def test_concurrent_exclusive_writes(self):
+        # the user is only in the overlay once its write is synced, so the
+        # writes queued before then must be checked too
+        _exists = lambda user_id: self._log.users.get_user(user_id) is not None
+        _results = []
+
+        def _write(i):
+            try:
+                _results.append(self._log.write("1", dict(USERS["1"], username=str(i)), _exists))
+            except UserExistsException:
+                _results.append(None)
+
+        _threads = [threading.Thread(target=_write, args=(i,)) for i in range(20)]
+        for _thread in _threads:
+            _thread.start()
+        for _thread in _threads:
+            _thread.join()
+
+        _written = [_record for _record in _results if _record is not None]
+        self.assertEqual(1, len(_written))
+        self.assertEqual(_written[0], self._log.users.get_user("1"))
+        self.assertEqual(1, self._log.writes)
+
+    def test_closed(self):
+        self._log.close()
+        with self.assertRaises(OSError):
+            self._log.write("1", USERS["1"])
+
+    def test_compact_without_persist(self):
+        for _ in range(3):
+            self._log.write("1", USERS["1"])
+        self._log.write("2", USERS["2"])
+
+        # one record per user is kept
+        self.assertEqual(2, self._log.compact())
+        with open(self._path, "rb") as log_file:
+            self.assertEqual(2, len(log_file.readlines()))
+        self.assertEqual(2, self._log.users.count())
+
+    def test_compact(self):
+        self._log.write("1", USERS["1"])
+        _persisted = []
+
+        def _persist(users):
+            _persisted.extend(users)
+            # a write made while persisting stays in the log
+            self._log.write("2", USERS["2"])
+            return True
+
+        self.assertEqual(1, self._log.compact(_persist))
+        self.assertEqual(["1"], [_user.user_id for _user in _persisted])
+        self.assertIsNone(self._log.users.get_user("1"))
+        self.assertEqual(["2"], [_user.user_id for _user in self._reopen().users.iter_users()])
+
+    def test_failed_persist_keeps_writes(self):
+        self._log.write("1", USERS["1"])
+        self.assertEqual(1, self._log.compact(lambda users: 1 / 0))
+        self.assertEqual(1, self._reopen().users.count())
+
+
+class TestLoggedUserStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self._log = UserWriteLog(os.path.join(self._dir.name, "users.log"))
+        self._log.start()
+        self._store = LoggedUserStore(MemoryUserStore(generate_users(10)), self._log)
+
+    def tearDown(self) -> None:
+        self._log.close()
+        self._dir.cleanup()
+
+    def test_writes_are_read(self):
+        _version = self._store.version
+        self._store.add_users([("3", dict(USERS["1"], username="renamed")), ("new", USERS["2"])])
+
+        self.assertEqual("renamed", self._store.get_user("3").username)
+        self.assertEqual("3", self._store.get_user_by_username("renamed").user_id)
+        # the old username is no longer the user's
+        self.assertIsNone(self._store.get_user_by_username("user3"))
+        self.assertEqual("user4", self._store.get_user_by_username("user4").username)
+        self.assertEqual(11, self._store.count())
+        self.assertEqual(_version, self._store.version)
+
+    def test_iter_users(self):
+        self._store.add_users([("3", USERS["1"]), ("00", USERS["1"]), ("99", USERS["2"])])
+        _users = list(self._store.iter_users())
+        self.assertEqual(["0", "00", "1", "2", "3", "4", "5", "6", "7", "8", "9", "99"],
+                         [_user.user_id for _user in _users])
+        self.assertEqual("dudeduerson", _users[4].username)
+        self.assertEqual(["4", "5"], [_user.user_id for _user in self._store.iter_users("3")][:2])
+        self.assertEqual(["0", "00", "1"], [_user.user_id for _user in self._store.iter_users(limit=3)])
+        self.assertEqual(["9", "99"], [_user.user_id for _user in self._store.iter_users("8", 5)])
+
+    def test_close_keeps_the_log(self):
+        self._store.close()
+        self._log.write("1", USERS["1"])
+
+
+class TestPersistUsers(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self._users = [UserRecord("1", "New", "User", "newuser", "new.png"),
+                       UserRecord("zz", "Last", "User", "lastuser", "new.png")]
+
+    def tearDown(self) -> None:
+        self._dir.cleanup()
+
+    def test_sqlite(self):
+        _path = os.path.join(self._dir.name, "users.db")
+        _store = SQLiteUserStore(_path)
+        _store.add_users(generate_users(5))
+        _store.close()
+
+        self.assertTrue(persist_users("sqlite", _path, self._users))
+        _store = SQLiteUserStore(_path, read_only=True)
+        self.assertEqual(6, _store.count())
+        self.assertEqual(self._users[0], _store.get_user("1"))
+        _store.close()
+
+    def test_snapshot(self):
+        _path = os.path.join(self._dir.name, "users.snap")
+        write_snapshot(_path, generate_users(5))
+
+        self.assertTrue(persist_users("snapshot", _path, self._users))
+        _store = SnapshotUserStore(_path, verify=True)
+        self.assertEqual(6, _store.count())
+        self.assertEqual(self._users[0], _store.get_user("1"))
+        self.assertEqual("newuser", _store.get_user_by_username("newuser").username)
+        self.assertIsNone(_store.get_user_by_username("user1"))
+        _store.close()
+
+    def test_memory(self):
+        self.assertFalse(persist_users("memory", None, self._users))
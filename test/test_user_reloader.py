@@ -0,0 +1,186 @@
+import os
+import tempfile
+import threading
+import unittest
+from src.libs.user_reloader import ReaderEpochs, UserStoreReloader
+from src.libs.user_store import MemoryUserStore
+from test.test_user_store import USERS
+
+
+class MockStore(MemoryUserStore):
+    def __init__(self, users=None) -> None:
+        super().__init__(users)
+        self.closed = False
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class TestUserStoreReloader(unittest.TestCase):
+    def setUp(self) -> None:
+        self._loads = []
+        self._applied = []
+        self._store = MockStore(USERS.items())
+        self._readers = ReaderEpochs()
+        self._reloader = UserStoreReloader(load=self._load,
+                                           apply=self._applied.append,
+                                           store=self._store,
+                                           requests=self._readers,
+                                           drain_timeout=5)
+
+    def _load(self):
+        _store = self._loads.pop(0)
+        if isinstance(_store, Exception):
+            raise _store
+        return _store
+
+    def test_reload(self):
+        _new = MockStore(USERS.items())
+        self._loads.append(_new)
+
+        self.assertTrue(self._reloader.reload())
+        self.assertEqual([_new], self._applied)
+        self.assertIs(_new, self._reloader.store)
+        self.assertTrue(self._store.closed)
+        self.assertEqual(1, self._reloader.reloads)
+
+    def test_failed_reload_keeps_store(self):
+        self._loads.append(ValueError("bad users file"))
+
+        self.assertFalse(self._reloader.reload())
+        self.assertEqual([], self._applied)
+        self.assertFalse(self._store.closed)
+        self.assertEqual("bad users file", self._reloader.last_error)
+
+    def test_empty_store_rejected(self):
+        _empty = MockStore()
+        self._loads.append(_empty)
+
+        self.assertFalse(self._reloader.reload())
+        self.assertIs(self._store, self._reloader.store)
+        self.assertTrue(_empty.closed)
+
+    def test_old_store_closed_after_requests_finish(self):
+        self._loads.append(MockStore(USERS.items()))
+        _epoch = self._readers.enter()
+
+        _thread = threading.Thread(target=self._reloader.reload)
+        _thread.start()
+        _thread.join(0.2)
+        # the request started before the swap may still read the old store
+        self.assertFalse(self._store.closed)
+
+        self._readers.exit(_epoch)
+        _thread.join()
+        self.assertTrue(self._store.closed)
+
+    def test_close_failure_keeps_reloading(self):
+        _first = MockStore(USERS.items())
+        _second = MockStore(USERS.items())
+        self._loads.extend([_first, _second])
+        _applied = threading.Event()
+
+        def _close():
+            raise OSError("close failed")
+
+        def _apply(store):
+            self._applied.append(store)
+            _applied.set()
+
+        self._store.close = _close
+        self._reloader._apply = _apply
+        self._reloader.start()
+        try:
+            self._reloader.request_reload()
+            self.assertTrue(_applied.wait(5))
+            _applied.clear()
+            self._reloader.request_reload()
+            # the thread survived the failed close of the first store
+            self.assertTrue(_applied.wait(5))
+            self.assertEqual([_first, _second], self._applied)
+        finally:
+            self._reloader.stop()
+
+    def test_request_reload(self):
+        _new = MockStore(USERS.items())
+        self._loads.append(_new)
+        _applied = threading.Event()
+        self._reloader._apply = lambda store: _applied.set()
+
+        self._reloader.start()
+        self._reloader.request_reload()
+        self.assertTrue(_applied.wait(5))
+        self._reloader.stop()
+
+    def test_reloading(self):
+        _loading = threading.Event()
+        _release = threading.Event()
+
+        def _load():
+            _loading.set()
+            _release.wait(5)
+            return MockStore(USERS.items())
+
+        self._reloader._load = _load
+        self.assertFalse(self._reloader.reloading)
+        _thread = threading.Thread(target=self._reloader.reload)
+        _thread.start()
+        self.assertTrue(_loading.wait(5))
+        self.assertTrue(self._reloader.reloading)
+
+        _release.set()
+        _thread.join()
+        self.assertFalse(self._reloader.reloading)
+
+    def test_retry_after(self):
+        self.assertEqual(0.0, self._reloader.retry_after())
+
+        # failed reloads count, they cost as much as successful ones
+        self._loads.append(ValueError("bad users file"))
+        self._reloader.reload()
+        self.assertGreater(self._reloader.retry_after(), 9)
+
+        self._reloader.min_request_interval = 0
+        self.assertEqual(0.0, self._reloader.retry_after())
+
+    def test_changed(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "users.ndjson")
+            with open(_path, "w") as users_file:
+                users_file.write("\n")
+
+            _reloader = UserStoreReloader(load=self._load, apply=self._applied.append,
+                                          store=self._store, source=_path)
+            self.assertFalse(_reloader.changed())
+
+            with open(_path, "a") as users_file:
+                users_file.write("\n")
+            self.assertTrue(_reloader.changed())
+
+
+class TestReaderEpochs(unittest.TestCase):
+    def test_interleaved_requests(self):
+        _readers = ReaderEpochs()
+        # one thread, as an event loop is, starts two requests before either finishes
+        _first = _readers.enter()
+        _second = _readers.enter()
+        _ended = _readers.advance()
+        _third = _readers.enter()
+
+        _readers.exit(_second)
+        self.assertFalse(_readers.finished(_ended))
+
+        # requests starting after the advance can't read the old store
+        _readers.exit(_first)
+        self.assertTrue(_readers.finished(_ended))
+        self.assertFalse(_readers.finished(_third))
+
+    def test_earlier_epochs(self):
+        _readers = ReaderEpochs()
+        _first = _readers.enter()
+        _readers.advance()
+        _ended = _readers.advance()
+
+        self.assertFalse(_readers.finished(_ended))
+        _readers.exit(_first)
+        self.assertTrue(_readers.finished(_ended))
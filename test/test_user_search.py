@@ -0,0 +1,137 @@
+import threading
+import time
+import unittest
+from src.libs.user_search import InvalidCursorException, SearchIndexer, UserSearchIndex
+from src.libs.user_search import decode_cursor, encode_cursor
+from src.libs.user_store import MemoryUserStore
+from test.test_user_store import USERS, generate_users
+
+
+class TestUserSearchIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        self._store = MemoryUserStore(USERS.items())
+        self._store.add_users([
+            ("3", {"first_name": "Anna", "last_name": "Andrews", "username": "anna", "icon": ""}),
+            ("4", {"first_name": "Zoë", "last_name": "", "username": "ZOE", "icon": ""})
+        ])
+        self._index = UserSearchIndex(self._store)
+
+    def test_search(self):
+        self.assertEqual((["1"], None), self._index.search("dude", 10))
+        self.assertEqual((["2"], None), self._index.search("MIKER", 10))
+        self.assertEqual((["4"], None), self._index.search("zoë", 10))
+        self.assertEqual(([], None), self._index.search("nobody", 10))
+
+    def test_empty_names_are_skipped(self):
+        # Anna, Andrews and anna are indexed, Zoë's last name isn't
+        self.assertEqual(11, len(self._index))
+
+    def test_users_are_returned_once_per_page(self):
+        self.assertEqual((["3"], None), self._index.search("an", 10))
+
+    def test_pages(self):
+        _index = UserSearchIndex(MemoryUserStore(generate_users(1000)))
+        _found = []
+        _user_ids, _cursor = _index.search("user1", 30)
+        while True:
+            self.assertLessEqual(len(_user_ids), 30)
+            _found.extend(_user_ids)
+            if _cursor is None:
+                break
+            _user_ids, _cursor = _index.search("user1", 30, _cursor)
+
+        # user1, user10-19, user100-199
+        self.assertEqual(111, len(_found))
+        self.assertEqual(111, len(set(_found)))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(InvalidCursorException):
+            self._index.search("an", 10, "not a cursor!")
+        # a cursor from another prefix can't be reused
+        with self.assertRaises(InvalidCursorException):
+            self._index.search("an", 10, encode_cursor("dude", "1"))
+
+    def test_cursor(self):
+        self.assertEqual(("zoë", "4"), decode_cursor(encode_cursor("zoë", "4")))
+
+
+class TestSearchIndexer(unittest.TestCase):
+    def setUp(self) -> None:
+        # builds wait for the test to release them
+        self._release = threading.Event()
+        self._built = []
+
+        def _build(store):
+            self._release.wait(5)
+            if getattr(store, "broken", False):
+                raise ValueError("broken store")
+            self._built.append(store)
+            return UserSearchIndex(store)
+
+        self._indexer = SearchIndexer(build=_build)
+
+    def _wait_for_builds(self, builds:int) -> None:
+        _deadline = time.monotonic() + 5
+        while self._indexer.builds < builds and time.monotonic() < _deadline:
+            time.sleep(0.01)
+        self.assertEqual(builds, self._indexer.builds)
+
+    def test_built_in_the_background(self):
+        _store = MemoryUserStore(USERS.items())
+        self.assertIsNone(self._indexer.get(_store))
+        self.assertIsNone(self._indexer.get(_store))
+
+        self._release.set()
+        self._wait_for_builds(1)
+        self.assertEqual((["1"], None), self._indexer.get(_store).search("dude", 10))
+        # the store is only indexed once
+        self.assertEqual([_store], self._built)
+
+    def test_reloaded_store(self):
+        self._release.set()
+        _old = MemoryUserStore(USERS.items())
+        self._indexer.get(_old)
+        self._wait_for_builds(1)
+        _old_index = self._indexer.index
+
+        # the old index is searched until the new store is indexed
+        self._release.clear()
+        _new = MemoryUserStore(USERS.items())
+        self.assertIs(_old_index, self._indexer.get(_new))
+        self._release.set()
+        self._wait_for_builds(2)
+        self.assertIsNot(_old_index, self._indexer.get(_new))
+
+    def test_new_version(self):
+        self._release.set()
+        _store = MemoryUserStore(USERS.items())
+        self._indexer.get(_store)
+        self._wait_for_builds(1)
+
+        # the same store is indexed again once its users change
+        _store.add_users([("3", {"first_name": "Anna", "last_name": "", "username": "anna", "icon": ""})])
+        self._indexer.get(_store)
+        self._wait_for_builds(2)
+        self.assertEqual((["3"], None), self._indexer.get(_store).search("anna", 10))
+
+        # or when the caller's version changes
+        self._indexer.get(_store, "written")
+        self._wait_for_builds(3)
+        self.assertIs(self._indexer.index, self._indexer.get(_store, "written"))
+
+    def test_failed_build(self):
+        self._release.set()
+        _store = MemoryUserStore(USERS.items())
+        _store.broken = True
+        self._indexer.get(_store)
+        _deadline = time.monotonic() + 5
+        while self._indexer.last_error is None and time.monotonic() < _deadline:
+            time.sleep(0.01)
+        self.assertEqual("broken store", self._indexer.last_error)
+
+        # the next search tries again
+        _store.broken = False
+        _deadline = time.monotonic() + 5
+        while self._indexer.get(_store) is None and time.monotonic() < _deadline:
+            time.sleep(0.01)
+        self.assertEqual(1, self._indexer.builds)
@@ -0,0 +1,416 @@
+import gzip
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.client import HTTPConnection
+from unittest import mock
+
+# user_service uses the flat imports of src/, as it does when app.py runs it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import user_service
+from app_config import AppConfig
+from libs.async_server import AsyncHTTPServer
+from libs.servers import ThreadPoolHTTPServer
+from libs.profiling import profiler
+from libs.user_log import LoggedUserStore, UserWriteLog
+from libs.user_reloader import UserStoreReloader
+from libs.user_search import SearchIndexer
+from libs.user_store import create_user_store
+
+
+class UserServiceTestCase(unittest.TestCase):
+    """Serves UserService on a live ThreadPoolHTTPServer"""
+    # settings, as environment variables, the service is configured with
+    settings = {}
+    threads = 2
+
+    def setUp(self) -> None:
+        with mock.patch.dict(os.environ, self.settings):
+            user_service.config = AppConfig()
+        user_service.user_store = create_user_store("memory", default_users=user_service.UserService._user_map)
+        user_service.response_cache = None
+        user_service.search_indexer = None
+        user_service.write_log = None
+
+        self._server = self._start_server()
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.start()
+
+    def tearDown(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def _start_server(self):
+        """Returns the server the service is run on"""
+        return ThreadPoolHTTPServer(("127.0.0.1", 0), user_service.UserService,
+                                    threads=self.threads, probe_paths=user_service.PROBE_PATHS)
+
+    def _request(self, method:str, path:str, body:bytes=None, headers:dict=None) -> tuple:
+        """Returns the status, headers and body of a response"""
+        _conn = HTTPConnection(*self._server.server_address, timeout=5)
+        try:
+            _conn.request(method, path, body=body, headers=headers or {})
+            _response = _conn.getresponse()
+            return _response.status, _response, _response.read()
+        finally:
+            _conn.close()
+
+
+class TestProbes(UserServiceTestCase):
+    def test_health(self):
+        self.assertEqual((200, b'{"status": "ok"}'), self._request("GET", "/health")[::2])
+
+    def test_ready(self):
+        _status, _, _body = self._request("GET", "/ready")
+        self.assertEqual(200, _status)
+        self.assertEqual("ready", json.loads(_body)["status"])
+
+    def test_query_string(self):
+        self.assertEqual(200, self._request("GET", "/health?x=1")[0])
+        self.assertEqual(200, self._request("GET", "/ready?check=alb")[0])
+
+    def test_not_ready_while_draining(self):
+        user_service.draining = True
+        self.addCleanup(setattr, user_service, "draining", False)
+        _status, _, _body = self._request("GET", "/ready")
+        self.assertEqual(503, _status)
+        self.assertFalse(json.loads(_body)["checks"]["serving"])
+
+
+class TestGetUser(UserServiceTestCase):
+    def test_user(self):
+        _status, _response, _body = self._request("GET", "/user/1")
+        self.assertEqual(200, _status)
+        self.assertEqual("dudeduerson", json.loads(_body)["username"])
+        self.assertIsNotNone(_response.getheader("ETag"))
+        self.assertEqual(404, self._request("GET", "/user/nobody")[0])
+
+    def test_head(self):
+        _status, _response, _body = self._request("HEAD", "/user/1")
+        self.assertEqual(200, _status)
+        self.assertEqual(b"", _body)
+        self.assertNotEqual("0", _response.getheader("Content-Length"))
+
+    def test_not_modified(self):
+        _, _response, _ = self._request("GET", "/user/1")
+        _status, _, _body = self._request("GET", "/user/1", headers={"If-None-Match": _response.getheader("ETag")})
+        self.assertEqual((304, b""), (_status, _body))
+
+        _since = {"If-Modified-Since": _response.getheader("Last-Modified")}
+        self.assertEqual(304, self._request("GET", "/user/1", headers=_since)[0])
+        # If-None-Match wins over If-Modified-Since
+        _since["If-None-Match"] = '"stale"'
+        self.assertEqual(200, self._request("GET", "/user/1", headers=_since)[0])
+
+
+class TestBatch(UserServiceTestCase):
+    def test_query(self):
+        _status, _, _body = self._request("GET", "/users?ids=1,nobody")
+        self.assertEqual(200, _status)
+        _items = json.loads(_body)
+        self.assertEqual("dudeduerson", _items[0]["user"]["username"])
+        self.assertEqual({"id": "nobody", "error": "user not found"}, _items[1])
+
+    def test_body(self):
+        _status, _, _body = self._request("POST", "/users/batch", body=b'{"ids": ["2", "1"]}')
+        self.assertEqual(200, _status)
+        self.assertEqual(["2", "1"], [_item["id"] for _item in json.loads(_body)])
+
+    def test_invalid(self):
+        self.assertEqual(400, self._request("POST", "/users/batch", body=b"[]")[0])
+        self.assertEqual(400, self._request("POST", "/users/batch", body=b'{"ids": []}')[0])
+        self.assertEqual(400, self._request("GET", "/users?ids=")[0])
+
+
+class TestSearch(UserServiceTestCase):
+    def test_disabled(self):
+        _status, _, _body = self._request("GET", "/users/search?prefix=dude")
+        self.assertEqual((503, b"user search is not enabled"), (_status, _body))
+
+    def test_search(self):
+        user_service.search_indexer = SearchIndexer()
+
+        # the first search starts building the index
+        _status, _response, _ = self._request("GET", "/users/search?prefix=dude")
+        self.assertEqual(503, _status)
+        self.assertEqual("5", _response.getheader("Retry-After"))
+
+        _deadline = time.monotonic() + 5
+        while _status == 503 and time.monotonic() < _deadline:
+            time.sleep(0.01)
+            _status, _, _body = self._request("GET", "/users/search?prefix=dude")
+        self.assertEqual(200, _status)
+        self.assertEqual(["1"], [_user["id"] for _user in json.loads(_body)["users"]])
+        self.assertEqual(400, self._request("GET", "/users/search")[0])
+
+
+class TestWrites(UserServiceTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        user_service.write_log = UserWriteLog(os.path.join(self._dir.name, "users.log"))
+        user_service.write_log.start()
+        self.addCleanup(user_service.write_log.close)
+        user_service.user_store = LoggedUserStore(user_service.user_store, user_service.write_log)
+
+    def _user(self, user_id:str=None, username:str="newuser") -> bytes:
+        _user = {"first_name": "New", "last_name": "User", "username": username, "icon": "new.png"}
+        if user_id is not None:
+            _user["id"] = user_id
+        return bytes(json.dumps(_user), "utf-8")
+
+    def test_create(self):
+        _status, _response, _body = self._request("POST", "/user", body=self._user("new"))
+        self.assertEqual(201, _status)
+        self.assertEqual("/user/new", _response.getheader("Location"))
+        self.assertEqual("newuser", json.loads(self._request("GET", "/user/new")[2])["username"])
+
+        self.assertEqual(409, self._request("POST", "/user", body=self._user("new"))[0])
+
+    def test_concurrent_creates(self):
+        _statuses = []
+        _threads = [threading.Thread(target=lambda i=i: _statuses.append(
+            self._request("POST", "/user", body=self._user("new", username="user{}".format(i)))[0]))
+            for i in range(self.threads * 2)]
+        for _thread in _threads:
+            _thread.start()
+        for _thread in _threads:
+            _thread.join()
+
+        self.assertEqual([201] + [409] * (len(_threads) - 1), sorted(_statuses))
+
+    def test_written_users_are_searched(self):
+        user_service.search_indexer = SearchIndexer()
+        self._wait_for_search("dude", ["1"])
+
+        self.assertEqual(201, self._request("POST", "/user", body=self._user("new", username="searchable"))[0])
+        self._wait_for_search("searchable", ["new"])
+
+    def _wait_for_search(self, prefix:str, user_ids:list) -> None:
+        """Searches until the index has caught up with the writes"""
+        _found = None
+        _deadline = time.monotonic() + 5
+        while _found != user_ids and time.monotonic() < _deadline:
+            _status, _, _body = self._request("GET", "/users/search?prefix=" + prefix)
+            if _status == 200:
+                _found = [_user["id"] for _user in json.loads(_body)["users"]]
+            if _found != user_ids:
+                time.sleep(0.01)
+        self.assertEqual(user_ids, _found)
+
+    def test_generated_id(self):
+        _status, _response, _ = self._request("POST", "/user", body=self._user())
+        self.assertEqual(201, _status)
+        self.assertEqual(200, self._request("GET", _response.getheader("Location"))[0])
+
+    def test_put(self):
+        self.assertEqual(201, self._request("PUT", "/user/new", body=self._user())[0])
+        self.assertEqual(200, self._request("PUT", "/user/1", body=self._user(username="renamed"))[0])
+        self.assertEqual("renamed", json.loads(self._request("GET", "/user/1")[2])["username"])
+
+    def test_invalid(self):
+        self.assertEqual(400, self._request("PUT", "/user/new", body=b"not json")[0])
+        self.assertEqual(400, self._request("PUT", "/user/new", body=self._user("4"))[0])
+
+    def test_disabled(self):
+        user_service.write_log = None
+        self.assertEqual(503, self._request("PUT", "/user/new", body=self._user())[0])
+
+
+# the admin token the admin tests configure, and the header which carries it
+ADMIN_TOKEN = "test-admin-token-0123456789"
+ADMIN_HEADERS = {"Authorization": "Bearer " + ADMIN_TOKEN}
+
+
+class TestAdmin(UserServiceTestCase):
+    settings = {"ADMIN_TOKEN": ADMIN_TOKEN}
+
+    def test_token_required(self):
+        _status, _response, _ = self._request("GET", "/admin/config")
+        self.assertEqual(401, _status)
+        self.assertEqual('Bearer realm="admin"', _response.getheader("WWW-Authenticate"))
+        self.assertEqual(401, self._request("GET", "/admin/config",
+                                            headers={"Authorization": "Bearer wrong"})[0])
+        self.assertEqual(401, self._request("GET", "/admin/traces",
+                                            headers={"Authorization": "Basic " + ADMIN_TOKEN})[0])
+        # unknown admin paths aren't revealed either
+        self.assertEqual(401, self._request("GET", "/admin/nothing")[0])
+
+    def test_token(self):
+        _status, _, _body = self._request("GET", "/admin/config", headers=ADMIN_HEADERS)
+        self.assertEqual(200, _status)
+        self.assertEqual(user_service.config.version, json.loads(_body)["version"])
+        self.assertEqual(404, self._request("GET", "/admin/nothing", headers=ADMIN_HEADERS)[0])
+
+    def test_disabled(self):
+        user_service.config.admin_token = None
+        _status, _, _body = self._request("GET", "/admin/config", headers=ADMIN_HEADERS)
+        self.assertEqual((503, b"admin routes are not enabled"), (_status, _body))
+
+
+class TestReloadUsers(UserServiceTestCase):
+    settings = {"ADMIN_TOKEN": ADMIN_TOKEN}
+
+    def setUp(self) -> None:
+        super().setUp()
+        self._loading = threading.Event()
+        self._release = threading.Event()
+        self.addCleanup(self._release.set)
+
+        def _load():
+            self._loading.set()
+            self._release.wait(5)
+            return create_user_store("memory", default_users=user_service.UserService._user_map)
+
+        def _apply(store):
+            user_service.user_store = store
+
+        user_service.users_reloader = UserStoreReloader(load=_load, apply=_apply, store=user_service.user_store)
+        user_service.users_reloader.start()
+        self.addCleanup(setattr, user_service, "users_reloader", None)
+        self.addCleanup(user_service.users_reloader.stop)
+
+    def test_token_required(self):
+        self.assertEqual(401, self._request("POST", "/admin/reload-users")[0])
+        self.assertFalse(self._loading.is_set())
+
+    def test_one_reload_at_a_time(self):
+        self.assertEqual(202, self._request("POST", "/admin/reload-users", headers=ADMIN_HEADERS)[0])
+        self.assertTrue(self._loading.wait(5))
+        self.assertEqual(409, self._request("POST", "/admin/reload-users", headers=ADMIN_HEADERS)[0])
+
+        self._release.set()
+        _deadline = time.monotonic() + 5
+        while user_service.users_reloader.reloading and time.monotonic() < _deadline:
+            time.sleep(0.01)
+
+        # a reload which has just run isn't repeated straight away
+        _status, _response, _ = self._request("POST", "/admin/reload-users", headers=ADMIN_HEADERS)
+        self.assertEqual(429, _status)
+        self.assertEqual("10", _response.getheader("Retry-After"))
+        self.assertEqual(1, user_service.users_reloader.reloads)
+
+
+class TestAsyncProfile(UserServiceTestCase):
+    settings = {"PROFILING_ENABLED": "on", "PROFILING_INTERVAL": "0.01", "ADMIN_TOKEN": ADMIN_TOKEN}
+
+    def _start_server(self):
+        return AsyncHTTPServer(("127.0.0.1", 0), user_service.UserService.handle_request,
+                               blocking_paths=user_service.BLOCKING_PATHS,
+                               probe_paths=user_service.PROBE_PATHS)
+
+    def tearDown(self) -> None:
+        self._server.shutdown()
+        self._thread.join()
+        self._server.server_close()
+
+    def test_probes_answered_while_profiling(self):
+        _profile = []
+        _thread = threading.Thread(target=lambda: _profile.append(
+            self._request("GET", "/admin/profile?seconds=2", headers=ADMIN_HEADERS)))
+        _thread.start()
+        _deadline = time.monotonic() + 5
+        while not profiler.running and time.monotonic() < _deadline:
+            time.sleep(0.01)
+        self.assertTrue(profiler.running)
+
+        # the profile runs off the event loop
+        _start = time.monotonic()
+        self.assertEqual(200, self._request("GET", "/health")[0])
+        self.assertEqual(200, self._request("GET", "/user/1")[0])
+        self.assertLess(time.monotonic() - _start, 1)
+        self.assertTrue(profiler.running)
+
+        _thread.join()
+        self.assertEqual(200, _profile[0][0])
+
+
+class TestRequestTimeout(UserServiceTestCase):
+    settings = {"SERVER_REQUEST_TIMEOUT": "1"}
+
+    def test_idle_connections_are_dropped(self):
+        # a client for every worker, none of which sends a request
+        _idle = [socket.create_connection(self._server.server_address, timeout=5) for _ in range(self.threads)]
+        try:
+            _start = time.monotonic()
+            _status, _, _body = self._request("GET", "/user/1")
+            self.assertEqual(200, _status)
+            self.assertLess(time.monotonic() - _start, 4)
+
+            for _sock in _idle:
+                self.assertEqual(b"", _sock.recv(1024))
+        finally:
+            for _sock in _idle:
+                _sock.close()
+
+
+class TestListUsers(UserServiceTestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        user_service.user_store.add_users(
+            ("user{:02}".format(i), {"username": "user{:02}".format(i)}) for i in range(20))
+        # pages are sent in several chunks
+        _chunk_size = mock.patch.object(user_service.UserService, "_list_chunk_size", 3)
+        _chunk_size.start()
+        self.addCleanup(_chunk_size.stop)
+
+    def test_pages(self):
+        _ids = []
+        _path = "/users?limit=7"
+        while True:
+            _status, _, _body = self._request("GET", _path)
+            self.assertEqual(200, _status)
+            _page = json.loads(_body)
+            self.assertLessEqual(len(_page["users"]), 7)
+            _ids.extend(_user["id"] for _user in _page["users"])
+            if _page["next_cursor"] is None:
+                break
+            _path = "/users?limit=7&cursor=" + _page["next_cursor"]
+
+        self.assertEqual(sorted(user_service.UserService._user_map) +
+                         ["user{:02}".format(i) for i in range(20)], _ids)
+
+    def test_last_page_has_no_cursor(self):
+        # a page which ends on the last user doesn't hand out a cursor
+        _status, _, _body = self._request("GET", "/users?limit=23")
+        self.assertEqual(23, len(json.loads(_body)["users"]))
+        self.assertIsNone(json.loads(_body)["next_cursor"])
+
+    def test_invalid_limit(self):
+        self.assertEqual(400, self._request("GET", "/users?limit=0")[0])
+        self.assertEqual(400, self._request("GET", "/users?cursor=nonsense!")[0])
+
+    def test_chunked(self):
+        _status, _response, _body = self._request("GET", "/users?limit=23")
+        self.assertEqual("chunked", _response.getheader("Transfer-Encoding"))
+        self.assertEqual(23, len(json.loads(_body)["users"]))
+
+    def test_http_1_0(self):
+        # HTTP/1.0 has no chunked encoding, so the body ends with the connection
+        with socket.create_connection(self._server.server_address, timeout=5) as _sock:
+            _sock.sendall(b"GET /users?limit=23 HTTP/1.0\r\n\r\n")
+            _response = b""
+            while True:
+                _data = _sock.recv(65536)
+                if not _data:
+                    break
+                _response += _data
+        _head, _, _body = _response.partition(b"\r\n\r\n")
+        self.assertTrue(_head.startswith(b"HTTP/1.0 200"))
+        self.assertNotIn(b"Transfer-Encoding", _head)
+        self.assertEqual(23, len(json.loads(_body)["users"]))
+
+    def test_compressed(self):
+        _status, _response, _body = self._request("GET", "/users?limit=23", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(200, _status)
+        self.assertEqual("gzip", _response.getheader("Content-Encoding"))
+        self.assertEqual("Accept-Encoding", _response.getheader("Vary"))
+        self.assertEqual(23, len(json.loads(gzip.decompress(_body))["users"]))
@@ -0,0 +1,112 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from src.libs import user_snapshot
+from src.libs.user_snapshot import SnapshotUserStore, SnapshotWriter, write_snapshot
+from src.libs.user_store import UserRecord, create_user_store
+from test.test_user_store import USERS, generate_users
+
+
+class TestUserSnapshot(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "users.snap")
+        write_snapshot(self._path, list(USERS.items()) + list(generate_users(1000)))
+        self._store = SnapshotUserStore(self._path, verify=True)
+
+    def tearDown(self) -> None:
+        self._store.close()
+        self._dir.cleanup()
+
+    def test_get_user(self):
+        # ids 1 and 2 were replaced by the generated users
+        self.assertEqual(1000, self._store.count())
+        self.assertEqual(UserRecord("999", "First499", "Last999", "user999", "default.png"),
+                         self._store.get_user("999"))
+        self.assertEqual("user1", self._store.get_user("1").username)
+        self.assertIsNone(self._store.get_user("1000"))
+        self.assertIsNone(self._store.get_user(""))
+
+    def test_get_user_by_username(self):
+        self.assertEqual("500", self._store.get_user_by_username("user500").user_id)
+        self.assertIsNone(self._store.get_user_by_username("dudeduerson"))
+
+    def test_unicode(self):
+        _path = os.path.join(self._dir.name, "unicode.snap")
+        write_snapshot(_path, [("ü", dict(USERS["1"], first_name="Zoë")), ("z", USERS["2"])])
+        _store = SnapshotUserStore(_path)
+        self.assertEqual("Zoë", _store.get_user("ü").first_name)
+        self.assertEqual("z", _store.get_user("z").user_id)
+        _store.close()
+
+    def test_iter_users(self):
+        _ids = [_user.user_id for _user in self._store.iter_users()]
+        self.assertEqual(sorted(str(i) for i in range(1000)), _ids)
+        self.assertEqual(UserRecord("100", "First100", "Last100", "user100", "default.png"),
+                         next(self._store.iter_users("10")))
+        self.assertEqual("11", next(self._store.iter_users("109")).user_id)
+        self.assertEqual([], list(self._store.iter_users("999")))
+        self.assertEqual(["11", "110"], [_user.user_id for _user in self._store.iter_users("109", 2)])
+
+    def test_read_only(self):
+        with self.assertRaises(NotImplementedError):
+            self._store.add_users(USERS.items())
+
+    def test_checksum(self):
+        with open(self._path, "r+b") as snapshot_file:
+            snapshot_file.seek(-1, os.SEEK_END)
+            _last = snapshot_file.read(1)
+            snapshot_file.seek(-1, os.SEEK_END)
+            snapshot_file.write(bytes([_last[0] ^ 0xFF]))
+
+        # opening only checks the header
+        SnapshotUserStore(self._path).close()
+        with self.assertRaises(ValueError):
+            SnapshotUserStore(self._path, verify=True)
+
+    def test_invalid_files(self):
+        _path = os.path.join(self._dir.name, "bad.snap")
+        with open(_path, "wb") as snapshot_file:
+            snapshot_file.write(b"not a snapshot" * 10)
+        with self.assertRaises(ValueError):
+            SnapshotUserStore(_path)
+
+        with open(self._path, "rb") as snapshot_file:
+            _data = snapshot_file.read()
+        with open(_path, "wb") as snapshot_file:
+            snapshot_file.write(_data[:-10])
+        with self.assertRaises(ValueError):
+            SnapshotUserStore(_path)
+
+    def test_abort(self):
+        _path = os.path.join(self._dir.name, "aborted.snap")
+        _writer = SnapshotWriter(_path)
+        _writer.add_users(USERS.items())
+        _writer.abort()
+        _writer.close()
+        self.assertFalse(os.path.exists(_path))
+
+    @mock.patch.object(user_snapshot, "CLOSE_RETRY_INTERVAL", 0.05)
+    def test_close_while_read(self):
+        # a reader part way through decoding a record holds a slice of the mapping
+        _slice = self._store._records[0:2]
+
+        self._store.close()
+        self.assertFalse(self._store._mmap.closed)
+        self.assertEqual("1", self._store.get_user("1").user_id)
+
+        _slice.release()
+        _deadline = time.monotonic() + 5
+        while not self._store._mmap.closed and time.monotonic() < _deadline:
+            time.sleep(0.01)
+        self.assertTrue(self._store._mmap.closed)
+
+    def test_create_user_store(self):
+        _store = create_user_store("snapshot", source=self._path)
+        self.assertEqual(1000, _store.count())
+        _store.close()
+
+        with self.assertRaises(ValueError):
+            create_user_store("snapshot")
@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+from src.libs.user_store import MemoryUserStore, SQLiteUserStore, UserRecord
+from src.libs.user_store import create_user_store, read_users_file
+
+USERS = {
+    "1": {
+        "first_name": "Dude",
+        "last_name": "Duder",
+        "username": "dudeduerson",
+        "icon": "default.png"
+    },
+    "2": {
+        "first_name": "Mike",
+        "last_name": "Mikerson",
+        "username": "reallycoolguy",
+        "icon": "default.png"
+    }
+}
+
+
+def generate_users(count: int):
+    for i in range(count):
+        yield str(i), {
+            "first_name": "First{}".format(i % 500),
+            "last_name": "Last{}".format(i % 2000),
+            "username": "user{}".format(i),
+            "icon": "default.png"
+        }
+
+
+class TestMemoryUserStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self._store = MemoryUserStore(USERS.items())
+
+    def test_get_user(self):
+        _user = self._store.get_user("1")
+        self.assertEqual("dudeduerson", _user.username)
+        self.assertEqual(USERS["1"], _user.to_dict())
+
+    def test_get_missing_user(self):
+        self.assertIsNone(self._store.get_user("99"))
+
+    def test_get_user_by_username(self):
+        self.assertEqual("2", self._store.get_user_by_username("reallycoolguy").user_id)
+        self.assertIsNone(self._store.get_user_by_username("nobody"))
+
+    def test_replace_user(self):
+        self._store.add_users([("1", dict(USERS["1"], username="renamed"))])
+        self.assertEqual(2, self._store.count())
+        self.assertIsNone(self._store.get_user_by_username("dudeduerson"))
+        self.assertEqual("1", self._store.get_user_by_username("renamed").user_id)
+
+    def test_modified_at(self):
+        _modified_at = self._store.modified_at
+        self.assertGreater(_modified_at, 0)
+
+        self._store.add_users([("1", USERS["1"])])
+        self.assertGreaterEqual(self._store.modified_at, _modified_at)
+
+    def test_strings_are_shared(self):
+        self.assertIs(self._store.get_user("1").icon, self._store.get_user("2").icon)
+
+    def test_iter_users(self):
+        _store = MemoryUserStore(generate_users(30))
+        _ids = [_user.user_id for _user in _store.iter_users()]
+        self.assertEqual(sorted(_ids), _ids)
+        self.assertEqual(30, len(_ids))
+        self.assertEqual(["27", "28", "29", "3", "4"], [_user.user_id for _user in _store.iter_users("26")][:5])
+
+        # users added after a walk are seen by the next one
+        _store.add_users([("271", USERS["1"])])
+        self.assertEqual("271", next(_store.iter_users("27")).user_id)
+
+    def test_iter_users_limit(self):
+        _store = MemoryUserStore(generate_users(30))
+        self.assertEqual(["27", "28"], [_user.user_id for _user in _store.iter_users("26", 2)])
+        self.assertEqual(30, len(list(_store.iter_users(limit=100))))
+
+    def test_memory_per_user_is_bounded(self):
+        _store = MemoryUserStore(generate_users(20000))
+        self.assertEqual(20000, _store.count())
+        self.assertLess(_store.bytes_per_user(), 400)
+
+
+class TestSQLiteUserStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self._dir = tempfile.TemporaryDirectory()
+        self._path = os.path.join(self._dir.name, "users.db")
+        self._store = SQLiteUserStore(self._path)
+        self._store.add_users(USERS.items())
+
+    def tearDown(self) -> None:
+        self._store.close()
+        self._dir.cleanup()
+
+    def test_get_user(self):
+        self.assertEqual(UserRecord("1", "Dude", "Duder", "dudeduerson", "default.png"),
+                         self._store.get_user("1"))
+        self.assertIsNone(self._store.get_user("99"))
+
+    def test_get_user_by_username(self):
+        self.assertEqual("2", self._store.get_user_by_username("reallycoolguy").user_id)
+
+    def test_count(self):
+        # ids 1 and 2 are replaced rather than added
+        self.assertEqual(25, self._store.add_users(generate_users(25)))
+        self.assertEqual(25, self._store.count())
+
+    def test_iter_users(self):
+        self._store.BATCH_SIZE = 7
+        self._store.add_users(generate_users(25))
+        _ids = [_user.user_id for _user in self._store.iter_users()]
+        self.assertEqual(sorted(str(i) for i in range(25)), _ids)
+        self.assertEqual(["3", "4"], [_user.user_id for _user in self._store.iter_users("24")][:2])
+        self.assertEqual([], list(self._store.iter_users("9")))
+
+    def test_iter_users_limit(self):
+        self._store.BATCH_SIZE = 7
+        self._store.add_users(generate_users(25))
+        _limits = []
+        self._store._connection().set_trace_callback(_limits.append)
+
+        self.assertEqual(["11", "12", "13", "14", "15", "16", "17", "18", "19"],
+                         [_user.user_id for _user in self._store.iter_users("10", 9)])
+        # the rows past the limit aren't read
+        self.assertEqual(2, len(_limits))
+        self.assertTrue(_limits[1].endswith("LIMIT 2"))
+
+    def test_close_every_connection(self):
+        _connections = [self._store._connection()]
+        _thread = threading.Thread(target=lambda: _connections.append(self._store._connection()))
+        _thread.start()
+        _thread.join()
+
+        self._store.close()
+        for _conn in _connections:
+            with self.assertRaises(sqlite3.ProgrammingError):
+                _conn.execute("SELECT 1")
+
+    def test_read_only(self):
+        _store = SQLiteUserStore(self._path, read_only=True)
+        self.assertEqual("Mike", _store.get_user("2").first_name)
+        _store.close()
+
+
+class TestCreateUserStore(unittest.TestCase):
+    def test_default_users(self):
+        _store = create_user_store("memory", default_users=USERS)
+        self.assertEqual(2, _store.count())
+
+    def test_users_file(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "users.ndjson")
+            with open(_path, "w") as users_file:
+                for user_id, user in USERS.items():
+                    users_file.write(json.dumps(dict(user, id=user_id)) + "\n")
+
+            self.assertEqual(["1", "2"], [user_id for user_id, _ in read_users_file(_path)])
+            _store = create_user_store("memory", source=_path)
+            self.assertEqual("Mikerson", _store.get_user("2").last_name)
+
+    def test_bad_users_file(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _path = os.path.join(_dir, "users.ndjson")
+            with open(_path, "w") as users_file:
+                users_file.write('{"username": "no-id"}\n')
+
+            with self.assertRaises(ValueError):
+                create_user_store("memory", source=_path)
+
+    def test_max_bytes(self):
+        self.assertEqual(2, create_user_store("memory", default_users=USERS, max_bytes=1048576).count())
+        with self.assertRaises(ValueError):
+            create_user_store("memory", default_users=USERS, max_bytes=100)
+
+    def test_sqlite_requires_source(self):
+        with self.assertRaises(ValueError):
+            create_user_store("sqlite")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_user_store("bad-backend")